@@ -0,0 +1,355 @@
+import argparse
+import ast
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Any
+from python_call_trace import PythonCallTrace, SUMMARY_MODES
+from exporters import export_graph
+from trace_cache import DefinitionCache
+
+# Named program shapes; every parameter of generate_program may be set
+SCENARIOS: Dict[str, Dict[str, int]] = {
+    "small": {"functions": 50, "fan_out": 2, "depth": 4},
+    "wide": {"functions": 400, "fan_out": 6, "depth": 3},
+    "deep": {"functions": 400, "fan_out": 1, "depth": 400},
+    "classes": {"functions": 100, "fan_out": 2, "depth": 4, "class_depth": 30},
+    "nested": {"functions": 100, "fan_out": 2, "depth": 4, "nesting": 4},
+    "large": {"functions": 2000, "fan_out": 2, "depth": 8, "statements": 20},
+}
+
+# Program the definition cache is measured on
+CACHE_SCENARIO: Dict[str, int] = {"functions": 300, "fan_out": 3, "depth": 6, "class_depth": 3, "nesting": 2}
+
+# Metrics compared against a baseline as ratios; counts must match exactly
+TIMED_METRICS = ("parse_seconds", "simulate_seconds", "export_seconds", "builder_seconds")
+MEMORY_METRICS = ("peak_memory", "peak_rss")
+COUNT_METRICS = ("nodes", "edges", "visits")
+
+
+def generate_program(
+    functions: int = 50,
+    fan_out: int = 2,
+    depth: int = 4,
+    class_depth: int = 0,
+    nesting: int = 0,
+    statements: int = 0,
+    seed: int = 0,
+) -> str:
+    """Source of a synthetic program with a `main` entry point.
+
+    Functions are split into ``depth`` levels; each function calls
+    ``fan_out`` functions of the next level and the last level only prints.
+    Every call is wrapped in ``nesting`` alternating if/for blocks and each
+    function is padded with ``statements`` plain assignments to grow the
+    file. ``class_depth`` adds a single-inheritance chain of that many
+    classes whose constructors call ``super().__init__()``.
+    """
+    rng = random.Random(seed)
+    depth = max(1, min(depth, functions))
+    levels: List[List[str]] = [[] for _ in range(depth)]
+    for i in range(functions):
+        levels[i * depth // functions].append(f"func_{i}")
+
+    def calls(targets: List[str], indent: str) -> List[str]:
+        lines = []
+        for target in targets:
+            prefix = indent
+            for level in range(nesting):
+                if level % 2 == 0:
+                    lines.append(f"{prefix}if value > {level}:")
+                else:
+                    lines.append(f"{prefix}for item in range({level + 1}):")
+                prefix += "    "
+            lines.append(f"{prefix}{target}()")
+        return lines
+
+    lines = []
+    for level, names in enumerate(levels):
+        for name in names:
+            lines.append(f"def {name}():")
+            lines.append("    value = 0")
+            lines += [f"    value_{j} = value + {j}" for j in range(statements)]
+            if level + 1 < depth:
+                lines += calls(rng.choices(levels[level + 1], k=fan_out), "    ")
+            else:
+                lines.append(f"    print('{name}')")
+            lines.append("")
+
+    for i in range(class_depth):
+        base = f"(Class_{i - 1})" if i else ""
+        lines.append(f"class Class_{i}{base}:")
+        lines.append("    def __init__(self):")
+        if i:
+            lines.append("        super().__init__()")
+        lines.append("        value = 0")
+        lines += calls([rng.choice(levels[-1])], "        ")
+        lines.append("")
+
+    lines.append("def main():")
+    lines.append("    value = 0")
+    if class_depth:
+        lines.append(f"    instance = Class_{class_depth - 1}()")
+    lines += calls(levels[0], "    ")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def best_time(function, repeat: int) -> float:
+    """Fastest of `repeat` runs, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def traced_rss(path: str, summary_mode: str, low_memory: bool) -> int:
+    """Peak resident set size in bytes of a process that traced path;
+    runs in a fresh worker process"""
+    PythonCallTrace(summary_mode=summary_mode, low_memory=low_memory).analyze_file(path)
+    try:
+        # Unlike ru_maxrss, the high-water mark is not inherited across exec
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def run_scenario(
+    params: Dict[str, int], repeat: int = 3, summary_mode: str = "copy", low_memory: bool = False
+) -> Dict[str, Any]:
+    """Generate a program, trace and export it and measure every phase"""
+    source = generate_program(**params)
+    fd, path = tempfile.mkstemp(suffix=".py")
+    with os.fdopen(fd, "w") as file:
+        file.write(source)
+
+    try:
+        parse_seconds = best_time(lambda: ast.parse(source), repeat)
+        trace_seconds = best_time(
+            lambda: PythonCallTrace(summary_mode=summary_mode, low_memory=low_memory).analyze_file(path),
+            repeat,
+        )
+
+        # Peak memory is measured on a separate run since tracemalloc slows it down
+        tracemalloc.start()
+        try:
+            tracer = PythonCallTrace(summary_mode=summary_mode, low_memory=low_memory)
+            tracer.analyze_file(path)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        # The peak RSS of this process includes earlier scenarios, so the
+        # trace is repeated in a freshly started one
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            peak_rss = pool.submit(traced_rss, path, summary_mode, low_memory).result()
+    finally:
+        os.remove(path)
+
+    counts = {}
+
+    def export():
+        with open(os.devnull, "w") as sink:
+            counts.update(export_graph(tracer.entry_node, sink, "dot"))
+
+    export_seconds = best_time(export, repeat)
+
+    def build():
+        from graphing import GraphBuilder
+
+        GraphBuilder("benchmark", tracer).add_nodes_edges(tracer.entry_node)
+
+    return {
+        "params": params,
+        "source_bytes": len(source.encode()),
+        "parse_seconds": parse_seconds,
+        "simulate_seconds": max(0.0, trace_seconds - parse_seconds),
+        "trace_seconds": trace_seconds,
+        "export_seconds": export_seconds,
+        "builder_seconds": best_time(build, repeat),
+        "peak_memory": peak_memory,
+        "peak_rss": peak_rss,
+        "nodes": counts["nodes"],
+        "edges": counts["edges"],
+        "visits": len(tracer.visit_log),
+    }
+
+
+def run_cache_benchmark(
+    params: Dict[str, int] = CACHE_SCENARIO, repeat: int = 3, summary_mode: str = "copy"
+) -> Dict[str, Any]:
+    """Time a cold trace of a generated program against one loaded from a
+    warm DefinitionCache, and measure the size of the cache entry"""
+    source = generate_program(**params)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = DefinitionCache(cache_dir)
+        tracers = {}
+
+        def trace(name: str, cache: Optional[DefinitionCache]):
+            tracers[name] = PythonCallTrace(summary_mode=summary_mode, cache=cache)
+            tracers[name].analyze_source(source, "benchmark.py")
+
+        cold_seconds = best_time(lambda: trace("cold", None), repeat)
+        trace("store", cache)
+        hit_seconds = best_time(lambda: trace("hit", cache), repeat)
+        entry_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir))
+
+    return {
+        "params": params,
+        "source_bytes": len(source.encode()),
+        "cold_seconds": cold_seconds,
+        "hit_seconds": hit_seconds,
+        "entry_bytes": entry_bytes,
+        "hits": cache.hits,
+        "nodes": len(tracers["hit"].graph),
+        "cold_nodes": len(tracers["cold"].graph),
+    }
+
+
+def compare_results(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    tolerance: float = 0.25,
+    min_seconds: float = 0.005,
+) -> List[str]:
+    """Describe every metric that regressed against a saved baseline.
+
+    Times and memory regress when they grow by more than ``tolerance``
+    (timings shorter than ``min_seconds`` on both sides are too noisy to
+    compare); node, edge and visit counts must not change at all.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if base.get("params") != result["params"]:
+            regressions.append(f"{name}: parameters differ from the baseline")
+            continue
+        for metric in TIMED_METRICS + MEMORY_METRICS:
+            old, new = base.get(metric), result[metric]
+            if not old:
+                continue
+            if metric in TIMED_METRICS and max(old, new) < min_seconds:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {old:.6g} -> {new:.6g} (+{new / old - 1:.0%})")
+        for metric in COUNT_METRICS:
+            if metric in base and base[metric] != result[metric]:
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]}")
+    return regressions
+
+
+def format_table(results: Dict[str, Dict[str, Any]]) -> str:
+    columns = ("source_bytes", "nodes", "edges", "parse_seconds", "simulate_seconds",
+               "export_seconds", "builder_seconds", "peak_memory", "peak_rss")
+    headers = ("scenario", "bytes", "nodes", "edges", "parse", "simulate",
+               "export", "builder", "peak MiB", "RSS MiB")
+    rows = [headers]
+    for name, result in results.items():
+        row = [name]
+        for column in columns:
+            value = result[column]
+            if column in MEMORY_METRICS:
+                row.append(f"{value / 2 ** 20:.1f}")
+            elif column.endswith("_seconds"):
+                row.append(f"{value * 1000:.1f}ms")
+            else:
+                row.append(str(value))
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure how the tracer and graph export scale on synthetic programs."
+    )
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a generator parameter in every scenario")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per measurement, the fastest is kept (default: 3)")
+    parser.add_argument("--summary-mode", choices=SUMMARY_MODES, default="copy")
+    parser.add_argument("--low-memory", action="store_true", help="trace in low-memory mode")
+    parser.add_argument("--cache", action="store_true",
+                        help="time cold traces against cache hits instead; fails if hits are not faster")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--save", metavar="PATH", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before reporting (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+    args.overrides = {}
+    for item in args.param:
+        name, _, value = item.partition("=")
+        if name not in generate_program.__code__.co_varnames or not value.isdigit():
+            parser.error(f"invalid parameter {item!r}")
+        args.overrides[name] = int(value)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.cache:
+        params = dict(CACHE_SCENARIO, **args.overrides)
+        result = run_cache_benchmark(params, max(1, args.repeat), args.summary_mode)
+        if args.json:
+            json.dump(result, sys.stdout, indent=2)
+            print()
+        else:
+            print(f"cold {result['cold_seconds'] * 1000:.1f}ms  hit {result['hit_seconds'] * 1000:.1f}ms  "
+                  f"entry {result['entry_bytes'] / 1024:.1f} KiB  nodes {result['nodes']}")
+        return 0 if result["hit_seconds"] < result["cold_seconds"] else 1
+
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        params = dict(SCENARIOS[name], **args.overrides)
+        results[name] = run_scenario(params, max(1, args.repeat), args.summary_mode, args.low_memory)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_table(results))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_results(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
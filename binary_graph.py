@@ -0,0 +1,281 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+from typing import Optional, Dict, List, Any, Tuple, Union, BinaryIO
+from flow_node import FlowNode
+
+MAGIC = b"PCTGRAPH"
+FORMAT_VERSION = 1
+# Magic, version, node, edge, string, type name and merge point counts,
+# entry and end ids (-1 when absent) and metadata size
+HEADER = struct.Struct("<8s9i")
+ALIGNMENT = 8
+
+# Sections follow the header in this order, each padded to ALIGNMENT bytes:
+#   types          u8  x nodes      index into the type names
+#   labels         u32 x nodes      index into the string table
+#   lines          i32 x nodes      line number of the AST node, or -1
+#   child_offsets  u32 x nodes + 1  CSR adjacency: children of node i are
+#   child_ids      u32 x edges      child_ids[child_offsets[i]:child_offsets[i + 1]]
+#   parent_offsets u32 x nodes + 1
+#   parent_ids     u32 x edges
+#   merge_points   u32 x 2 x merge point count  (CONDITION node, END_IF node) pairs
+#   string_offsets u32 x strings + 1, then the UTF-8 text of every string
+#   metadata       JSON object
+# The first strings are the type names; every label is stored once.
+
+
+def padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def section_size(typecode: str, count: int) -> int:
+    size = count * array(typecode).itemsize
+    return size + padding(size)
+
+
+def write_array(fp: BinaryIO, values: array):
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    data = values.tobytes()
+    fp.write(data + bytes(padding(len(data))))
+
+
+def write_graph(
+    entry: FlowNode, output: Union[str, BinaryIO], metadata: Optional[Dict[str, Any]] = None
+) -> Dict[str, int]:
+    """Write the graph reachable from entry in the binary format.
+
+    Nodes are renumbered depth first from entry, so entry is node 0.
+    Deferred labels are rendered once here. Collapsed nodes of a lazy
+    trace are expanded as they are reached, as FlowNode.children does.
+    Returns the number of nodes and edges written.
+    """
+    if not isinstance(output, str):
+        return write_stream(entry, output, metadata)
+    with open(output, "wb") as fp:
+        return write_stream(entry, fp, metadata)
+
+
+def write_stream(entry: FlowNode, fp: BinaryIO, metadata: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    graph = entry.graph
+    ids: Dict[int, int] = {}
+    order: List[int] = []
+    stack = [entry.index]
+    while stack:
+        index = stack.pop()
+        if index in ids:
+            continue
+        ids[index] = len(order)
+        order.append(index)
+        if graph.collapsed and index in graph.collapsed:
+            graph.expander(index)
+        stack.extend(reversed(graph.children(index)))
+
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+    type_ids: Dict[str, int] = {}
+    types = array("B")
+    labels = array("I")
+    lines = array("i")
+    for index in order:
+        node_type = graph.node_type(index)
+        if node_type not in type_ids:
+            type_ids[node_type] = len(type_ids)
+        types.append(type_ids[node_type])
+        lines.append(graph.lineno(index) or -1)
+    # Type names come first in the string table
+    for node_type in type_ids:
+        string_ids[node_type] = len(strings)
+        strings.append(node_type)
+    for index in order:
+        label = graph.label(index)
+        string_id = string_ids.get(label)
+        if string_id is None:
+            string_id = string_ids[label] = len(strings)
+            strings.append(label)
+        labels.append(string_id)
+
+    child_offsets = array("I", [0])
+    child_ids = array("I")
+    parent_lists: List[List[int]] = [[] for _ in order]
+    for new_id, index in enumerate(order):
+        for child in graph.children(index):
+            child_ids.append(ids[child])
+            parent_lists[ids[child]].append(new_id)
+        child_offsets.append(len(child_ids))
+    parent_offsets = array("I", [0])
+    parent_ids = array("I")
+    for parents in parent_lists:
+        parent_ids.extend(parents)
+        parent_offsets.append(len(parent_ids))
+
+    merge_points = array("I")
+    for index, merge in graph.merge_points.items():
+        if index in ids and merge in ids:
+            merge_points.extend((ids[index], ids[merge]))
+
+    encoded = [text.encode("utf-8") for text in strings]
+    string_offsets = array("I", [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+    end = next((i for i, index in enumerate(order) if graph.node_type(index) == "END"), -1)
+    metadata_bytes = json.dumps(metadata or {}).encode("utf-8")
+
+    fp.write(HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(order), len(child_ids), len(strings), len(type_ids),
+        len(merge_points) // 2, 0, end, len(metadata_bytes),
+    ))
+    for values in (types, labels, lines, child_offsets, child_ids, parent_offsets, parent_ids,
+                   merge_points, string_offsets):
+        write_array(fp, values)
+    text = b"".join(encoded)
+    fp.write(text + bytes(padding(len(text))))
+    fp.write(metadata_bytes)
+    return {"nodes": len(order), "edges": len(child_ids)}
+
+
+class BinaryGraph:
+    """Read-only FlowGraph backed by a memory-mapped binary graph file.
+
+    The arrays are ``memoryview`` casts of the mapping, so loading costs
+    the same whatever the size of the graph; labels are decoded and cached
+    when first read. ``node(i)`` returns FlowNode views, so traversal,
+    exporters and compaction work on a loaded graph as on a traced one.
+    Line numbers survive, AST nodes do not. Close the graph (or use it as a
+    context manager) once its views are no longer needed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ast_nodes: Dict[int, Any] = {}
+        self.low_memory = False
+        self.files: List[str] = []
+        self.collapsed: Dict[int, Any] = {}
+        with open(path, "rb") as fp:
+            self.mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.load()
+        except Exception:
+            self.close()
+            raise
+
+    def load(self):
+        if len(self.mapping) < HEADER.size:
+            raise ValueError(f"{self.path} is not a binary flow graph")
+        (magic, version, nodes, edges, strings, type_count, merges,
+         entry, end, metadata_size) = HEADER.unpack_from(self.mapping)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a binary flow graph")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has format version {version}, expected {FORMAT_VERSION}")
+
+        layout = [("B", nodes), ("I", nodes), ("i", nodes), ("I", nodes + 1), ("I", edges),
+                  ("I", nodes + 1), ("I", edges), ("I", 2 * merges), ("I", strings + 1)]
+        size = HEADER.size + sum(section_size(typecode, count) for typecode, count in layout)
+        if len(self.mapping) < size + metadata_size:
+            raise ValueError(f"{self.path} is truncated")
+
+        self.view = memoryview(self.mapping)
+        self.offset = HEADER.size
+        self.types = self.section("B", nodes)
+        self.label_ids = self.section("I", nodes)
+        self.lines = self.section("i", nodes)
+        self.child_offsets = self.section("I", nodes + 1)
+        self.child_ids = self.section("I", edges)
+        self.parent_offsets = self.section("I", nodes + 1)
+        self.parent_ids = self.section("I", edges)
+        pairs = self.section("I", 2 * merges)
+        self.merge_points = {pairs[i]: pairs[i + 1] for i in range(0, len(pairs), 2)}
+        self.string_offsets = self.section("I", strings + 1)
+        if len(self.mapping) < size + section_size("B", self.string_offsets[strings]) + metadata_size:
+            raise ValueError(f"{self.path} is truncated")
+        self.text = self.section("B", self.string_offsets[strings])
+        self.metadata: Dict[str, Any] = json.loads(
+            bytes(self.view[self.offset:self.offset + metadata_size]) or b"{}"
+        )
+        self.strings: Dict[int, str] = {}
+        self.type_names = [self.string(i) for i in range(type_count)]
+        self.entry_index = entry
+        self.end_index = end
+
+    def section(self, typecode: str, count: int) -> Any:
+        size = count * array(typecode).itemsize
+        data = self.view[self.offset:self.offset + size]
+        self.offset += size + padding(size)
+        if sys.byteorder == "big" and typecode != "B":
+            # Stored little-endian: copy rather than map
+            values = array(typecode, data.tobytes())
+            values.byteswap()
+            return values
+        return data.cast(typecode)
+
+    def close(self):
+        for name in ("types", "label_ids", "lines", "child_offsets", "child_ids",
+                     "parent_offsets", "parent_ids", "string_offsets", "text", "view"):
+            value = self.__dict__.pop(name, None)
+            if isinstance(value, memoryview):
+                value.release()
+        self.mapping.close()
+
+    def __enter__(self) -> "BinaryGraph":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def string(self, string_id: int) -> str:
+        text = self.strings.get(string_id)
+        if text is None:
+            start = self.string_offsets[string_id]
+            end = self.string_offsets[string_id + 1]
+            text = self.strings[string_id] = str(self.text[start:end], "utf-8")
+        return text
+
+    def children(self, index: int) -> List[int]:
+        return self.child_ids[self.child_offsets[index]:self.child_offsets[index + 1]].tolist()
+
+    def parents(self, index: int) -> List[int]:
+        return self.parent_ids[self.parent_offsets[index]:self.parent_offsets[index + 1]].tolist()
+
+    def node_type(self, index: int) -> str:
+        return self.type_names[self.types[index]]
+
+    def label(self, index: int) -> str:
+        return self.string(self.label_ids[index])
+
+    def lineno(self, index: int) -> Optional[int]:
+        line = self.lines[index]
+        return None if line < 0 else line
+
+    def span(self, index: int) -> Optional[Tuple[int, int, int, int]]:
+        """Always None: only line numbers are stored, not source spans"""
+        return None
+
+    def snippet(self, index: int) -> Optional[str]:
+        return None
+
+    def node(self, index: int) -> FlowNode:
+        view = FlowNode.__new__(FlowNode)
+        view.graph = self
+        view.index = index
+        return view
+
+    @property
+    def entry(self) -> FlowNode:
+        return self.node(self.entry_index)
+
+    @property
+    def end(self) -> Optional[FlowNode]:
+        return None if self.end_index < 0 else self.node(self.end_index)
+
+
+def load_graph(path: str) -> BinaryGraph:
+    """Memory-map a graph written by write_graph"""
+    return BinaryGraph(path)
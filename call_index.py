@@ -0,0 +1,307 @@
+import argparse
+import ast
+import json
+import sys
+from collections import deque
+from typing import Optional, Dict, List, Set, Any, Iterator
+from python_call_trace import PythonCallTrace
+
+# Queries understood by CallIndex.query and the batch command, with the
+# number of names each takes
+QUERIES = {"reachable": 2, "path": 2, "callers": 1, "callees": 1, "impact": 1, "uncalled": 0}
+
+
+class CallIndex:
+    """Function-level call graph of a lazy trace, indexed for queries.
+
+    Functions defined in the traced file are keyed by their qualified name
+    within the module (``helper``, ``Animal.speak``,
+    ``outer.<locals>.helper``), so definitions sharing a name stay apart.
+    Calls without a definition (builtins, methods of unknown objects) are
+    keyed by the name they are traced under. Queries take either a key or,
+    when only one function is called under it, a traced name.
+
+    The index expands one call of each
+    function body in the trace: the calls a body makes are the same
+    wherever it is called from, so the graph is built in time linear in
+    the size of the program instead of the size of the trace. Recursive
+    calls that the trace cuts are still edges.
+
+    Functions are grouped into strongly connected components, and each
+    component stores the components it reaches as a bitset (an int), so
+    ``reachable`` is a couple of dictionary lookups and a shift;
+    ``shortest_path`` searches breadth first, only through functions that
+    reach the target.
+    """
+
+    def __init__(self, tracer: PythonCallTrace):
+        if not tracer.lazy:
+            raise ValueError("CallIndex needs a lazy trace")
+        self.tracer = tracer
+        self.callees: Dict[str, Set[str]] = {}
+        self.callers: Dict[str, Set[str]] = {}
+        self.names: Dict[str, Set[str]] = {}  # Name calls are traced under -> keys
+        self.expanded = set()  # Bodies whose calls were collected, as summary keys
+        self.build()
+        self.index_components()
+
+    def build(self):
+        graph = self.tracer.graph
+        if self.tracer.entry_node is None:
+            return
+        root = self.tracer.entry_node.children[0]
+        root_call = graph.collapsed.get(root.index)
+        if root_call is None:
+            return
+        self.add_function(self.function_key(root_call.func_def), root_call.name)
+        work = [root.index]
+        while work:
+            index = work.pop()
+            call = graph.collapsed.get(index)
+            if call is None:
+                continue
+            key = (call.func_def, call.in_super_call, call.name)
+            if key in self.expanded:
+                continue
+            self.expanded.add(key)
+            caller = self.function_key(call.func_def)
+            # The visit log also has calls that get no node, such as methods
+            # of unknown objects; nested calls are not logged until expanded
+            visit_start = len(self.tracer.visit_log)
+            body = self.tracer.expand(index)
+            unmatched: Dict[str, int] = {}
+            for name in self.tracer.visit_log[visit_start:]:
+                unmatched[name] = unmatched.get(name, 0) + 1
+            for node in body:
+                if graph.node_type(node) != "FUNCTION":
+                    continue
+                name = graph.label(node)
+                unmatched[name] = unmatched.get(name, 0) - 1
+                target = graph.collapsed.get(node)
+                if target is None:
+                    # A cut recursive call names a call pending at this one
+                    target = self.pending_call(call, name)
+                else:
+                    work.append(node)
+                self.add_call(caller, name if target is None else self.function_key(target.func_def), name)
+            for name, count in unmatched.items():
+                if count > 0:
+                    self.add_call(caller, name, name)
+
+    def function_key(self, func_def: ast.AST) -> str:
+        """Qualified name of a definition, without the traced module's prefix"""
+        qualname = self.tracer.symbols.qualnames[func_def]
+        prefix = f"{self.tracer.module_name}."
+        return qualname[len(prefix):] if qualname.startswith(prefix) else qualname
+
+    def pending_call(self, call, name: str):
+        while call is not None and call.name != name:
+            call = call.parent
+        return call
+
+    def add_function(self, key: str, name: str):
+        self.callees.setdefault(key, set())
+        self.callers.setdefault(key, set())
+        self.names.setdefault(name, set()).add(key)
+
+    def add_call(self, caller: str, callee: str, name: str):
+        self.add_function(callee, name)
+        self.callees[caller].add(callee)
+        self.callers[callee].add(caller)
+
+    def index_components(self):
+        """Number the components (Tarjan's, iteratively) and their bitsets"""
+        # Sorted once so that searches and paths are deterministic
+        self.ordered = {name: sorted(callees) for name, callees in self.callees.items()}
+        self.component: Dict[str, int] = {}
+        self.reach: List[int] = []  # Component -> bitset of components it reaches
+        number: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack = set()
+        for root in self.callees:
+            if root in number:
+                continue
+            number[root] = low[root] = len(number)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.ordered[root]))]
+            while work:
+                name, callees = work[-1]
+                callee = next(callees, None)
+                if callee is not None:
+                    if callee not in number:
+                        number[callee] = low[callee] = len(number)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(self.ordered[callee])))
+                    elif callee in on_stack:
+                        low[name] = min(low[name], number[callee])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[name])
+                if low[name] != number[name]:
+                    continue
+                # Components are completed callees first, so their bitsets exist
+                component = len(self.reach)
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    self.component[member] = component
+                    members.append(member)
+                    if member == name:
+                        break
+                reach = 1 << component
+                for member in members:
+                    for callee in self.callees[member]:
+                        if self.component[callee] != component:
+                            reach |= self.reach[self.component[callee]]
+                self.reach.append(reach)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.callees or name in self.names
+
+    def __len__(self) -> int:
+        return len(self.callees)
+
+    def resolve(self, name: str) -> str:
+        """Key of a function given by its key or by the one name it is called under"""
+        if name in self.callees:
+            return name
+        keys = self.names.get(name)
+        if not keys:
+            raise KeyError(f"{name!r} is not called in the trace")
+        if len(keys) > 1:
+            raise KeyError(f"{name!r} is ambiguous: {', '.join(sorted(keys))}")
+        return next(iter(keys))
+
+    def reachable(self, source: str, target: str) -> bool:
+        """Whether calling source can lead to a call of target"""
+        source, target = self.resolve(source), self.resolve(target)
+        return bool(self.reach[self.component[source]] >> self.component[target] & 1)
+
+    def shortest_path(self, source: str, target: str) -> Optional[List[str]]:
+        """Fewest calls leading from source to target, or None"""
+        if not self.reachable(source, target):
+            return None
+        source, target = self.resolve(source), self.resolve(target)
+        goal = self.component[target]
+        previous: Dict[str, Optional[str]] = {source: None}
+        queue = deque([source])
+        while queue:
+            name = queue.popleft()
+            if name == target:
+                path = []
+                while name is not None:
+                    path.append(name)
+                    name = previous[name]
+                return path[::-1]
+            for callee in self.ordered[name]:
+                if callee not in previous and self.reach[self.component[callee]] >> goal & 1:
+                    previous[callee] = name
+                    queue.append(callee)
+        return None
+
+    def direct_callers(self, name: str) -> List[str]:
+        return sorted(self.callers[self.resolve(name)])
+
+    def direct_callees(self, name: str) -> List[str]:
+        return list(self.ordered[self.resolve(name)])
+
+    def impact(self, name: str) -> List[str]:
+        """Every function whose calls can lead to a call of name"""
+        name = self.resolve(name)
+        seen = set()
+        queue = deque([name])
+        while queue:
+            for caller in self.callers[queue.popleft()]:
+                if caller not in seen:
+                    seen.add(caller)
+                    queue.append(caller)
+        return sorted(seen)
+
+    def uncalled(self) -> List[str]:
+        """Keys of the functions defined in the traced file whose body no
+        traced call reaches, in definition order. A call by name alone, such
+        as a method of an object of unknown type, does not count.
+        """
+        reached = {key[0] for key in self.expanded}
+        return [
+            self.function_key(node) for node in self.tracer.symbols.symbols.values()
+            if isinstance(node, self.tracer.function_types) and node not in reached
+        ]
+
+    def query(self, kind: str, *names: str) -> Any:
+        """Answer a query by name; see QUERIES"""
+        if kind not in QUERIES:
+            raise ValueError(f"Unknown query {kind!r}, expected one of {tuple(QUERIES)}")
+        if len(names) != QUERIES[kind]:
+            raise ValueError(f"{kind} takes {QUERIES[kind]} function names")
+        if kind == "reachable":
+            return self.reachable(*names)
+        if kind == "path":
+            return self.shortest_path(*names)
+        if kind == "callers":
+            return self.direct_callers(*names)
+        if kind == "callees":
+            return self.direct_callees(*names)
+        if kind == "impact":
+            return self.impact(*names)
+        return self.uncalled()
+
+
+def build_call_index(path: str, **options) -> CallIndex:
+    """Trace a file lazily and index its call graph.
+
+    ``options`` are passed to PythonCallTrace (``lazy`` is always set).
+    """
+    tracer = PythonCallTrace(lazy=True, **options)
+    tracer.analyze_file(path)
+    return CallIndex(tracer)
+
+
+def run_batch(index: CallIndex, lines: Iterator[str], out):
+    """Answer one whitespace-separated query per line as NDJSON"""
+    for line in lines:
+        words = line.split()
+        if not words:
+            continue
+        try:
+            result = {"query": words, "result": index.query(*words)}
+        except (KeyError, ValueError) as error:
+            result = {"query": words, "error": str(error.args[0])}
+        out.write(json.dumps(result) + "\n")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Query the call graph of a traced Python file."
+    )
+    parser.add_argument("path", help="source file to trace")
+    parser.add_argument("query", choices=tuple(QUERIES) + ("batch",),
+                        help="query to answer; batch reads one query per line from stdin")
+    parser.add_argument("names", nargs="*", help="function names the query takes")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    index = build_call_index(args.path)
+    if args.query == "batch":
+        run_batch(index, sys.stdin, sys.stdout)
+        return 0
+    try:
+        result = index.query(args.query, *args.names)
+    except (KeyError, ValueError) as error:
+        print(f"error: {error.args[0]}", file=sys.stderr)
+        return 2
+    print(json.dumps(result))
+    # Like grep, a negative answer is a non-zero status
+    return 0 if result else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
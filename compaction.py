@@ -0,0 +1,289 @@
+from typing import Dict, List, Tuple
+from flow_node import FlowNode, FlowGraph
+
+# What each level does; every level includes the ones below it
+COMPACTION_LEVELS = {
+    0: "copy the graph unchanged",
+    1: "prune empty if statements and loops",
+    2: "collapse straight runs of calls into CHAIN nodes",
+    3: "merge structurally identical sub-graphs",
+}
+# Runs of consecutive calls listed in a CHAIN label before the rest is elided
+CHAIN_RUNS = 4
+
+
+def chain_label(names: List[str]) -> str:
+    """Label of a CHAIN node, e.g. "print x3, log (4 calls)" """
+    runs: List[Tuple[str, int]] = []
+    for name in names:
+        if runs and runs[-1][0] == name:
+            runs[-1] = (name, runs[-1][1] + 1)
+        else:
+            runs.append((name, 1))
+    parts = [name if count == 1 else f"{name} x{count}" for name, count in runs[:CHAIN_RUNS]]
+    if len(runs) > CHAIN_RUNS:
+        parts.append("...")
+    label = ", ".join(parts)
+    return label if len(runs) == 1 else f"{label} ({len(names)} calls)"
+
+
+class CompactionGraph:
+    """Mutable adjacency lists of the part of a FlowGraph reachable from entry"""
+
+    def __init__(self, entry: FlowNode):
+        graph = self.source = entry.graph
+        self.entry = entry.index
+        self.types: Dict[int, str] = {}
+        self.labels: Dict[int, str] = {}
+        self.ast_nodes = {}
+        self.span_ids: Dict[int, int] = {}  # Low-memory graphs only
+        self.children: Dict[int, List[int]] = {}
+        self.parents: Dict[int, List[int]] = {}
+        self.chains: Dict[int, tuple] = {}  # CHAIN node -> every call it replaces
+        stack = [entry.index]
+        while stack:
+            index = stack.pop()
+            if index in self.types:
+                continue
+            self.types[index] = graph.node_type(index)
+            self.labels[index] = graph.label(index)
+            if index in graph.ast_nodes:
+                self.ast_nodes[index] = graph.ast_nodes[index]
+            if graph.low_memory and graph.span_ids[index] != -1:
+                self.span_ids[index] = graph.span_ids[index]
+            self.children[index] = graph.children(index)
+            self.parents.setdefault(index, [])
+            for child in self.children[index]:
+                self.parents.setdefault(child, []).append(index)
+                stack.append(child)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def unlink(self, parent: int, child: int):
+        self.children[parent].remove(child)
+        self.parents[child].remove(parent)
+
+    def remove(self, index: int):
+        """Remove a node, linking each of its parents to its children instead"""
+        successors = [child for child in self.children[index] if child != index]
+        for child in list(self.children[index]):
+            self.unlink(index, child)
+        for parent in list(self.parents[index]):
+            edges = self.children[parent]
+            position = edges.index(index)
+            self.unlink(parent, index)
+            for child in successors:
+                if child not in edges:
+                    # Keep the parent's edges in order
+                    edges.insert(position, child)
+                    self.parents[child].append(parent)
+                    position += 1
+        del self.types[index], self.labels[index], self.children[index], self.parents[index]
+        self.ast_nodes.pop(index, None)
+        self.span_ids.pop(index, None)
+
+    def prune_empty(self):
+        """Drop if statements and loops whose bodies produced no nodes"""
+        work = [i for i, kind in self.types.items() if kind in ("CONDITION", "LOOP_START")]
+        while work:
+            index = work.pop()
+            if index not in self.types:
+                continue
+            children = self.children[index]
+            parents = list(self.parents[index])
+            if self.types[index] == "CONDITION":
+                # Both branches lead straight to the END_IF
+                if len(children) != 1 or self.types[children[0]] != "END_IF":
+                    continue
+                merge = children[0]
+                if self.parents[merge] != [index]:
+                    continue
+                self.remove(merge)
+            elif index not in children:
+                continue  # The body is more than the loop's own back edge
+            self.remove(index)
+            # Removing a body may leave the enclosing statement empty
+            work.extend(parent for parent in parents if parent in self.types)
+
+    def continues_run(self, index: int) -> bool:
+        """Whether a run of calls continues from this node to its only child"""
+        children = self.children[index]
+        return (
+            self.types[index] == "FUNCTION"
+            and len(children) == 1
+            and self.types[children[0]] == "FUNCTION"
+            and len(self.parents[children[0]]) == 1
+        )
+
+    def collapse_chains(self):
+        """Replace each straight run of FUNCTION nodes with one CHAIN node"""
+        for index in list(self.types):
+            if index not in self.types or self.types[index] != "FUNCTION":
+                continue
+            parents = self.parents[index]
+            if len(parents) == 1 and self.continues_run(parents[0]):
+                continue  # Runs are collapsed from their first node
+            run = [index]
+            seen = {index}
+            while self.continues_run(run[-1]) and self.children[run[-1]][0] not in seen:
+                run.append(self.children[run[-1]][0])
+                seen.add(run[-1])
+            if len(run) < 2:
+                continue
+            calls = tuple(self.labels[node] for node in run)
+            for node in run[1:]:
+                self.remove(node)
+            self.types[index] = "CHAIN"
+            self.labels[index] = chain_label(calls)
+            self.chains[index] = calls
+
+    def strongly_connected(self) -> List[List[int]]:
+        """Tarjan's components, each listed after every component it reaches"""
+        order: Dict[int, int] = {}
+        low: Dict[int, int] = {}
+        stack: List[int] = []
+        on_stack = set()
+        components = []
+        work = [(self.entry, iter(self.children[self.entry]))]
+        order[self.entry] = low[self.entry] = 0
+        stack.append(self.entry)
+        on_stack.add(self.entry)
+        while work:
+            index, children = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in order:
+                    order[child] = low[child] = len(order)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(self.children[child])))
+                elif child in on_stack:
+                    low[index] = min(low[index], order[child])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[index])
+            if low[index] == order[index]:
+                component = []
+                while True:
+                    node = stack.pop()
+                    on_stack.discard(node)
+                    component.append(node)
+                    if node == index:
+                        break
+                components.append(component)
+        return components
+
+    def merge_identical(self):
+        """Hash-cons nodes whose labels and successors are identical.
+
+        Components are processed from the sinks up, so successors are
+        already merged when a node's signature is computed. A loop (a
+        strongly connected component) is merged as a whole with an
+        identical loop, matching nodes in the order a walk from the loop's
+        single entry meets them; loops entered at several nodes are kept.
+        """
+        canonical: Dict[int, int] = {}
+        table: Dict[tuple, List[int]] = {}
+        for component in self.strongly_connected():
+            members = set(component)
+            if len(component) == 1 and component[0] not in self.children[component[0]]:
+                index = component[0]
+                successors = tuple(canonical[c] for c in self.children[index])
+                signature = (self.types[index], self.chains.get(index, self.labels[index]), successors)
+                canonical[index] = table.setdefault(signature, [index])[0]
+                continue
+
+            entries = [
+                i for i in component
+                if i == self.entry or any(p not in members for p in self.parents[i])
+            ]
+            if len(entries) != 1:
+                canonical.update((i, i) for i in component)
+                continue
+            walk = [entries[0]]
+            position = {entries[0]: 0}
+            for index in walk:
+                for child in self.children[index]:
+                    if child in members and child not in position:
+                        position[child] = len(walk)
+                        walk.append(child)
+            signature = tuple(
+                (
+                    self.types[i],
+                    self.chains.get(i, self.labels[i]),
+                    tuple(
+                        ("loop", position[c]) if c in members else ("exit", canonical[c])
+                        for c in self.children[i]
+                    ),
+                )
+                for i in walk
+            )
+            representative = table.setdefault(("component", signature), walk)
+            canonical.update(zip(walk, representative))
+
+        for index in list(self.types):
+            if canonical[index] != index:
+                for child in list(self.children[index]):
+                    self.unlink(index, child)
+        for index in list(self.types):
+            if canonical[index] != index:
+                for parent in list(self.parents[index]):
+                    edges = self.children[parent]
+                    position = edges.index(index)
+                    self.unlink(parent, index)
+                    target = canonical[index]
+                    if target not in edges:
+                        edges.insert(position, target)
+                        self.parents[target].append(parent)
+                del self.types[index], self.labels[index], self.children[index], self.parents[index]
+                self.ast_nodes.pop(index, None)
+                self.span_ids.pop(index, None)
+        self.span_ids.pop(index, None)
+
+    def build(self) -> FlowNode:
+        """Copy into a new FlowGraph, numbering nodes depth first from entry.
+
+        The copy is low-memory if the source graph is, and keeps its spans
+        and files.
+        """
+        source = self.source
+        graph = FlowGraph(low_memory=source.low_memory)
+        graph.files, graph.file_ids = list(source.files), dict(source.file_ids)
+        graph.spans, graph.span_table = list(source.spans), dict(source.span_table)
+        ids: Dict[int, int] = {}
+        stack = [self.entry]
+        while stack:
+            index = stack.pop()
+            if index in ids:
+                continue
+            ids[index] = graph.add_node(self.types[index], self.labels[index], self.ast_nodes.get(index))
+            if graph.low_memory:
+                graph.span_ids[-1] = self.span_ids.get(index, -1)
+            stack.extend(reversed(self.children[index]))
+        for index, new_id in ids.items():
+            for child in self.children[index]:
+                graph.add_edge(new_id, ids[child])
+        return graph.node(ids[self.entry])
+
+
+def compact_graph(entry: FlowNode, level: int = 3) -> FlowNode:
+    """Compacted copy of the graph reachable from entry; returns its entry.
+
+    See COMPACTION_LEVELS for what each level does. Pruning and merging
+    keep every path of calls through the graph; CHAIN nodes list the calls
+    they replace with counts. The original graph is left untouched and
+    collapsed nodes of a lazy trace stay collapsed.
+    """
+    if level not in COMPACTION_LEVELS:
+        raise ValueError(f"Unknown compaction level {level!r}, expected one of {tuple(COMPACTION_LEVELS)}")
+    graph = CompactionGraph(entry)
+    if level >= 1:
+        graph.prune_empty()
+    if level >= 2:
+        graph.collapse_chains()
+    if level >= 3:
+        graph.merge_identical()
+    return graph.build()
@@ -0,0 +1,237 @@
+import json
+from typing import Optional, Dict, List, TextIO, Iterator, Tuple
+from xml.sax.saxutils import escape, quoteattr
+from flow_node import FlowNode, FlowGraph
+from binary_graph import write_graph
+
+# Define different styles for different node types to use in GraphViz
+NODE_STYLES = {
+    "ENTRY": {
+        "shape": "ellipse",
+        "style": "filled",
+        "fillcolor": "lightgreen",
+    },
+    "FUNCTION": {
+        "shape": "box",
+        "style": "filled",
+        "fillcolor": "lightblue",
+    },
+    "CALL": {"shape": "box", "style": "filled", "fillcolor": "lightpink"},
+    "LOOP": {
+        "shape": "ellipse",
+        "style": "filled",
+        "fillcolor": "lightgray",
+    },
+    "CONDITION": {
+        "shape": "diamond",
+        "style": "filled",
+        "fillcolor": "lightgray",
+    },
+    "END_IF": {
+        "shape": "Mdiamond",
+        "style": "filled",
+        "fillcolor": "white",
+    },
+    "END_LOOP": {
+        "shape": "Msquare",
+        "style": "filled",
+        "fillcolor": "white",
+    },
+    "MERGE": {
+        "shape": "ellipse",
+        "style": "filled",
+        "fillcolor": "lightgray",
+    },
+    "END": {
+        "shape": "ellipse",
+        "style": "filled",
+        "fillcolor": "lightgreen",
+    },
+    "CHAIN": {
+        "shape": "box",
+        "style": "filled",
+        "fillcolor": "lightblue",
+        "peripheries": "2",
+    },
+    "TRUNCATED": {
+        "shape": "octagon",
+        "style": "filled",
+        "fillcolor": "orange",
+    },
+}
+DEFAULT_STYLE = {"shape": "box"}
+
+# "binary" is written by binary_graph, the others by WRITERS
+EXPORT_FORMATS = ("dot", "jsonl", "graphml", "binary")
+
+
+def walk_graph(entry: FlowNode) -> Iterator[Tuple[str, int, int]]:
+    """Stream ("node", id, -1) and ("edge", parent, child) events depth-first.
+
+    Each edge is reported just before its child is first visited, which is
+    the order GraphBuilder adds them to a Digraph. Collapsed nodes of a lazy
+    trace are expanded as they are reached, as FlowNode.children does.
+    """
+    graph = entry.graph
+
+    def children(index: int) -> List[int]:
+        if graph.collapsed and index in graph.collapsed:
+            graph.expander(index)
+        return graph.children(index)
+
+    visited = bytearray(len(graph))
+    visited[entry.index] = 1
+    yield "node", entry.index, -1
+
+    stack = [(entry.index, iter(children(entry.index)))]
+    while stack:
+        parent, edges = stack[-1]
+        child = next(edges, None)
+        if child is None:
+            stack.pop()
+            continue
+        yield "edge", parent, child
+        if child >= len(visited):
+            # Expanding added nodes
+            visited.extend(bytearray(len(graph) - len(visited)))
+        if not visited[child]:
+            visited[child] = 1
+            yield "node", child, -1
+            stack.append((child, iter(children(child))))
+
+
+class StreamWriter:
+    """Base class of writers that serialize graph events to a text stream"""
+
+    BUFFER_LINES = 4096
+
+    def __init__(self, fp: TextIO, graph: FlowGraph, name: str = "flow"):
+        self.fp = fp
+        self.graph = graph
+        self.name = name
+        self.buffer = []
+        self.node_count = 0
+        self.edge_count = 0
+
+    def write(self, text: str):
+        self.buffer.append(text)
+        if len(self.buffer) >= self.BUFFER_LINES:
+            self.flush()
+
+    def flush(self):
+        self.fp.write("".join(self.buffer))
+        self.buffer.clear()
+
+    def begin(self):
+        pass
+
+    def node(self, index: int):
+        raise NotImplementedError
+
+    def edge(self, parent: int, child: int):
+        raise NotImplementedError
+
+    def end(self):
+        self.flush()
+
+
+class DotWriter(StreamWriter):
+    def begin(self):
+        self.write(f"// {self.name}\ndigraph {{\n\trankdir=TB\n")
+
+    def node(self, index: int):
+        style = NODE_STYLES.get(self.graph.node_type(index), DEFAULT_STYLE)
+        attributes = "".join(f" {key}={value}" for key, value in style.items())
+        self.write(f"\t{index} [label={dot_quote(self.graph.label(index))}{attributes}]\n")
+
+    def edge(self, parent: int, child: int):
+        self.write(f"\t{parent} -> {child}\n")
+
+    def end(self):
+        self.write("}\n")
+        self.flush()
+
+
+class JsonLinesWriter(StreamWriter):
+    def node(self, index: int):
+        record = {
+            "kind": "node",
+            "id": index,
+            "type": self.graph.node_type(index),
+            "label": self.graph.label(index),
+        }
+        lineno = self.graph.lineno(index)
+        if lineno is not None:
+            record["lineno"] = lineno
+        self.write(json.dumps(record) + "\n")
+
+    def edge(self, parent: int, child: int):
+        self.write(f'{{"kind": "edge", "source": {parent}, "target": {child}}}\n')
+
+
+class GraphMLWriter(StreamWriter):
+    def begin(self):
+        self.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+            '  <key id="type" for="node" attr.name="type" attr.type="string"/>\n'
+            '  <key id="label" for="node" attr.name="label" attr.type="string"/>\n'
+            f"  <graph id={quoteattr(self.name)} edgedefault=\"directed\">\n"
+        )
+
+    def node(self, index: int):
+        self.write(
+            f'    <node id="n{index}">'
+            f'<data key="type">{escape(self.graph.node_type(index))}</data>'
+            f'<data key="label">{escape(self.graph.label(index))}</data></node>\n'
+        )
+
+    def edge(self, parent: int, child: int):
+        self.write(f'    <edge source="n{parent}" target="n{child}"/>\n')
+
+    def end(self):
+        self.write("  </graph>\n</graphml>\n")
+        self.flush()
+
+
+WRITERS = {"dot": DotWriter, "jsonl": JsonLinesWriter, "graphml": GraphMLWriter}
+
+
+def dot_quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def export_graph(
+    entry: FlowNode, fp: TextIO, fmt: str = "dot", name: str = "flow"
+) -> Dict[str, int]:
+    """Write the graph reachable from entry to fp while traversing it.
+
+    Nothing is held in memory beyond the traversal stack and a small write
+    buffer. Returns the number of nodes and edges written.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown text export format {fmt!r}, expected one of {tuple(WRITERS)}")
+    writer = WRITERS[fmt](fp, entry.graph, name)
+    writer.begin()
+    for kind, first, second in walk_graph(entry):
+        if kind == "node":
+            writer.node(first)
+            writer.node_count += 1
+        else:
+            writer.edge(first, second)
+            writer.edge_count += 1
+    writer.end()
+    return {"nodes": writer.node_count, "edges": writer.edge_count}
+
+
+def export_file(
+    entry: FlowNode, output_file: str, fmt: Optional[str] = None, name: str = "flow"
+) -> Dict[str, int]:
+    """Export to a path, taking the format from its extension if not given"""
+    if fmt is None:
+        fmt = output_file.rsplit(".", 1)[-1].lower()
+        fmt = {"gv": "dot", "ndjson": "jsonl", "pctg": "binary"}.get(fmt, fmt)
+    if fmt == "binary":
+        return write_graph(entry, output_file, {"name": name})
+    with open(output_file, "w", encoding="utf-8") as fp:
+        return export_graph(entry, fp, fmt, name)
@@ -1,29 +1,437 @@
 import ast
-import uuid
-from typing import Optional
+import bisect
+import mmap
+from array import array
+from typing import Optional, Dict, List, Tuple, Callable, Any
+
+
+class FlowGraph:
+    """Struct-of-arrays store for the nodes and edges of a flow graph.
+
+    Nodes are integer ids into parallel arrays: a type code, an interned
+    label and a sparse map to the originating AST node. Most nodes have a
+    single parent and a single child, so the first edge in each direction
+    lives in an ``array`` and further edges in sparse overflow lists; edge
+    insertion and de-duplication are O(1).
+
+    Nodes in ``collapsed`` have a body that has not been simulated yet;
+    ``expander`` is called with their id before FlowNode.children lists
+    them. A ``None`` label is deferred: ``label_renderer`` computes it from
+    the node's type and AST node when it is first read.
+
+    A ``low_memory`` graph keeps no AST nodes: each node stores the id of
+    an interned ``(file_id, lineno, col, end_lineno)`` span instead, where
+    ``file_id`` indexes ``files`` and is the graph's ``file_id`` when the
+    node is added, and deferred labels are rendered right away.
+    """
+
+    EDGE_SHIFT = 32
+
+    def __init__(self, low_memory: bool = False):
+        self.expander: Optional[Callable[[int], Any]] = None
+        self.label_renderer: Optional[Callable[[str, ast.AST], str]] = None
+        self.low_memory = low_memory
+        self.clear()
+
+    def clear(self):
+        """Remove every node and edge; existing views become invalid"""
+        self.type_names: List[str] = []
+        self.type_codes: Dict[str, int] = {}
+        self.types = array("B")
+        self.labels: List[Optional[str]] = []
+        self.label_table: Dict[str, str] = {}  # Interned labels
+        self.ast_nodes: Dict[int, ast.AST] = {}
+        self.first_child = array("q")
+        self.first_parent = array("q")
+        self.more_children: Dict[int, List[int]] = {}
+        self.more_parents: Dict[int, List[int]] = {}
+        self.more_edges = set()  # Encoded edges stored in the overflow lists
+        self.link_times: Optional[Dict[int, int]] = None  # While set, node count when each overflow edge was added
+        self.merge_points: Dict[int, int] = {}
+        self.collapsed: Dict[int, Any] = {}
+        self.files: List[str] = []
+        self.file_ids: Dict[str, int] = {}
+        self.file_id = -1  # File of the spans of new nodes
+        self.spans: List[Tuple[int, int, int, int]] = []
+        self.span_table: Dict[Tuple[int, int, int, int], int] = {}
+        self.span_ids = array("i")  # Node -> span, -1 for none; low-memory graphs only
+        self.line_starts: Dict[int, array] = {}  # Offsets of the lines of each file, read for snippets
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def add_node(
+        self, node_type: str, label: Optional[str], ast_node: Optional[ast.AST] = None
+    ) -> int:
+        code = self.type_codes.get(node_type)
+        if code is None:
+            code = self.type_codes[node_type] = len(self.type_names)
+            self.type_names.append(node_type)
+        index = len(self.types)
+        self.types.append(code)
+        if self.low_memory:
+            if label is None:
+                label = self.label_renderer(node_type, ast_node)
+            self.span_ids.append(-1 if ast_node is None else self.add_span(ast_node))
+        elif ast_node is not None:
+            self.ast_nodes[index] = ast_node
+        self.labels.append(label if label is None else self.label_table.setdefault(label, label))
+        self.first_child.append(-1)
+        self.first_parent.append(-1)
+        return index
+
+    def add_file(self, path: str) -> int:
+        """Id of a source file, registering it on first use"""
+        file_id = self.file_ids.get(path)
+        if file_id is None:
+            file_id = self.file_ids[path] = len(self.files)
+            self.files.append(path)
+        return file_id
+
+    def add_span(self, ast_node: ast.AST) -> int:
+        """Id of the interned span of an AST node in the current file"""
+        lineno = getattr(ast_node, "lineno", None)
+        if lineno is None:
+            return -1
+        return self.intern_span(lineno, ast_node.col_offset, ast_node.end_lineno or lineno)
+
+    def intern_span(self, lineno: int, col: int, end_lineno: int) -> int:
+        """Id of a span in the current file, registering it on first use"""
+        span = (self.file_id, lineno, col, end_lineno)
+        span_id = self.span_table.get(span)
+        if span_id is None:
+            span_id = self.span_table[span] = len(self.spans)
+            self.spans.append(span)
+        return span_id
+
+    def add_edge(self, parent: int, child: int) -> bool:
+        """Add an edge unless it already exists; returns whether it was added"""
+        first = self.first_child[parent]
+        if first == -1:
+            self.first_child[parent] = child
+        elif first == child:
+            return False
+        else:
+            key = (parent << self.EDGE_SHIFT) | child
+            if key in self.more_edges:
+                return False
+            self.more_edges.add(key)
+            self.more_children.setdefault(parent, []).append(child)
+            if self.link_times is not None:
+                self.link_times[key] = len(self.types)
+
+        if self.first_parent[child] == -1:
+            self.first_parent[child] = parent
+        else:
+            self.more_parents.setdefault(child, []).append(parent)
+        return True
+
+    def remove_edge(self, parent: int, child: int):
+        """Remove an existing edge, keeping the order of the remaining ones"""
+        key = (parent << self.EDGE_SHIFT) | child
+        if self.first_child[parent] == child:
+            more = self.more_children.get(parent)
+            if more:
+                promoted = more.pop(0)
+                self.more_edges.discard((parent << self.EDGE_SHIFT) | promoted)
+                self.first_child[parent] = promoted
+                if not more:
+                    del self.more_children[parent]
+            else:
+                self.first_child[parent] = -1
+        else:
+            self.more_children[parent].remove(child)
+            self.more_edges.discard(key)
+            if not self.more_children[parent]:
+                del self.more_children[parent]
+
+        if self.first_parent[child] == parent:
+            more = self.more_parents.get(child)
+            if more:
+                self.first_parent[child] = more.pop(0)
+                if not more:
+                    del self.more_parents[child]
+            else:
+                self.first_parent[child] = -1
+        else:
+            self.more_parents[child].remove(parent)
+            if not self.more_parents[child]:
+                del self.more_parents[child]
+
+    def children(self, index: int) -> List[int]:
+        first = self.first_child[index]
+        if first == -1:
+            return []
+        more = self.more_children.get(index)
+        return [first] + more if more else [first]
+
+    def parents(self, index: int) -> List[int]:
+        first = self.first_parent[index]
+        if first == -1:
+            return []
+        more = self.more_parents.get(index)
+        return [first] + more if more else [first]
+
+    def reorder_children(self, index: int, children: List[int]):
+        """List the children of a node in another order"""
+        if len(children) > 1:
+            self.first_child[index] = children[0]
+            self.more_children[index] = children[1:]
+
+    def node_type(self, index: int) -> str:
+        return self.type_names[self.types[index]]
+
+    def label(self, index: int) -> str:
+        label = self.labels[index]
+        if label is None:
+            label = self.label_renderer(self.node_type(index), self.ast_nodes[index])
+        return label
+
+    def lineno(self, index: int) -> Optional[int]:
+        if self.low_memory:
+            span = self.span(index)
+            return None if span is None else span[1]
+        return getattr(self.ast_nodes.get(index), "lineno", None)
+
+    def span(self, index: int) -> Optional[Tuple[int, int, int, int]]:
+        """``(file_id, lineno, col, end_lineno)`` of a node of a low-memory graph"""
+        span_id = self.span_ids[index] if self.low_memory else -1
+        return None if span_id == -1 else self.spans[span_id]
+
+    def snippet(self, index: int) -> Optional[str]:
+        """Source text of a node's span, re-read from its file.
+
+        The file is memory-mapped rather than read, and must be unchanged
+        since it was traced; the span runs from the node's column to the
+        end of its last line. None for nodes without a span.
+        """
+        span = self.span(index)
+        if span is None:
+            return None
+        file_id, lineno, col, end_lineno = span
+        with open(self.files[file_id], "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            starts = self.line_starts.get(file_id)
+            if starts is None:
+                starts = self.line_starts[file_id] = array("q", [0])
+                position = data.find(b"\n")
+                while position != -1:
+                    starts.append(position + 1)
+                    position = data.find(b"\n", position + 1)
+            end = starts[end_lineno] if end_lineno < len(starts) else len(data)
+            # Columns are UTF-8 byte offsets, as in the AST
+            text = data[starts[lineno - 1] + col:end]
+        return text.decode("utf-8", "replace").rstrip("\r\n")
+
+    def node(self, index: int) -> "FlowNode":
+        """View of the node with the given id"""
+        view = FlowNode.__new__(FlowNode)
+        view.graph = self
+        view.index = index
+        return view
+
+    def copy_range(self, start: int, end: int) -> int:
+        """Append copies of nodes [start, end) with the edges among them.
+
+        Returns the id of the copy of ``start``; the copy of node ``i`` is
+        ``returned id + (i - start)``.
+        """
+        offset = len(self.types) - start
+        for i in range(start, end):
+            self.add_node(self.node_type(i), self.labels[i], self.ast_nodes.get(i))
+            if self.low_memory:
+                self.span_ids[-1] = self.span_ids[i]
+        for i in range(start, end):
+            for child in self.children(i):
+                if start <= child < end:
+                    self.add_edge(i + offset, child + offset)
+        return start + offset
+
+    def copy_ranges(self, ranges: List[Tuple[int, int]]) -> List[int]:
+        """Append copies of the nodes of several [start, end) ranges, in the
+        order given, with the edges among all of them.
+
+        Returns the id of the copy of each range's start.
+        """
+        if len(ranges) == 1:
+            return [self.copy_range(*ranges[0])]
+        starts = []
+        for start, end in ranges:
+            starts.append(len(self.types))
+            for i in range(start, end):
+                self.add_node(self.node_type(i), self.labels[i], self.ast_nodes.get(i))
+                if self.low_memory:
+                    self.span_ids[-1] = self.span_ids[i]
+        bounds = sorted((start, end, new_start) for (start, end), new_start in zip(ranges, starts))
+        lows = [start for start, _, _ in bounds]
+        for (start, end), new_start in zip(ranges, starts):
+            offset = new_start - start
+            for i in range(start, end):
+                for child in self.children(i):
+                    if start <= child < end:
+                        self.add_edge(i + offset, child + offset)
+                        continue
+                    low, high, child_start = bounds[max(0, bisect.bisect_right(lows, child) - 1)]
+                    if low <= child < high:
+                        self.add_edge(i + offset, child_start + child - low)
+        return starts
+
+    def compact(self, ranges: List[Tuple[int, int]]) -> array:
+        """Keep only the nodes of the given disjoint [start, end) ranges,
+        renumbered in the order given; edges from or to other nodes are
+        dropped.
+
+        Returns the new id of every old node, -1 for removed ones, followed
+        by a -1 so that a missing link (-1) maps to itself.
+        """
+        size = len(self.types)
+        positions = array("q", [-1]) * (size + 1)
+        count = 0
+        for start, end in ranges:
+            positions[start:end] = array("q", range(count, count + end - start))
+            count += end - start
+
+        # Only the neighbours of removed nodes lose edges; every other link
+        # is renumbered as is
+        removed = self.removed_nodes(ranges, size)
+        linked = {first[index] for first in (self.first_child, self.first_parent) for index in removed}
+        for more in (self.more_children, self.more_parents):
+            linked.update(node for index in removed if index in more for node in more[index])
+        dirty = [node for node in linked if positions[node] != -1]
+
+        def gather(values):
+            kept = values[:0]
+            for start, end in ranges:
+                kept += values[start:end]
+            return kept
+
+        def relink(first: array, more: Dict[int, List[int]], linked_to) -> Tuple[array, Dict[int, List[int]]]:
+            new_first = array("q")
+            for start, end in ranges:
+                new_first.extend([positions[linked] for linked in first[start:end]])
+            new_more = {positions[index]: [positions[node] for node in linked] for index, linked in more.items()}
+            new_more.pop(-1, None)
+            for index in dirty:
+                kept = [positions[node] for node in linked_to(index) if positions[node] != -1]
+                new_first[positions[index]] = kept[0] if kept else -1
+                if len(kept) > 1:
+                    new_more[positions[index]] = kept[1:]
+                else:
+                    new_more.pop(positions[index], None)
+            return new_first, new_more
+
+        self.types = gather(self.types)
+        self.labels = gather(self.labels)
+        if self.low_memory:
+            self.span_ids = gather(self.span_ids)
+        self.ast_nodes = {positions[i]: node for i, node in self.ast_nodes.items() if positions[i] != -1}
+        first_child, more_children = relink(self.first_child, self.more_children, self.children)
+        self.first_parent, self.more_parents = relink(self.first_parent, self.more_parents, self.parents)
+        self.first_child, self.more_children = first_child, more_children
+        self.more_edges = {
+            (parent << self.EDGE_SHIFT) | child
+            for parent, children in self.more_children.items() for child in children
+        }
+        self.merge_points = {
+            positions[node]: positions[merge] for node, merge in self.merge_points.items()
+            if positions[node] != -1 and positions[merge] != -1
+        }
+        self.collapsed = {
+            positions[node]: call for node, call in self.collapsed.items() if positions[node] != -1
+        }
+        return positions
+
+    @staticmethod
+    def removed_nodes(ranges: List[Tuple[int, int]], size: int) -> List[int]:
+        """Nodes of [0, size) outside the given disjoint ranges"""
+        removed = []
+        previous = 0
+        for start, end in sorted(ranges):
+            removed.extend(range(previous, start))
+            previous = end
+        removed.extend(range(previous, size))
+        return removed
 
 
 class FlowNode:
-    def __init__(self, node_type: str, label: str, ast_node: Optional[ast.AST] = None):
-        self.id = str(uuid.uuid4())
-        self.type = node_type
-        self.label = label
-        self.ast_node = ast_node
-        self.children = []
-        self.parents = []
-        self.branch_merge_point = None
+    """Lightweight view of one node of a FlowGraph.
+
+    Creating a FlowNode without a graph allocates a fresh single-node graph;
+    nodes can only be linked to nodes of the same graph.
+    """
+
+    __slots__ = ("graph", "index")
+
+    def __init__(
+        self,
+        node_type: str,
+        label: str,
+        ast_node: Optional[ast.AST] = None,
+        graph: Optional[FlowGraph] = None,
+    ):
+        self.graph = graph if graph is not None else FlowGraph()
+        self.index = self.graph.add_node(node_type, label, ast_node)
 
     def __str__(self):
         # Define Serializer for the class
         return f"{self.type} {self.label}"
 
+    def __repr__(self):
+        return f"<FlowNode {self.index}: {self}>"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FlowNode)
+            and self.index == other.index
+            and self.graph is other.graph
+        )
+
+    def __hash__(self):
+        return self.index
+
+    @property
+    def id(self) -> int:
+        return self.index
+
+    @property
+    def type(self) -> str:
+        return self.graph.node_type(self.index)
+
+    @property
+    def label(self) -> str:
+        return self.graph.label(self.index)
+
+    @property
+    def ast_node(self) -> Optional[ast.AST]:
+        return self.graph.ast_nodes.get(self.index)
+
+    @property
+    def span(self) -> Optional[Tuple[int, int, int, int]]:
+        return self.graph.span(self.index)
+
+    @property
+    def children(self) -> List["FlowNode"]:
+        graph = self.graph
+        if graph.collapsed and self.index in graph.collapsed:
+            graph.expander(self.index)
+        node = graph.node
+        return [node(i) for i in graph.children(self.index)]
+
+    @property
+    def parents(self) -> List["FlowNode"]:
+        node = self.graph.node
+        return [node(i) for i in self.graph.parents(self.index)]
+
+    @property
+    def branch_merge_point(self) -> Optional["FlowNode"]:
+        index = self.graph.merge_points.get(self.index)
+        return None if index is None else self.graph.node(index)
+
     def add_child(self, child: "FlowNode"):
-        # Check if it already exists in child's parents or self's children
-        if child not in self.children:
-            self.children.append(child)
-        if self not in child.parents:
-            child.parents.append(self)
+        # Edges are de-duplicated by the graph
+        if child.graph is not self.graph:
+            raise ValueError("Cannot link nodes of different flow graphs")
+        self.graph.add_edge(self.index, child.index)
 
     def set_branch_merge_point(self, node: "FlowNode"):
         # Initialize branch_merge_point
-        self.branch_merge_point = node
+        self.graph.merge_points[self.index] = node.index
@@ -1,6 +1,11 @@
+from typing import Optional, Dict, List
 from python_call_trace import PythonCallTrace
 from flow_node import FlowNode
 from graphviz import Digraph
+from exporters import NODE_STYLES, DEFAULT_STYLE, export_file
+from compaction import compact_graph
+from hotness import HeatMap, heat_color
+from paged_graph import PagedGraph, DEFAULT_PAGE_SIZE
 
 
 class GraphBuilder:
@@ -8,80 +13,86 @@ class GraphBuilder:
         self,
         comment: str,
         call_tracer: PythonCallTrace,
+        compact: int = 0,
+        heat: Optional[HeatMap] = None,
     ):
+        if compact and heat is not None:
+            raise ValueError("Heat is estimated for the graph as traced; it cannot be compacted")
         self.dot = Digraph(comment=comment)
         self.call_tracer = call_tracer
+        self.compact = compact  # Level of compaction.compact_graph, 0 draws the graph as traced
+        self.heat = heat  # Colors nodes by estimated execution count if given
         self.visited = set()
 
+    def entry_node(self) -> FlowNode:
+        """Entry of the graph to draw"""
+        if self.call_tracer.entry_node is None:
+            raise ValueError(
+                "No Entry Node found which infers no 'main' function present in file"
+            )
+        if self.compact:
+            return compact_graph(self.call_tracer.entry_node, self.compact)
+        return self.call_tracer.entry_node
+
+    def add_node(self, node: FlowNode):
+        """Add a single node to the graph, styled by its type"""
+        self.visited.add(node.id)
+        style = NODE_STYLES.get(node.type, DEFAULT_STYLE)
+        if self.heat is not None:
+            count = self.heat.counts.get(node.id, 0.0)
+            style = dict(style, style="filled", fillcolor=heat_color(self.heat.heat(node.id)),
+                         tooltip=f"about {count:g} runs")
+        self.dot.node(str(node.id), node.label, **style)
+
     def add_nodes_edges(self, node: FlowNode):
         """Add nodes and edges to the graph"""
         # Check if node is already visited
         if node.id in self.visited:
             return
-        self.visited.add(node.id)
+        self.add_node(node)
 
-        # Define different styles for different node types to use in GraphViz
-        styles = {
-            "ENTRY": {
-                "shape": "ellipse",
-                "style": "filled",
-                "fillcolor": "lightgreen",
-            },
-            "FUNCTION": {
-                "shape": "box",
-                "style": "filled",
-                "fillcolor": "lightblue",
-            },
-            "CALL": {"shape": "box", "style": "filled", "fillcolor": "lightpink"},
-            "LOOP": {
-                "shape": "ellipse",
-                "style": "filled",
-                "fillcolor": "lightgray",
-            },
-            "CONDITION": {
-                "shape": "diamond",
-                "style": "filled",
-                "fillcolor": "lightgray",
-            },
-            "END_IF": {
-                "shape": "Mdiamond",
-                "style": "filled",
-                "fillcolor": "white",
-            },
-            "END_LOOP": {
-                "shape": "Msquare",
-                "style": "filled",
-                "fillcolor": "white",
-            },
-            "MERGE": {
-                "shape": "ellipse",
-                "style": "filled",
-                "fillcolor": "lightgray",
-            },
-            "END": {
-                "shape": "ellipse",
-                "style": "filled",
-                "fillcolor": "lightgreen",
-            },
-        }
+        # Depth-first over an explicit stack of child iterators, emitting each
+        # edge just before descending into its child
+        stack = [(node, iter(node.children))]
+        while stack:
+            parent, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                continue
+            self.dot.edge(str(parent.id), str(child.id))
+            if child.id not in self.visited:
+                self.add_node(child)
+                stack.append((child, iter(child.children)))
 
-        # Choose style based on node type
-        style = styles.get(node.type, {"shape": "box"})
-        self.dot.node(node.id, node.label, **style)
+    def create_visual_graph(self, output_file: str, view: bool = False, fmt: str = "png"):
+        """Create a visual representation of the execution flow graph.
 
-        # Draw all the children nodes of current node
-        for child in node.children:
-            self.dot.edge(node.id, child.id)
-            self.add_nodes_edges(child)
-
-    def create_visual_graph(self, output_file: str):
-        """Create a visual representation of the execution flow graph"""
+        This lays the graph out with graphviz's `dot`; use `export` for large
+        graphs or headless runs that only need a machine-readable graph.
+        """
         self.dot.attr(rankdir="TB")
 
-        if self.call_tracer.entry_node is None:
-            raise ValueError(
-                "No Entry Node found which infers no 'main' function present in file"
-            )
+        with self.call_tracer.phase("export"):
+            self.add_nodes_edges(self.entry_node())
+            self.dot.render(output_file, view=view, format=fmt)
+
+    def export(self, output_file: str, fmt: Optional[str] = None) -> Dict[str, int]:
+        """Stream the graph to a DOT, JSON-lines or GraphML file without rendering"""
+        with self.call_tracer.phase("export"):
+            return export_file(self.entry_node(), output_file, fmt, self.dot.comment)
+
+    def render_pages(
+        self, output_dir: str, page_size: int = DEFAULT_PAGE_SIZE, jobs: Optional[int] = None,
+        fmt: str = "svg", render: bool = True
+    ) -> List[str]:
+        """Render a lazy trace as linked pages of per-function clusters.
 
-        self.add_nodes_edges(self.call_tracer.entry_node)
-        self.dot.render(output_file, view=True, format="png")
+        Unlike `create_visual_graph`, each page is laid out on its own, in
+        parallel, so large graphs stay readable; see paged_graph.PagedGraph.
+        """
+        if self.compact:
+            raise ValueError("Pages follow the function bodies of the trace; they cannot be compacted")
+        with self.call_tracer.phase("export"):
+            paged = PagedGraph(self.call_tracer, page_size, self.heat)
+            return paged.write(output_dir, self.dot.comment, fmt, jobs, render)
@@ -0,0 +1,410 @@
+import argparse
+import ast
+import heapq
+import json
+import math
+import sys
+from typing import Optional, Dict, List, Any, Tuple, Union
+from python_call_trace import PythonCallTrace, COVERAGE_MODES
+
+# Iterations assumed for loops and comprehensions of unknown size
+DEFAULT_TRIPS = 10
+COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+# Nodes that open a scope of their own; names and calls in them are not the enclosing function's
+SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+# Calls that iterate over their first argument, element by element
+SAME_SIZE = {"enumerate", "reversed", "sorted", "list", "tuple", "set", "frozenset", "iter", "dict"}
+
+
+def scope_nodes(node: ast.AST) -> List[ast.AST]:
+    """Nodes below node, leaving out nested functions, classes and lambdas"""
+    nodes = []
+    stack = list(ast.iter_child_nodes(node))
+    while stack:
+        child = stack.pop()
+        if isinstance(child, SCOPES):
+            continue
+        nodes.append(child)
+        stack.extend(ast.iter_child_nodes(child))
+    return nodes
+
+
+def single_assignments(nodes: List[ast.AST]) -> Dict[str, ast.expr]:
+    """Value of every name assigned exactly once, by a plain ``name = value``"""
+    stores: Dict[str, int] = {}
+    values: Dict[str, ast.expr] = {}
+    for node in nodes:
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            stores[node.id] = stores.get(node.id, 0) + 1
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            values[node.targets[0].id] = node.value
+    return {name: value for name, value in values.items() if stores.get(name) == 1}
+
+
+def call_name(node: ast.Call) -> Optional[str]:
+    """Bare name of the called function, as the last part of a traced call name"""
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+
+class Constants:
+    """Sizes and integer values of expressions, where literals make them known.
+
+    ``names`` maps names to the single value assigned to them, looked up in
+    the function first and then in its module.
+    """
+
+    def __init__(self, *scopes: Dict[str, ast.expr]):
+        self.scopes = scopes
+        self.resolving = set()  # Names being resolved, to stop on cycles
+
+    def lookup(self, name: str) -> Optional[ast.expr]:
+        for scope in self.scopes:
+            if name in scope:
+                return scope[name]
+        return None
+
+    def resolve(self, node: ast.Name, evaluate) -> Optional[int]:
+        value = self.lookup(node.id)
+        if value is None or node.id in self.resolving:
+            return None
+        self.resolving.add(node.id)
+        try:
+            return evaluate(value)
+        finally:
+            self.resolving.discard(node.id)
+
+    def integer(self, node: ast.expr) -> Optional[int]:
+        if isinstance(node, ast.Constant):
+            return node.value if isinstance(node.value, int) and not isinstance(node.value, bool) else None
+        if isinstance(node, ast.Name):
+            return self.resolve(node, self.integer)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            value = self.integer(node.operand)
+            return None if value is None else -value
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.FloorDiv)):
+            left, right = self.integer(node.left), self.integer(node.right)
+            if left is None or right is None or isinstance(node.op, ast.FloorDiv) and right == 0:
+                return None
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            return left * right if isinstance(node.op, ast.Mult) else left // right
+        if isinstance(node, ast.Call) and call_name(node) == "len" and len(node.args) == 1:
+            return self.size(node.args[0])
+        return None
+
+    def size(self, node: ast.expr) -> Optional[int]:
+        """Number of elements iterating over node yields, if known"""
+        if isinstance(node, ast.Constant):
+            return len(node.value) if isinstance(node.value, (str, bytes)) else None
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            if any(isinstance(element, ast.Starred) for element in node.elts):
+                return None
+            return len(node.elts)
+        if isinstance(node, ast.Dict):
+            return None if None in node.keys else len(node.keys)
+        if isinstance(node, ast.Name):
+            return self.resolve(node, self.size)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult):
+            # [x] * n
+            for sequence, count in ((node.left, node.right), (node.right, node.left)):
+                length, times = self.size(sequence), self.integer(count)
+                if length is not None and times is not None:
+                    return length * max(times, 0)
+            return None
+        if not isinstance(node, ast.Call):
+            return None
+        name = call_name(node)
+        if name == "range" and isinstance(node.func, ast.Name) and 1 <= len(node.args) <= 3:
+            bounds = [self.integer(arg) for arg in node.args]
+            if None in bounds or len(bounds) == 3 and bounds[2] == 0:
+                return None
+            return len(range(*bounds))
+        if name in SAME_SIZE and isinstance(node.func, ast.Name) and node.args:
+            return self.size(node.args[0])
+        if name == "zip" and isinstance(node.func, ast.Name) and node.args:
+            sizes = [self.size(arg) for arg in node.args]
+            return None if None in sizes else min(sizes)
+        if name in ("items", "keys", "values") and isinstance(node.func, ast.Attribute) and not node.args:
+            return self.size(node.func.value)
+        return None
+
+
+class HeatMap:
+    """Estimated execution counts of the nodes of a lazy trace.
+
+    Every body is expanded once, and counts flow through it from its
+    FUNCTION node: loop bodies run as many times as the loop's trip count,
+    each branch of a condition gets an equal share, and merges add their
+    branches back up. Nested calls then start from the count of their
+    FUNCTION node, so loops multiply across calls. Trip counts are read off
+    ``range`` calls and sized literals, directly or through names assigned
+    once; other loops run ``default_trips`` times. Comprehensions make no
+    nodes, so calls in them are scaled by name: a call whose name the
+    function only calls inside comprehensions counts once per element.
+    (Comprehensions are only traced with ``coverage="full"``.)
+
+    ``counts`` has the count of every node, ``function_counts`` the total
+    per called name, and ``hot_paths`` ranks call paths from main.
+    """
+
+    def __init__(self, tracer: PythonCallTrace, default_trips: int = DEFAULT_TRIPS):
+        if not tracer.lazy:
+            raise ValueError("HeatMap needs a lazy trace")
+        self.tracer = tracer
+        self.default_trips = default_trips
+        self.counts: Dict[int, float] = {}
+        self.hottest = 1.0
+        # Call paths are interned as (parent path, label) pairs
+        self.path_ids: Dict[Tuple[int, str], int] = {}
+        self.path_keys: List[Tuple[int, str]] = []
+        self.path_counts: List[float] = []
+        self.constants: Dict[ast.AST, Dict[str, ast.expr]] = {}  # Scope -> single assignments
+        self.scales: Dict[ast.AST, Dict[str, float]] = {}  # Function -> comprehension factor per call name
+        self.estimate()
+
+    def estimate(self):
+        tracer = self.tracer
+        graph = tracer.graph
+        if tracer.entry_node is None:
+            return
+        entry = tracer.entry_node.index
+        root = graph.children(entry)[0]
+        for index in (entry, root, tracer.end_node.index):
+            self.counts[index] = 1.0
+        work = [(root, self.add_path(-1, graph.label(root), 1.0))]
+        while work:
+            index, path = work.pop()
+            call = graph.collapsed.get(index)
+            if call is None:
+                continue
+            # Measure the body before the calls in it are expanded, while
+            # each still leads straight to the rest of the body
+            body = tracer.expand(index)
+            for node in self.propagate(index, body, call.func_def):
+                work.append((node, self.add_path(path, graph.label(node), self.counts[node])))
+        self.hottest = max(self.counts.values())
+
+    def add_path(self, parent: int, label: str, count: float) -> int:
+        key = (parent, label)
+        path = self.path_ids.get(key)
+        if path is None:
+            path = self.path_ids[key] = len(self.path_keys)
+            self.path_keys.append(key)
+            self.path_counts.append(0.0)
+        self.path_counts[path] += count
+        return path
+
+    def propagate(self, root: int, body: range, func_def: ast.AST) -> List[int]:
+        """Count the nodes of one body from its FUNCTION node; returns its calls"""
+        graph = self.tracer.graph
+        scales = self.comprehension_scales(func_def)
+        types = [graph.node_type(index) for index in body]
+        if "LOOP_START" not in types and "CONDITION" not in types:
+            # Straight-line bodies, the most common, run as often as they are called
+            count = self.counts[root]
+            calls = []
+            for index, node_type in zip(body, types):
+                if node_type == "FUNCTION":
+                    self.counts[index] = count * scales.get(graph.label(index).rpartition(".")[2], 1.0)
+                    calls.append(index)
+                else:
+                    self.counts[index] = count
+            return calls
+
+        # Depth-first over the body, finding the edges that close loops
+        order = []
+        back = set()
+        on_stack = {root}
+        done = set()
+        stack = [root]
+        positions = [0]
+        while stack:
+            index = stack[-1]
+            children = graph.children(index)
+            position = positions[-1]
+            if position < len(children):
+                positions[-1] = position + 1
+                child = children[position]
+                if child not in body:
+                    continue
+                if child in on_stack:
+                    back.add((index, child))
+                elif child not in done:
+                    on_stack.add(child)
+                    stack.append(child)
+                    positions.append(0)
+                continue
+            stack.pop()
+            positions.pop()
+            on_stack.discard(index)
+            done.add(index)
+            order.append(index)
+
+        flow = {root: self.counts[root]}
+        calls = []
+        for index in reversed(order):
+            count = flow.get(index, 0.0)
+            node_type = graph.node_type(index)
+            if index != root:
+                if node_type == "FUNCTION":
+                    self.counts[index] = count * scales.get(graph.label(index).rpartition(".")[2], 1.0)
+                    calls.append(index)
+                else:
+                    self.counts[index] = count
+            children = graph.children(index)
+            forward = [c for c in children if c in body and (index, c) not in back]
+            for child in forward:
+                if node_type == "LOOP_START" and child == children[0]:
+                    # The first child of a loop is its body, the others follow the loop
+                    share = count * self.loop_trips(graph.ast_nodes.get(index), func_def)
+                elif node_type == "CONDITION":
+                    share = count / len(forward)
+                else:
+                    share = count
+                flow[child] = flow.get(child, 0.0) + share
+        return calls
+
+    def scope_constants(self, scope: ast.AST) -> Dict[str, ast.expr]:
+        constants = self.constants.get(scope)
+        if constants is None:
+            if isinstance(scope, ast.Module):
+                # Module constants are assigned at the top level
+                nodes = [n for stmt in scope.body if not isinstance(stmt, SCOPES) for n in ast.walk(stmt)]
+            else:
+                nodes = scope_nodes(scope)
+            constants = self.constants[scope] = single_assignments(nodes)
+        return constants
+
+    def evaluator(self, func_def: ast.AST) -> Constants:
+        scopes = [self.scope_constants(func_def)]
+        module = self.tracer.symbols.owners.get(func_def)
+        info = self.tracer.symbols.modules.get(module) if module else None
+        if info is not None:
+            scopes.append(self.scope_constants(info.tree))
+        return Constants(*scopes)
+
+    def loop_trips(self, loop: Optional[ast.AST], func_def: ast.AST) -> float:
+        """Estimated iterations of a loop of func_def"""
+        if isinstance(loop, (ast.For, ast.AsyncFor)):
+            size = self.evaluator(func_def).size(loop.iter)
+            if size is not None:
+                return float(size)
+        return float(self.default_trips)
+
+    def comprehension_scales(self, func_def: ast.AST) -> Dict[str, float]:
+        """Factor for the calls of func_def that are made in comprehensions only"""
+        scales = self.scales.get(func_def)
+        if scales is not None:
+            return scales
+        constants = None  # Only functions with comprehensions need them
+        factors: Dict[str, List[float]] = {}
+        stack = [(child, 1.0) for child in ast.iter_child_nodes(func_def)]
+        while stack:
+            node, factor = stack.pop()
+            if isinstance(node, SCOPES):
+                continue
+            if isinstance(node, COMPREHENSIONS):
+                if constants is None:
+                    constants = self.evaluator(func_def)
+                inner = factor
+                for generator in node.generators:
+                    stack.append((generator.iter, inner))
+                    size = constants.size(generator.iter)
+                    inner *= self.default_trips if size is None else size
+                    stack.extend((condition, inner) for condition in generator.ifs)
+                parts = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+                stack.extend((part, inner) for part in parts)
+                continue
+            if isinstance(node, ast.Call):
+                name = call_name(node)
+                if name is not None:
+                    factors.setdefault(name, []).append(factor)
+            stack.extend([(child, factor) for child in ast.iter_child_nodes(node)])
+        scales = self.scales[func_def] = {
+            name: min(values) for name, values in factors.items() if min(values) != 1.0
+        }
+        return scales
+
+    def path_labels(self, path: int) -> List[str]:
+        labels = []
+        while path >= 0:
+            path, label = self.path_keys[path]
+            labels.append(label)
+        return labels[::-1]
+
+    def hot_paths(self, top: int = 10) -> List[Tuple[List[str], float]]:
+        """The top call paths from main by estimated count, summed over call sites"""
+        ranked = heapq.nlargest(top, range(len(self.path_counts)), key=self.path_counts.__getitem__)
+        return [(self.path_labels(path), self.path_counts[path]) for path in ranked]
+
+    def function_counts(self) -> Dict[str, float]:
+        """Estimated calls of each name, hottest first"""
+        graph = self.tracer.graph
+        totals: Dict[str, float] = {}
+        for index, count in self.counts.items():
+            if graph.node_type(index) == "FUNCTION":
+                label = graph.label(index)
+                totals[label] = totals.get(label, 0.0) + count
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+    def heat(self, index: int) -> float:
+        """Count of a node on a logarithmic scale from 0 (once or never) to 1 (hottest)"""
+        if self.hottest <= 1.0:
+            return 0.0
+        return max(0.0, math.log(max(self.counts.get(index, 0.0), 1.0)) / math.log(self.hottest))
+
+
+def heat_color(heat: float) -> str:
+    """Graphviz HSV fill from pale yellow (0) to red (1)"""
+    return f"{0.17 * (1 - heat):.3f} {0.1 + 0.8 * heat:.3f} 1.000"
+
+
+def estimate_file(path: str, default_trips: int = DEFAULT_TRIPS, **options) -> HeatMap:
+    """Trace a file lazily and estimate how often each node runs.
+
+    ``options`` are passed to PythonCallTrace (``lazy`` is always set).
+    """
+    tracer = PythonCallTrace(lazy=True, **options)
+    tracer.analyze_file(path)
+    return HeatMap(tracer, default_trips)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Estimate the hottest call paths of a Python file without running it."
+    )
+    parser.add_argument("path", help="source file to trace")
+    parser.add_argument("-f", "--format", choices=("text", "json"), default="text",
+                        help="report format (default: text)")
+    parser.add_argument("--top", type=int, default=10, help="call paths to list (default: 10)")
+    parser.add_argument("--default-trips", type=int, default=DEFAULT_TRIPS,
+                        help=f"iterations of loops of unknown size (default: {DEFAULT_TRIPS})")
+    parser.add_argument("--coverage", choices=COVERAGE_MODES, default="full",
+                        help="statements traced (default: full, which includes comprehensions)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    heat = estimate_file(args.path, args.default_trips, coverage=args.coverage)
+    paths = heat.hot_paths(args.top)
+    if args.format == "json":
+        report: Dict[str, Union[List[Any], Dict[str, float]]] = {
+            "hot_paths": [{"path": labels, "count": count} for labels, count in paths],
+            "functions": heat.function_counts(),
+        }
+        print(json.dumps(report, indent=2))
+    else:
+        for labels, count in paths:
+            print(f"{count:>12g}  {' > '.join(labels)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,243 @@
-from python_call_trace import PythonCallTrace
-from graphing import GraphBuilder
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional, Dict, List, Any
+from python_call_trace import PythonCallTrace, SUMMARY_MODES, COVERAGE_MODES, LABEL_LIMITS
+from trace_cache import DefinitionCache, CACHE_DIR_ENV
+from trace_stats import TraceStats
+from trace_budget import TraceBudget
+from exporters import EXPORT_FORMATS, export_file, export_graph
+from compaction import COMPACTION_LEVELS, compact_graph
 
 
-def main():
+BUDGET_OPTIONS = ("max_depth", "max_nodes", "max_seconds", "max_expansions")
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """Resolve files, directories (searched recursively) and glob patterns"""
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.py"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True) or [pattern]
+        for path in sorted(matches):
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def trace_file(path: str, options: Dict[str, Any], source: Optional[str] = None) -> Dict[str, Any]:
+    """Trace one file and describe the result; runs in a worker process.
+
+    With `source` the text is traced instead of reading `path`, which then
+    only names the module.
+    """
+    start = time.perf_counter()
+    report = {"file": path, "function_defs": [], "visit_log": [], "nodes": 0, "error": None}
+    try:
+        cache = options.get("cache")
+        if cache is None and options.get("cache_dir"):
+            cache = DefinitionCache(options["cache_dir"])
+        stats = TraceStats() if options.get("stats") else None
+        limits = {name: options.get(name) for name in BUDGET_OPTIONS}
+        budget = TraceBudget(**limits) if any(v is not None for v in limits.values()) else None
+        label_limits = None
+        if options.get("label_limit") is not None:
+            # 0 keeps labels whole
+            label_limits = dict.fromkeys(LABEL_LIMITS, options["label_limit"] or None)
+        tracer = PythonCallTrace(
+            summary_mode=options.get("summary_mode", "copy"),
+            coverage=options.get("coverage", "legacy"),
+            cache=cache,
+            stats=stats,
+            budget=budget,
+            label_limits=label_limits,
+            low_memory=options.get("low_memory", False),
+        )
+        if source is None:
+            tracer.analyze_file(path)
+        else:
+            tracer.analyze_source(source, path)
+        report["function_defs"] = list(tracer.function_defs.keys())
+        report["visit_log"] = tracer.visit_log
+        report["nodes"] = len(tracer.graph)
+
+        entry = tracer.entry_node
+        if options.get("compact"):
+            with tracer.phase("compaction"):
+                entry = compact_graph(entry, options["compact"])
+            report["compacted_nodes"] = len(entry.graph)
+        if options.get("graph_dir"):
+            fmt = options.get("graph_format", "dot")
+            output_file = graph_path(options["graph_dir"], path, "pctg" if fmt == "binary" else fmt)
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            filename = os.path.splitext(os.path.basename(path))[0]
+            with tracer.phase("export"):
+                export_file(entry, output_file, fmt, f"{filename} - Execution Flow Graph")
+            report["graph"] = output_file
+        elif options.get("graph_inline"):
+            buffer = io.StringIO()
+            with tracer.phase("export"):
+                export_graph(entry, buffer, options.get("graph_format", "dot"))
+            report["graph"] = buffer.getvalue()
+        if stats is not None:
+            report["stats"] = stats.report(options.get("stats_top", 0))
+        if budget is not None:
+            report["truncated"] = tracer.truncation_report()
+    except Exception as error:
+        # One pathological file (RecursionError, TypeError, ...) must not end the batch
+        report["error"] = f"{type(error).__name__}: {error}"
+    report["seconds"] = round(time.perf_counter() - start, 6)
+    return report
+
+
+def graph_path(graph_dir: str, path: str, extension: str) -> str:
+    """Export file of a traced file, mirroring its directories under graph_dir"""
+    relative = os.path.relpath(path)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        # Outside the working directory: mirror the absolute path instead
+        relative = os.path.abspath(path).lstrip(os.sep)
+    return os.path.join(graph_dir, f"{os.path.splitext(relative)[0]}.{extension}")
+
+
+def run_batch(paths: List[str], options: Dict[str, Any], jobs: int, out, fmt: str) -> int:
+    """Trace files on a worker pool and write a JSON or NDJSON report.
+
+    NDJSON lines are written as files finish; the JSON report lists files in
+    input order. Returns the number of files that failed.
+    """
+    start = time.perf_counter()
+    reports: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+
+    def emit(i: int, report: Dict[str, Any]):
+        reports[i] = report
+        if fmt == "ndjson":
+            out.write(json.dumps(report) + "\n")
+            out.flush()
+
+    if jobs == 1 or len(paths) < 2:
+        for i, path in enumerate(paths):
+            emit(i, trace_file(path, options))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(trace_file, path, options): i for i, path in enumerate(paths)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    report = future.result()
+                except Exception as error:  # The worker itself died, e.g. BrokenProcessPool
+                    report = {"file": paths[i], "function_defs": [], "visit_log": [], "nodes": 0,
+                              "error": f"{type(error).__name__}: {error}", "seconds": 0.0}
+                emit(i, report)
+
+    if fmt == "json":
+        json.dump(
+            {"files": reports, "seconds": round(time.perf_counter() - start, 6)},
+            out,
+            indent=2,
+        )
+        out.write("\n")
+    return sum(1 for report in reports if report["error"])
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Trace the possible call order of Python files starting from main()."
+    )
+    parser.add_argument("paths", nargs="*", help="files, directories or glob patterns to trace")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("-f", "--format", choices=("json", "ndjson"), default="json",
+                        help="report format (default: json)")
+    parser.add_argument("-o", "--output", help="write the report to a file instead of stdout")
+    parser.add_argument("--graph-dir", help="also export each flow graph into this directory")
+    parser.add_argument("--graph-format", choices=EXPORT_FORMATS, default="dot",
+                        help="format of exported flow graphs (default: dot)")
+    parser.add_argument("--cache-dir", default=os.environ.get(CACHE_DIR_ENV),
+                        help=f"on-disk definition cache (default: ${CACHE_DIR_ENV})")
+    parser.add_argument("--summary-mode", choices=SUMMARY_MODES, default="copy",
+                        help="how cached function bodies are replayed (default: copy)")
+    parser.add_argument("--coverage", choices=COVERAGE_MODES, default="legacy",
+                        help="statements traced: legacy follows calls, ifs and loops only, full "
+                             "also try, with, match, async code and every expression (default: legacy)")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="keep source spans instead of syntax trees once each file is traced")
+    parser.add_argument("--compact", type=int, choices=tuple(COMPACTION_LEVELS), default=0,
+                        help="compact exported graphs: 1 prunes empty ifs and loops, 2 also "
+                             "collapses runs of calls, 3 also merges identical sub-graphs")
+    parser.add_argument("--label-limit", type=int, metavar="N",
+                        help="truncate condition and loop labels of exported graphs after N "
+                             "characters, 0 for no limit (default: 15 and 25)")
+    parser.add_argument("--stats", nargs="?", type=int, const=0, metavar="TOP",
+                        help="include phase timings and per-function counters in the "
+                             "report, listing only the TOP busiest functions if given")
+    parser.add_argument("--max-depth", type=int, help="stop expanding calls nested deeper than this")
+    parser.add_argument("--max-nodes", type=int, help="stop each trace once its graph has this many nodes")
+    parser.add_argument("--max-seconds", type=float, help="stop each simulation after this many seconds")
+    parser.add_argument("--max-expansions", type=int,
+                        help="expand each function's body at most this many times")
+    return parser.parse_args(argv)
+
+
+def interactive():
+    from graphing import GraphBuilder
+
     # Input and Output handling
     input_file = str(input("Please give path to source file: ")).strip()
     filename = input_file.split("/")[-1].split(".")[0]
     output_file = f"output/{filename}"
 
     # our Python Call Tracer
-    tracer = PythonCallTrace()
+    cache = DefinitionCache() if os.environ.get(CACHE_DIR_ENV) else None
+    tracer = PythonCallTrace(cache=cache)
     tracer.analyze_file(input_file)
 
     # Build Graph based on tracer's state
     graph = GraphBuilder(f"{filename} - Execution Flow Graph", tracer)
-    graph.create_visual_graph(output_file)
+    graph.create_visual_graph(output_file, view=True)
 
     print(f"Execution flow graph has been generated as '{output_file}.png'")
 
 
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.paths:
+        interactive()
+        return 0
+
+    paths = expand_paths(args.paths)
+    if args.graph_dir:
+        os.makedirs(args.graph_dir, exist_ok=True)
+    options = {
+        "cache_dir": args.cache_dir,
+        "summary_mode": args.summary_mode,
+        "coverage": args.coverage,
+        "low_memory": args.low_memory,
+        "graph_dir": args.graph_dir,
+        "graph_format": args.graph_format,
+        "label_limit": args.label_limit,
+        "compact": args.compact,
+        "stats": args.stats is not None,
+        "stats_top": args.stats or 0,
+    }
+    options.update((name, getattr(args, name)) for name in BUDGET_OPTIONS)
+
+    jobs = max(1, args.jobs)
+    if args.output:
+        with open(args.output, "w") as out:
+            failures = run_batch(paths, options, jobs, out, args.format)
+    else:
+        failures = run_batch(paths, options, jobs, sys.stdout, args.format)
+    return 1 if failures else 0
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
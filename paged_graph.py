@@ -0,0 +1,227 @@
+import argparse
+import html
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Tuple
+import graphviz
+from python_call_trace import PythonCallTrace
+from exporters import NODE_STYLES, DEFAULT_STYLE, dot_quote
+from hotness import HeatMap, heat_color
+
+DEFAULT_PAGE_SIZE = 400  # Nodes per page; dot lays out pages this size in well under a second
+RENDER_FORMATS = ("svg", "png", "pdf")
+STUB_STYLE = {"shape": "note", "style": "dashed", "fontcolor": "gray30"}
+TOP_LEVEL = -1  # Owner of the nodes outside every body: entry, main and end
+
+
+class PagedGraph:
+    """Flow graph of a lazy trace split into pages at function boundaries.
+
+    Every body is expanded and kept whole on one page, drawn as a cluster
+    named after its function. Pages are filled depth first along the call
+    tree, so callees share their caller's page while it has room; bodies
+    that do not fit go to an overflow page of the caller's page, which the
+    next ones fill in turn. Edges between pages end in link stubs naming
+    the other page. Each page has at most ``page_size`` nodes unless one
+    body alone is larger, so laying out all the pages takes time linear in
+    the size of the graph.
+    """
+
+    def __init__(self, tracer: PythonCallTrace, page_size: int = DEFAULT_PAGE_SIZE,
+                 heat: Optional[HeatMap] = None):
+        if not tracer.lazy:
+            raise ValueError("PagedGraph needs a lazy trace")
+        if tracer.entry_node is None:
+            raise ValueError("No Entry Node found which infers no 'main' function present in file")
+        self.tracer = tracer
+        self.page_size = page_size
+        self.heat = heat
+        self.owner: Dict[int, int] = {}  # Node -> FUNCTION node whose body holds it
+        self.page_of: Dict[int, int] = {}
+        self.pages: List[List[int]] = []  # Nodes of each page
+        self.page_bodies: List[List[int]] = []  # FUNCTION nodes whose bodies are on each page
+        self.overflow: Dict[int, int] = {}  # Page -> page taking the bodies it has no room for
+        self.paginate()
+
+    def new_page(self) -> int:
+        self.pages.append([])
+        self.page_bodies.append([])
+        return len(self.pages) - 1
+
+    def place(self, page: int, size: int) -> int:
+        """Page for a body of size nodes called from page"""
+        if not self.pages[page] or len(self.pages[page]) + size <= self.page_size:
+            return page
+        target = self.overflow.get(page)
+        if target is None or len(self.pages[target]) + size > self.page_size:
+            target = self.overflow[page] = self.new_page()
+        return target
+
+    def add(self, page: int, nodes, owner: int):
+        for index in nodes:
+            self.owner[index] = owner
+            self.page_of[index] = page
+        self.pages[page].extend(nodes)
+
+    def paginate(self):
+        tracer = self.tracer
+        graph = tracer.graph
+        entry = tracer.entry_node.index
+        root = graph.children(entry)[0]
+        top = self.new_page()
+        self.add(top, [entry, root, tracer.end_node.index], TOP_LEVEL)
+        # Depth first, so that a body is placed right after its caller's
+        work = [root]
+        while work:
+            index = work.pop()
+            body = tracer.expand(index)
+            if body is None:
+                continue
+            page = self.place(self.page_of[index], len(body))
+            self.add(page, body, index)
+            self.page_bodies[page].append(index)
+            work.extend(reversed([i for i in body if graph.node_type(i) == "FUNCTION"]))
+
+    def page_name(self, page: int) -> str:
+        bodies = self.page_bodies[page]
+        return self.tracer.graph.label(bodies[0]) if bodies else "main"
+
+    def node_line(self, index: int, indent: str = "\t") -> str:
+        graph = self.tracer.graph
+        style = NODE_STYLES.get(graph.node_type(index), DEFAULT_STYLE)
+        if self.heat is not None:
+            count = self.heat.counts.get(index, 0.0)
+            style = dict(style, style="filled", fillcolor=dot_quote(heat_color(self.heat.heat(index))),
+                         tooltip=dot_quote(f"about {count:g} runs"))
+        attributes = "".join(f" {key}={value}" for key, value in style.items())
+        return f"{indent}{index} [label={dot_quote(graph.label(index))}{attributes}]\n"
+
+    def page_source(self, page: int, fmt: str = "svg") -> str:
+        """DOT text of one page: a cluster per body and stubs for edges leaving the page"""
+        graph = self.tracer.graph
+        lines = [f"// page {page}: {self.page_name(page)}\ndigraph {dot_quote(f'page {page}')} {{\n\trankdir=TB\n"]
+        clusters: Dict[int, List[int]] = {}
+        for index in self.pages[page]:
+            clusters.setdefault(self.owner[index], []).append(index)
+        for owner, nodes in clusters.items():
+            if owner == TOP_LEVEL:
+                lines.extend(self.node_line(index) for index in nodes)
+                continue
+            lines.append(f"\tsubgraph cluster_{owner} {{\n\t\tlabel={dot_quote(graph.label(owner))}\n"
+                         "\t\tstyle=rounded\n")
+            lines.extend(self.node_line(index, "\t\t") for index in nodes)
+            lines.append("\t}\n")
+
+        stubs: Dict[Tuple[str, int, int], str] = {}  # (direction, other page, node) -> stub id
+
+        def stub(direction: str, other: int, index: int, label: str) -> str:
+            key = (direction, other, index)
+            name = stubs.get(key)
+            if name is None:
+                name = stubs[key] = f"{direction}_{other}_{index}"
+                attributes = "".join(f" {key}={value}" for key, value in STUB_STYLE.items())
+                text = f"page {other}: {label}"
+                lines.append(f"\t{name} [label={dot_quote(text)} URL={dot_quote(f'page_{other}.{fmt}')}"
+                             f"{attributes}]\n")
+            return name
+
+        for index in self.pages[page]:
+            for child in graph.children(index):
+                other = self.page_of.get(child, page)
+                if other == page:
+                    lines.append(f"\t{index} -> {child}\n")
+                else:
+                    lines.append(f"\t{index} -> {stub('to', other, child, graph.label(child))}\n")
+            for parent in graph.parents(index):
+                other = self.page_of.get(parent, page)
+                if other != page:
+                    lines.append(f"\t{stub('from', other, parent, graph.label(parent))} -> {index}\n")
+        lines.append("}\n")
+        return "".join(lines)
+
+    def index_html(self, title: str, fmt: str = "svg") -> str:
+        """Index of the pages with the functions drawn on each"""
+        graph = self.tracer.graph
+        rows = []
+        for page, nodes in enumerate(self.pages):
+            names = sorted({graph.label(owner) for owner in self.page_bodies[page]})
+            shown = ", ".join(names[:8]) + (f" and {len(names) - 8} more" if len(names) > 8 else "")
+            rows.append(f'<tr><td><a href="page_{page}.{fmt}">page {page}</a></td>'
+                        f"<td>{len(nodes)}</td><td>{html.escape(shown)}</td></tr>")
+        return (
+            f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>\n"
+            f"<body><h1>{html.escape(title)}</h1>\n"
+            f"<p>{len(graph)} nodes on {len(self.pages)} pages</p>\n"
+            "<table><tr><th>Page</th><th>Nodes</th><th>Functions</th></tr>\n"
+            + "\n".join(rows) + "\n</table></body></html>\n"
+        )
+
+    def write(self, output_dir: str, title: str, fmt: str = "svg", jobs: Optional[int] = 1,
+              render: bool = True) -> List[str]:
+        """Write page_N.dot for every page and index.html; with render,
+        also page_N.<fmt>, laid out on ``jobs`` worker processes (None for
+        every core). Returns the paths of the page files.
+        """
+        if fmt not in RENDER_FORMATS:
+            raise ValueError(f"Unknown page format {fmt!r}, expected one of {RENDER_FORMATS}")
+        os.makedirs(output_dir, exist_ok=True)
+        sources = [os.path.join(output_dir, f"page_{page}.dot") for page in range(len(self.pages))]
+        for page, path in enumerate(sources):
+            with open(path, "w") as fp:
+                fp.write(self.page_source(page, fmt))
+        with open(os.path.join(output_dir, "index.html"), "w") as fp:
+            fp.write(self.index_html(title, fmt))
+        if not render:
+            return sources
+
+        outputs = [os.path.splitext(path)[0] + f".{fmt}" for path in sources]
+        if jobs == 1 or len(sources) < 2:
+            for source, output in zip(sources, outputs):
+                render_page(source, output, fmt)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                list(pool.map(render_page, sources, outputs, [fmt] * len(sources)))
+        return outputs
+
+
+def render_page(source: str, output: str, fmt: str):
+    """Lay out one DOT file with dot; runs in a worker process"""
+    with open(source, "rb") as fp:
+        data = graphviz.pipe("dot", fmt, fp.read())
+    with open(output, "wb") as fp:
+        fp.write(data)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Render the flow graph of a Python file as linked pages of per-function clusters."
+    )
+    parser.add_argument("path", help="source file to trace")
+    parser.add_argument("output_dir", help="directory for the pages and index.html")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"nodes per page (default: {DEFAULT_PAGE_SIZE})")
+    parser.add_argument("-f", "--format", choices=RENDER_FORMATS, default="svg",
+                        help="format of rendered pages; svg keeps the links (default: svg)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="pages laid out in parallel (default: all cores)")
+    parser.add_argument("--no-render", action="store_true", help="only write the DOT pages and the index")
+    parser.add_argument("--heat", action="store_true", help="color nodes by estimated execution count")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    tracer = PythonCallTrace(lazy=True, coverage="full" if args.heat else "legacy")
+    tracer.analyze_file(args.path)
+    heat = HeatMap(tracer) if args.heat else None
+    paged = PagedGraph(tracer, args.page_size, heat)
+    name = os.path.splitext(os.path.basename(args.path))[0]
+    paths = paged.write(args.output_dir, f"{name} - Execution Flow Graph", args.format,
+                        max(1, args.jobs), not args.no_render)
+    print(f"{len(paths)} pages written to {args.output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import ast
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Tuple, Union
+from flow_node import FlowNode
+from python_call_trace import PythonCallTrace, split_lines
+from symbol_table import ModuleInfo, parse_module, dotted_name, walk_statements
+
+# Directories that never hold project sources
+SKIPPED_DIRS = {"__pycache__", "venv", ".venv", "env", "build", "dist", "node_modules"}
+
+
+def discover_modules(root: str) -> List[Tuple[str, str, bool]]:
+    """List (path, module name, is_package) for every Python file under root.
+
+    If the root itself is a package (has an ``__init__.py``) its directory
+    name is used as the top-level package, so absolute imports of the form
+    ``import root.module`` resolve.
+    """
+    root = os.path.abspath(root)
+    prefix = []
+    if os.path.isfile(os.path.join(root, "__init__.py")):
+        prefix = [os.path.basename(root)]
+
+    modules = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            d for d in dirnames if d not in SKIPPED_DIRS and not d.startswith(".")
+        )
+        rel = os.path.relpath(dirpath, root)
+        package = prefix + ([] if rel == "." else rel.split(os.sep))
+        for filename in sorted(filenames):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            if filename == "__init__.py":
+                if package:
+                    modules.append((path, ".".join(package), True))
+            else:
+                modules.append((path, ".".join(package + [filename[:-3]]), False))
+    return modules
+
+
+class ModuleIndex:
+    """What a worker reports about a module: its top-level functions and the
+    modules it imports, small enough to send back instead of the tree"""
+
+    def __init__(self, info: ModuleInfo):
+        self.name = info.name
+        self.path = info.path
+        self.is_package = info.is_package
+        self.functions = set(info.functions)
+        # Full dotted names, so `import a.b` reaches a.b and not only a
+        self.imported: List[str] = list(info.star_imports)
+        for node in walk_statements(info.tree):
+            if isinstance(node, ast.Import):
+                self.imported.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                source = info.absolute_module(node.module, node.level)
+                if source is not None:
+                    self.imported.append(source)
+                    # `from package import module` names a submodule
+                    self.imported.extend(f"{source}.{alias.name}" for alias in node.names)
+
+
+def index_or_error(path: str, name: str, is_package: bool) -> Union[ModuleIndex, str]:
+    """Parse and index a module in a worker, returning the error text instead of raising"""
+    try:
+        return ModuleIndex(parse_module(path, name, is_package))
+    except (SyntaxError, UnicodeDecodeError, OSError) as error:
+        return str(error)
+
+
+class ProjectCallTrace(PythonCallTrace):
+    """Traces `main` across every module of a project.
+
+    Modules are indexed in parallel worker processes, which send back
+    only their top-level functions and imports. The modules the entry
+    module imports, directly or not, are then parsed again in-process,
+    collected into a global ``SymbolTable``, and calls are resolved in the
+    namespace of the module whose function is being simulated, honoring
+    ``import`` and ``from ... import`` aliases. Syntax trees are never sent
+    between processes: unpickling one costs as much as parsing the source.
+    """
+
+    def __init__(self, summary_mode: str = "copy", workers: Optional[int] = None, low_memory: bool = False):
+        super().__init__(summary_mode, low_memory=low_memory)
+        self.workers = workers  # None uses every core, 1 indexes in-process
+        self.entry_module: Optional[str] = None
+        self.errors: Dict[str, str] = {}  # Path -> parse error
+        self.source_path: Optional[str] = None  # Module whose lines are in source_lines
+
+    def index_modules(self, modules: List[Tuple[str, str, bool]]) -> Dict[str, ModuleIndex]:
+        """Index modules by name, spreading the parsing over a process pool"""
+        if self.workers == 1 or len(modules) < 2:
+            results = [index_or_error(*module) for module in modules]
+        else:
+            workers = self.workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(modules) // (workers * 4))
+                results = pool.map(
+                    index_or_error,
+                    [m[0] for m in modules],
+                    [m[1] for m in modules],
+                    [m[2] for m in modules],
+                    chunksize=chunksize,
+                )
+                results = list(results)
+
+        indexes = {}
+        for (path, name, _), result in zip(modules, results):
+            if isinstance(result, ModuleIndex):
+                indexes[name] = result
+            else:
+                self.errors[path] = result
+        return indexes
+
+    def imported_modules(self, modules: Dict[str, ModuleIndex], start: str) -> List[str]:
+        """Modules loaded by importing start: the ones it imports, directly
+        or not, and every package enclosing one of them"""
+        seen = {start}
+        work = [start]
+        while work:
+            info = modules[work.pop()]
+            for target in [info.name] + info.imported:
+                # Importing a.b.c first runs a and a.b
+                parts = target.split(".")
+                for i in range(1, len(parts) + 1):
+                    name = ".".join(parts[:i])
+                    if name in modules and name not in seen:
+                        seen.add(name)
+                        work.append(name)
+        return sorted(seen)
+
+    def analyze_project(self, root: str, entry: str = "main") -> tuple[FlowNode, FlowNode]:
+        """Parse every module under root and simulate execution from the entry function.
+
+        ``entry`` is either a qualified ``module.function`` name or a bare
+        function name, which is looked up in ``__main__``/``main`` modules
+        first and then in module name order.
+        """
+        modules = self.index_modules(discover_modules(root))
+        module_name, func_name = self.find_entry(entry, modules)
+        if module_name is not None:
+            # Modules the entry never imports cannot be called into
+            for name in self.imported_modules(modules, module_name):
+                index = modules[name]
+                try:
+                    info = parse_module(index.path, index.name, index.is_package)
+                except (SyntaxError, UnicodeDecodeError, OSError) as error:
+                    self.errors[index.path] = str(error)
+                    continue
+                self.symbols.add_module(info)
+                if self.low_memory:
+                    self.release_module(info)
+
+        # Flat views of the project for compatibility with single-file tracing
+        for name, info in sorted(self.symbols.modules.items()):
+            for function_name, node in info.functions.items():
+                self.function_defs[f"{name}.{function_name}"] = node
+        self.index_classes()
+        self.build_method_index()
+
+        if module_name is not None:
+            self.entry_module = module_name
+            self.entry_node = self.create_node("ENTRY", "Program Start")
+            self.simulate_function_call(func_name)
+            self.end_node = self.create_node("END", "Program Exit")
+        if self.low_memory:
+            self.release_ast()
+
+        if self.entry_node is None or self.end_node is None:
+            raise ValueError("No entry or end node found")
+        return self.entry_node, self.end_node
+
+    def find_entry(self, entry: str, modules: Dict[str, ModuleIndex]) -> Tuple[Optional[str], str]:
+        """Module defining the entry function, and the function's name in it"""
+        if "." in entry:
+            module_name, _, func_name = entry.rpartition(".")
+            info = modules.get(module_name)
+            if info is not None and func_name in info.functions:
+                return module_name, func_name
+            return None, entry
+
+        def priority(name: str) -> tuple:
+            leaf = name.split(".")[-1]
+            return (leaf != "__main__", leaf != "main", name.count("."), name)
+
+        for module_name in sorted(modules, key=priority):
+            if entry in modules[module_name].functions:
+                return module_name, entry
+        return None, entry
+
+    def create_node(self, node_type: str, label: Optional[str], ast_node: Optional[ast.AST] = None) -> FlowNode:
+        """Create a new flow node; spans of low-memory traces name the module's file"""
+        if self.low_memory and ast_node is not None:
+            info = self.symbols.modules.get(self.current_module())
+            if info is not None:
+                self.graph.file_id = self.graph.add_file(info.path)
+        return super().create_node(node_type, label, ast_node)
+
+    def release_module(self, info: ModuleInfo):
+        """Keep only the definitions of a module, without their bodies.
+
+        Module-level code is never simulated and the symbol table holds
+        every definition, so of all the trees only the bodies being
+        simulated are resident; the others are parsed again on entry.
+        """
+        functions = [node for node in walk_statements(info.tree) if isinstance(node, self.function_types)]
+        for node in functions:
+            node.body = []
+        info.tree.body = []
+
+    def definition_lines(self, func_def: ast.FunctionDef) -> List[str]:
+        """Source lines of the module defining a function, read again from its file"""
+        path = self.symbols.modules[self.symbols.owners[func_def]].path
+        if self.source_path != path or self.source_lines is None:
+            with open(path, "r") as file:
+                self.source_lines = split_lines(file.read())
+            self.source_path = path
+        return self.source_lines
+
+    def current_module(self) -> Optional[str]:
+        """Module whose namespace names are currently resolved in"""
+        func_def = self.current_function()
+        if func_def is None:
+            return self.entry_module
+        return self.symbols.owners.get(func_def, self.entry_module)
+
+    def class_key(self, qualname: str, class_def: ast.ClassDef) -> str:
+        return qualname
+
+    def get_base_classes(self, class_name: str) -> List[str]:
+        """Qualified project base classes of a qualified class name"""
+        class_def = self.symbols.symbols.get(class_name)
+        if not isinstance(class_def, ast.ClassDef):
+            return []
+        module_name = self.symbols.owners[class_def]
+        scope = self.symbols.parents.get(class_def)
+        bases = []
+        for base in class_def.bases:
+            dotted = dotted_name(base)
+            target = dotted and self.symbols.resolve_scoped(scope, module_name, dotted)
+            if target and isinstance(self.symbols.symbols.get(target), ast.ClassDef):
+                bases.append(target)
+        return bases
+
+    def attribute_call_name(self, node: ast.Attribute) -> Optional[str]:
+        """Calls through module aliases (`mod.func()`) resolve into project code,
+        other attribute calls through the class of their receiver"""
+        dotted = dotted_name(node)
+        if dotted is None:
+            return None
+        head = dotted.split(".")[0]
+        module_name = self.current_module()
+        info = self.symbols.modules.get(module_name)
+        if info is None or head not in info.imports:
+            return super().attribute_call_name(node)
+        return dotted if self.qualify(dotted) else None
+
@@ -1,61 +1,1275 @@
 import ast
-from typing import Optional, Dict, Set, List
-from flow_node import FlowNode
+import bisect
+import hashlib
+import math
+import os
+import re
+import time
+from array import array
+from contextlib import nullcontext
+from typing import Optional, Dict, Set, List, Tuple, FrozenSet, Callable, Any, Iterator, Union
+from flow_node import FlowNode, FlowGraph
+from symbol_table import SymbolTable, ModuleInfo, STATEMENT_FIELDS, dotted_name, walk_statements
+
+SUMMARY_MODES = ("off", "copy", "shared")
+
+# Characters of source text kept in labels of each kind before "..."
+LABEL_LIMITS = {"CONDITION": 15, "LOOP_START": 25}
+
+# "legacy" simulates the statements and expressions traced so far; "full"
+# also simulates every other kind that can contain calls
+COVERAGE_MODES = ("legacy", "full")
+
+# Handler method of each statement and expression kind, by AST class. Kinds
+# without a handler simulate to nothing. Tracers bind the table of their
+# coverage mode once, so dispatch costs a dictionary lookup per node.
+LEGACY_STATEMENTS = {
+    ast.If: "step_if_statement",
+    ast.Expr: "step_expression_statement",
+    ast.For: "step_loop",
+    ast.While: "step_loop",
+    ast.Assign: "step_assignment",
+    ast.Return: "step_return",
+    ast.Call: "step_call",
+}
+LEGACY_EXPRESSIONS = {
+    ast.Call: "step_call",
+    ast.Attribute: "step_attribute",
+    ast.JoinedStr: "step_sub_expressions",
+    ast.FormattedValue: "step_formatted_value",
+}
+FULL_STATEMENTS = {
+    **LEGACY_STATEMENTS,
+    ast.If: "step_full_if_statement",
+    ast.Expr: "step_sub_expressions",
+    ast.For: "step_full_for_loop",
+    ast.AsyncFor: "step_full_for_loop",
+    ast.While: "step_full_while_loop",
+    ast.Assign: "step_full_assignment",
+    ast.AugAssign: "step_full_assignment",
+    ast.AnnAssign: "step_full_assignment",
+    ast.Delete: "step_delete",
+    ast.FunctionDef: "step_function_definition",
+    ast.AsyncFunctionDef: "step_function_definition",
+    ast.ClassDef: "step_class_definition",
+    ast.Return: "step_sub_expressions",
+    ast.Raise: "step_sub_expressions",
+    ast.Assert: "step_sub_expressions",
+    ast.With: "step_with",
+    ast.AsyncWith: "step_with",
+    ast.Try: "step_try",
+    ast.Match: "step_match",
+}
+if hasattr(ast, "TryStar"):  # Python 3.11+
+    FULL_STATEMENTS[ast.TryStar] = "step_try"
+FULL_EXPRESSIONS = {
+    **LEGACY_EXPRESSIONS,
+    ast.FormattedValue: "step_sub_expressions",
+    **dict.fromkeys(
+        (
+            ast.BinOp, ast.BoolOp, ast.Compare, ast.UnaryOp, ast.IfExp, ast.Subscript,
+            ast.Slice, ast.Tuple, ast.List, ast.Set, ast.Dict, ast.Starred, ast.NamedExpr,
+            ast.Await, ast.Yield, ast.YieldFrom, ast.Lambda,
+        ),
+        "step_sub_expressions",
+    ),
+    **dict.fromkeys(
+        (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp),
+        "step_list_or_generator_expression",
+    ),
+}
+STATEMENT_HANDLERS = {"legacy": LEGACY_STATEMENTS, "full": FULL_STATEMENTS}
+EXPRESSION_HANDLERS = {"legacy": LEGACY_EXPRESSIONS, "full": FULL_EXPRESSIONS}
+
+
+def split_lines(source: str) -> List[str]:
+    """Lines of source text, numbered the way AST line numbers count them"""
+    return re.split(r"\r\n?|\n", source)
+
+
+class FunctionSummary:
+    """Visit sequence and flow sub-graph produced by simulating one function body.
+
+    Summaries reference ranges of the tracer's append-only logs rather than
+    copying them: visits ``[visit_start, visit_end)`` of ``visit_log``, the
+    call signatures ``[entered_start, entered_end)`` of ``entered_calls`` and
+    the node ids ``[start, end)`` of ``graph``. ``head`` is the id of the
+    first node of the body and ``tail`` of the node the caller continues
+    from (both ``None`` for an empty body).
+    """
+
+    def __init__(
+        self,
+        visit_start: int,
+        visit_end: int,
+        entered_start: int,
+        entered_end: int,
+        start: int,
+        end: int,
+        head: Optional[int],
+        tail: Optional[int],
+        super_out: bool,
+    ):
+        self.visit_start = visit_start
+        self.visit_end = visit_end
+        self.entered_start = entered_start
+        self.entered_end = entered_end
+        self.start = start
+        self.end = end
+        self.head = head
+        self.tail = tail
+        self.super_out = super_out  # in_super_call state after the body
+        self.expanded: Optional[FrozenSet[str]] = None  # Built on first replay
+        self.height = 0  # Deepest nesting of bodies below this one
+        # Summaries kept by update_file carry their own logs, since the
+        # trace's logs are rebuilt
+        self.visits: Optional[List[str]] = None
+        self.entered: Optional[List[str]] = None
+        self.instance: Optional[int] = None  # Body it records, in the instance records
+
+
+class LazyCall:
+    """A call whose body a lazy trace has not simulated yet.
+
+    ``parent`` is the call whose body contains this one (None for ``main``);
+    the chain of parents is the stack of pending calls at the call site.
+    """
+
+    __slots__ = ("name", "func_def", "in_super_call", "signature", "parent")
+
+    def __init__(
+        self,
+        name: str,
+        func_def: ast.FunctionDef,
+        in_super_call: bool,
+        signature: str,
+        parent: Optional["LazyCall"],
+    ):
+        self.name = name
+        self.func_def = func_def
+        self.in_super_call = in_super_call
+        self.signature = signature
+        self.parent = parent
+
 
 class PythonCallTrace(ast.NodeVisitor):
-    def __init__(self):
-        self.function_defs: Dict[str, ast.FunctionDef] = {}  # Track function definitions
-        self.class_defs: Dict[str, ast.ClassDef] = {}  # Track class definitions
+    """Simulates execution from ``main`` on an explicit worklist.
+
+    Every ``simulate_*`` step pushes the work it depends on onto
+    ``self.tasks`` instead of recursing, so the depth of the traced program
+    is bounded by memory rather than by the interpreter stack. Tasks are
+    ``(handler, args)`` pairs popped in LIFO order; ``push`` queues them so
+    that the first one given runs first.
+    """
+
+    def __init__(
+        self,
+        summary_mode: str = "copy",
+        cache=None,
+        stats=None,
+        budget=None,
+        lazy: bool = False,
+        label_limits: Optional[Dict[str, Optional[int]]] = None,
+        coverage: str = "legacy",
+        low_memory: bool = False,
+    ):
+        if summary_mode not in SUMMARY_MODES:
+            raise ValueError(f"summary_mode must be one of {SUMMARY_MODES}")
+        if coverage not in COVERAGE_MODES:
+            raise ValueError(f"coverage must be one of {COVERAGE_MODES}")
+        if low_memory and lazy:
+            raise ValueError("A lazy trace needs the AST nodes that low_memory releases")
+        self.function_defs: Dict[str, ast.FunctionDef] = {}  # Every function by bare name, for display
+        self.class_defs: Dict[str, ast.ClassDef] = {}  # Class key -> definition
+        # Scope-aware definitions by qualified name; names are resolved in the
+        # scope of the body being simulated and cached per (scope, name)
+        self.symbols = SymbolTable()
+        self.module_name: Optional[str] = None
+        self.tree: Optional[ast.Module] = None
+        self.class_keys: Dict[ast.ClassDef, str] = {}
+        self.resolved: Dict[Tuple[Optional[ast.AST], str], Optional[str]] = {}
+        self.receiver_types: Dict[ast.AST, Dict[str, Optional[str]]] = {}
         self.current_node = None
         self.entry_node = None
         self.end_node = None
         self.visited_calls: Set[str] = set()  # Track pending function calls
         self.visit_log: List[str] = list()  # Persistent visit_log for testing
         self.in_super_call = False  # Track if we're inside a super() call
+        # Low-memory traces keep source spans in the graph instead of AST
+        # nodes and release the tree once main has been traced
+        self.low_memory = low_memory
+        self.graph = FlowGraph(low_memory)  # Every node created, ids in creation order
+        self.tasks: List[Tuple[Callable[..., Any], tuple]] = []  # Simulation worklist
+        # "copy" clones a cached body sub-graph at each call site, "shared"
+        # links call sites to a single sub-graph, "off" re-simulates bodies
+        self.summary_mode = summary_mode
+        self.summaries: Dict[Tuple[ast.FunctionDef, bool], FunctionSummary] = {}
+        self.entered_calls: List[str] = []  # Signature of every body entered, in order
+        # [signature, shallowest cut depth, definition, key, height]
+        self.call_frames: List[list] = []
+        self.cache = cache  # Optional trace_cache.DefinitionCache
+        # Every body simulated or replayed by an eager trace, in order:
+        # [parent, node start, node end, visit start, visit end, head, tail,
+        # summary replayed, summary recorded], and the open bodies
+        self.instances: Optional[List[list]] = None
+        self.open_instances: List[int] = []
+        # While update_file re-traces: the previous records and where each
+        # one's contained records end, the bodies they left in the graph that
+        # a replay can link in place, by summary, as (first, end) record ids
+        # in copy mode and as the record that simulated it in shared mode,
+        # and (node count, start, end) of each old node range moved
+        self.previous_instances: List[list] = []
+        self.previous_ends: List[int] = []
+        self.reusable: Dict[FunctionSummary, List[Tuple[int, int]]] = {}
+        self.unplaced: Dict[FunctionSummary, int] = {}
+        self.reused_runs: List[Tuple[int, int, int]] = []
+        # Direct dependencies of each simulated body, used by update_file:
+        # names it looked up and summary keys of the functions it called
+        self.summary_lookups: Dict[Tuple[ast.FunctionDef, bool], Set[str]] = {}
+        self.summary_callees: Dict[Tuple[ast.FunctionDef, bool], Set[tuple]] = {}
+        self.source: Optional[str] = None
+        self.source_lines: Optional[List[str]] = None  # Split lazily to parse released bodies again
+        self.last_update: Dict[str, int] = {}
+        self.stats = stats  # Optional trace_stats.TraceStats
+        self.budget = budget  # Optional trace_budget.TraceBudget
+        self.expansions: Dict[ast.FunctionDef, int] = {}  # Bodies expanded per function
+        # (reason, function) -> [count, id of the first TRUNCATED node]
+        self.truncations: Dict[Tuple[str, str], List[int]] = {}
+        # Method resolution index: C3 linearization of every class (the class
+        # first, unknown bases included as leaves), the methods each class
+        # defines itself and the methods visible on it through its MRO
+        self.mros: Dict[str, List[str]] = {}
+        self.methods: Dict[Tuple[str, str], ast.FunctionDef] = {}
+        self.method_table: Dict[Tuple[str, str], ast.FunctionDef] = {}
+        # Lazy traces leave FUNCTION nodes collapsed (see expand); the ids of
+        # the body nodes of each expanded node are kept so it expands once
+        self.lazy = lazy
+        self.expanding: Optional[LazyCall] = None
+        self.bodies: Dict[int, range] = {}
+        self.graph.expander = self.expand
+        # Condition and loop labels are rendered when first read, once per
+        # AST node; None in label_limits disables truncation for that kind
+        self.label_limits = dict(LABEL_LIMITS, **(label_limits or {}))
+        self.rendered_labels: Dict[ast.AST, str] = {}
+        self.graph.label_renderer = self.render_label
+        # Statement and expression handlers by AST class; full coverage also
+        # traces async functions
+        self.coverage = coverage
+        self.statement_handlers: Dict[type, Callable[[ast.AST], Any]] = {
+            kind: getattr(self, name) for kind, name in STATEMENT_HANDLERS[coverage].items()
+        }
+        self.expression_handlers: Dict[type, Callable[[ast.AST], Any]] = {
+            kind: getattr(self, name) for kind, name in EXPRESSION_HANDLERS[coverage].items()
+        }
+        self.function_types = (
+            (ast.FunctionDef, ast.AsyncFunctionDef) if coverage == "full" else (ast.FunctionDef,)
+        )
 
     def __str__(self):
         return f"Functions: {self.function_defs.keys()}\nVisits: {self.visit_log}"
 
-    def create_node(self, node_type: str, label: str, ast_node: Optional[ast.AST] = None) -> FlowNode:
+    def create_node(self, node_type: str, label: Optional[str], ast_node: Optional[ast.AST] = None) -> FlowNode:
         """Create a new flow node"""
-        node = FlowNode(node_type, label, ast_node)
+        index = self.graph.add_node(node_type, label, ast_node)
         if self.current_node:
-            self.current_node.add_child(node)
-        self.current_node = node
+            self.graph.add_edge(self.current_node.index, index)
+        node = self.current_node = self.graph.node(index)
         return node
 
     def analyze_file(self, file_path: str) -> tuple[FlowNode, FlowNode]:
         """Analyze the given Python file to trace function and class definitions,
         and simulate the execution starting from the 'main' function."""
         with open(file_path, "r") as file:
-            tree = ast.parse(file.read())
+            source = file.read()
+        return self.analyze_source(source, file_path)
+
+    def analyze_source(self, source: str, file_path: str = "<source>") -> tuple[FlowNode, FlowNode]:
+        """Like analyze_file for source text; `file_path` names the module"""
+        cacheable = self.cache is not None and self.cacheable()
+        if cacheable:
+            with self.phase("cache_load"):
+                entry = self.cache.load(source, self.cache_fingerprint())
+                if entry is not None:
+                    self.load_cached_trace(entry, file_path)
+            if entry is not None:
+                self.source = source
+                self.source_lines = None
+                return self.entry_node, self.end_node
 
+        with self.phase("parse"):
+            tree = ast.parse(source)
         # First pass: collect all function and class definitions
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                self.function_defs[node.name] = node
-            elif isinstance(node, ast.ClassDef):
-                self.class_defs[node.name] = node
+        with self.phase("definitions"):
+            self.function_defs.update(self.collect_definitions(tree)[0])
+            self.load_module(tree, file_path)
+        self.source = source
+        self.source_lines = None
 
         # Start execution from main
-        if "main" in self.function_defs:
-            self.entry_node = self.create_node("ENTRY", "Program Start")
-            self.simulate_function_call("main")
-            self.end_node = self.create_node("END", "Program Exit")
+        if not self.lazy and not len(self.graph):
+            self.open_instances = [0]
+            self.instances = [[-1, 0, -1, len(self.visit_log), -1, None, None, None, None]]
+        with self.phase("simulation"):
+            if "main" in self.function_defs:
+                self.entry_node = self.create_node("ENTRY", "Program Start")
+                self.simulate_function_call("main")
+                self.end_node = self.create_node("END", "Program Exit")
+        self.close_instances()
+
+        if cacheable and self.entry_node is not None:
+            with self.phase("cache_store"):
+                entry = self.cached_trace()
+                if entry is not None:
+                    self.cache.store(source, self.cache_fingerprint(), entry)
+        if self.low_memory:
+            self.release_ast()
+
+        if self.entry_node is None or self.end_node is None:
+            raise ValueError("No entry or end node found")
+        return self.entry_node, self.end_node
+
+    def load_module(self, tree: ast.Module, file_path: str):
+        """Index the scopes and classes of the traced file"""
+        self.tree = tree
+        self.module_name = os.path.splitext(os.path.basename(file_path))[0]
+        self.graph.file_id = self.graph.add_file(file_path)
+        self.symbols.add_module(ModuleInfo(self.module_name, file_path, tree))
+        self.index_classes()
+        self.build_method_index()
+
+    def index_classes(self):
+        """Key every class of the symbol table in class_defs"""
+        for qualname, node in self.symbols.symbols.items():
+            if isinstance(node, ast.ClassDef):
+                key = self.class_key(qualname, node)
+                self.class_defs[key] = node
+                self.class_keys[node] = key
+
+    def class_key(self, qualname: str, class_def: ast.ClassDef) -> str:
+        """Name a class is known by in class_defs, MROs and the visit log"""
+        return qualname[len(self.symbols.owners[class_def]) + 1:]
+
+    def collect_definitions(
+        self, tree: ast.AST
+    ) -> Tuple[Dict[str, ast.FunctionDef], Dict[str, ast.ClassDef]]:
+        """All function and class definitions of a tree, keyed by bare name"""
+        function_defs = {}
+        class_defs = {}
+        for node in walk_statements(tree):
+            if isinstance(node, self.function_types):
+                function_defs[node.name] = node
+            elif isinstance(node, ast.ClassDef):
+                class_defs[node.name] = node
+        return function_defs, class_defs
+
+    def hash_definitions(self, source: str, *definitions: Dict[str, ast.AST]) -> Dict[str, str]:
+        """Hash of the source text of each named definition"""
+        lines = source.splitlines(keepends=True)
+        hashes = {}
+        for defs in definitions:
+            for name, node in defs.items():
+                text = lines[node.lineno - 1:node.end_lineno]
+                text[-1] = text[-1][:node.end_col_offset]
+                text[0] = text[0][node.col_offset:]
+                digest = hashlib.sha1("".join(text).encode("utf-8", "surrogatepass"))
+                # Functions and classes can share a name; either changing counts
+                hashes[name] = hashes.get(name, "") + digest.hexdigest()
+        return hashes
+
+    def reuse_definitions(self, tree: ast.AST, moved: Dict[ast.AST, ast.AST]):
+        """Put the previous nodes of unchanged definitions into a new tree.
+
+        ``moved`` maps definitions of the new tree to their identical
+        previous ones, which are shifted to the new positions so that
+        summaries and flow nodes referring to them stay valid.
+        """
+        todo = [tree]
+        while todo:
+            node = todo.pop()
+            for field in STATEMENT_FIELDS:
+                children = getattr(node, field, None)
+                if not isinstance(children, list):
+                    continue
+                for i, child in enumerate(children):
+                    old_def = moved.get(child)
+                    if old_def is None:
+                        todo.append(child)
+                        continue
+                    lines = child.lineno - old_def.lineno
+                    columns = child.col_offset - old_def.col_offset
+                    if lines or columns:
+                        first = old_def.lineno
+                        for moved_node in ast.walk(old_def):
+                            if "lineno" not in moved_node._attributes:
+                                continue
+                            if moved_node.lineno == first:
+                                moved_node.col_offset += columns
+                            if moved_node.end_lineno == first:
+                                moved_node.end_col_offset += columns
+                            moved_node.lineno += lines
+                            moved_node.end_lineno += lines
+                    # Decorators precede the hashed text and may have changed
+                    old_def.decorator_list = child.decorator_list
+                    children[i] = old_def
+
+    def update_file(self, file_path: str) -> tuple[FlowNode, FlowNode]:
+        """Re-trace a file after an edit, re-simulating only what changed.
+
+        Definitions are compared with the previous analysis by the hash of
+        their source text, and unchanged ones keep their previous nodes.
+        Summaries of changed functions, and of every function that looked up
+        a changed name directly or through its callees, are discarded. The
+        other summaries keep their nodes in the graph: replays adopt them
+        where they are, so only the bodies of invalidated functions are
+        simulated and created again. Node ids are renumbered to those of a
+        fresh trace; nodes obtained from the previous graph are invalidated.
+        """
+        if self.low_memory:
+            raise ValueError("update_file needs the AST nodes that low_memory releases")
+        if self.source is None:
+            return self.analyze_file(file_path)
+
+        with open(file_path, "r") as file:
+            source = file.read()
+        with self.phase("parse"):
+            tree = ast.parse(source)
+        with self.phase("definitions"):
+            function_defs, class_defs = self.collect_definitions(tree)
+        if self.tree is None:
+            # Traces loaded from a cache have no tree nor summaries
+            self.tree = ast.parse(self.source)
+
+        old_function_defs, old_class_defs = self.collect_definitions(self.tree)
+        old_hashes = self.hash_definitions(self.source, old_function_defs, old_class_defs)
+        new_hashes = self.hash_definitions(source, function_defs, class_defs)
+        changed = {
+            name for name in old_hashes.keys() | new_hashes.keys()
+            if old_hashes.get(name) != new_hashes.get(name)
+        }
+        self.reuse_definitions(tree, {
+            new_defs[name]: old_def
+            for old_defs, new_defs in ((old_function_defs, function_defs), (old_class_defs, class_defs))
+            for name, old_def in old_defs.items() if name not in changed and name in new_defs
+        })
+        function_defs, _ = self.collect_definitions(tree)
+
+        # Re-trace from main after the nodes of the previous trace
+        old_summaries = self.summaries
+        old_lookups = self.summary_lookups
+        old_callees = self.summary_callees
+        old_size = len(self.graph)
+        self.visited_calls.clear()
+        self.tasks.clear()
+        self.call_frames.clear()
+        self.expansions.clear()
+        self.truncations.clear()
+        self.current_node = self.entry_node = self.end_node = None
+        self.in_super_call = False
+        self.bodies.clear()
+        self.function_defs.clear()
+        self.function_defs.update(function_defs)
+        self.class_defs.clear()
+        self.class_keys.clear()
+        self.resolved.clear()
+        self.receiver_types.clear()
+        self.rendered_labels.clear()
+        self.symbols = SymbolTable()
+        self.load_module(tree, file_path)
+        defined = self.symbols.owners
+
+        # Invalidate bodies whose definition is gone, direct dependents of
+        # changed names and all their callers
+        callers: Dict[tuple, List[tuple]] = {}
+        for caller, callees in old_callees.items():
+            for callee in callees:
+                callers.setdefault(callee, []).append(caller)
+        invalid = [
+            key for key, lookups in old_lookups.items()
+            if key[0] not in defined or not changed.isdisjoint(lookups)
+        ]
+        invalid_set = set(invalid)
+        while invalid:
+            for caller in callers.get(invalid.pop(), ()):
+                if caller not in invalid_set:
+                    invalid_set.add(caller)
+                    invalid.append(caller)
+
+        # Dependencies of bodies inside kept summaries are kept too, as
+        # those bodies are not simulated again
+        self.summary_lookups = {key: names for key, names in old_lookups.items() if key not in invalid_set}
+        self.summary_callees = {
+            key: {callee for callee in old_callees.get(key, ()) if callee[0] in defined}
+            for key in self.summary_lookups
+        }
+        self.summaries = {}
+        for key, summary in old_summaries.items():
+            if key not in invalid_set:
+                # The logs are rebuilt; the summary's nodes stay where they are
+                summary.visits = list(self.summary_visits(summary))
+                summary.entered = list(self.summary_entered(summary))
+                self.summaries[key] = summary
+        if self.instances is not None:
+            kept = set(self.summaries.values())
+            self.previous_instances = self.instances
+            self.previous_ends = self.record_ends(self.instances)
+            if self.summary_mode == "copy":
+                self.reusable = self.reusable_instances(kept)
+            else:
+                self.unplaced = {
+                    record[8]: instance for instance, record in enumerate(self.instances) if record[8] in kept
+                }
+                self.graph.link_times = {}
+
+        self.visit_log.clear()
+        self.entered_calls = []
+        self.source = source
+        self.source_lines = None
+        self.instances = None
+        if not self.lazy:
+            self.open_instances = [0]
+            self.instances = [[-1, old_size, -1, 0, -1, None, None, None, None]]
+        self.last_update = {
+            "changed": len(changed),
+            "invalidated": len(invalid_set),
+            "reused": len(self.summaries),
+        }
+
+        with self.phase("simulation"):
+            if "main" in self.function_defs:
+                self.entry_node = self.create_node("ENTRY", "Program Start")
+                self.simulate_function_call("main")
+                self.end_node = self.create_node("END", "Program Exit")
+        self.close_instances()
+        self.last_update["created"] = len(self.graph) - old_size
+        self.remove_previous_trace(old_size)
 
         if self.entry_node is None or self.end_node is None:
             raise ValueError("No entry or end node found")
         return self.entry_node, self.end_node
 
+    @staticmethod
+    def record_ends(instances: List[list]) -> List[int]:
+        """Id after the last record each record contains; records are in
+        pre-order, so each body's records are contiguous"""
+        ends = [len(instances)] * len(instances)
+        open_ids: List[int] = []
+        for instance, record in enumerate(instances):
+            while open_ids and open_ids[-1] != record[0]:
+                ends[open_ids.pop()] = instance
+            open_ids.append(instance)
+        return ends
+
+    def reusable_instances(self, kept: Set[FunctionSummary]) -> Dict[FunctionSummary, List[Tuple[int, int]]]:
+        """Bodies of the previous trace that copy replays of kept summaries
+        can reuse.
+
+        A body is reusable if it recorded or copied a kept summary; only the
+        outermost ones are offered, each with the records of the bodies it
+        contains, as ``(first, end)`` record ids.
+        """
+        instances = self.instances
+        ends = self.previous_ends
+
+        reusable: Dict[FunctionSummary, List[Tuple[int, int]]] = {}
+        # Whether a body lies in a reused one, however deep: bodies that were
+        # not summarized, such as those holding recursion cuts, sit between
+        reused = [False] * len(instances)
+        for instance, record in enumerate(instances):
+            if record[0] >= 0 and reused[record[0]]:
+                reused[instance] = True
+                continue
+            summary = record[7] if record[7] is not None else record[8]
+            if summary in kept and record[5] is not None:
+                reused[instance] = True
+                reusable.setdefault(summary, []).append((instance, ends[instance]))
+        for ranges in reusable.values():
+            ranges.reverse()  # Popped in trace order
+        return reusable
+
+    def remove_previous_trace(self, old_size: int):
+        """Drop the nodes of the previous trace that update_file did not reuse.
+
+        Each reused node range is moved to where the new trace linked it, so
+        nodes are in the order a fresh trace creates them.
+        """
+        graph = self.graph
+        runs = self.reused_runs
+        ranges = []
+        previous = old_size
+        for anchor, start, end in runs:
+            ranges += [(previous, anchor), (start, end)]
+            previous = anchor
+        ranges.append((previous, len(graph)))
+        # Shared tails were linked to their new successors after the old ones
+        tails = {}
+        if self.summary_mode == "shared":
+            for summary in self.summaries.values():
+                if summary.head is not None and summary.tail not in tails:
+                    children = graph.children(summary.tail)
+                    tails[summary.tail] = (
+                        [child for child in children if child < old_size],
+                        [child for child in children if child >= old_size],
+                    )
+        positions = graph.compact([(start, end) for start, end in ranges if start < end])
+
+        # Record boundaries inside reused bodies follow their body
+        moved = sorted((start, positions[start]) for _, start, _ in runs)
+        starts = [start for start, _ in moved]
+
+        def boundary(index: int, end: bool) -> int:
+            if index >= old_size:
+                return positions[index]
+            run = bisect.bisect_right(starts, index - end) - 1
+            return moved[run][1] + index - moved[run][0]
+
+        found: Dict[FunctionSummary, int] = {}
+        for instance, record in enumerate(self.instances or ()):
+            record[1], record[2] = boundary(record[1], record[1] == record[2]), boundary(record[2], True)
+            if record[5] is not None:
+                record[5], record[6] = positions[record[5]], positions[record[6]]
+            if record[8] is not None:
+                found[record[8]] = instance
+            elif record[7] is not None and record[5] is not None:
+                found.setdefault(record[7], instance)
+
+        # Summaries take the range of a body that still has their nodes
+        for key, summary in list(self.summaries.items()):
+            if summary.head is None:
+                continue
+            if summary in found:
+                summary.instance = found[summary]
+                _, summary.start, summary.end, _, _, summary.head, summary.tail = self.instances[summary.instance][:7]
+            else:
+                self.drop_summary(key)
+
+        for tail, (old, new) in tails.items():
+            if positions[tail] != -1:
+                graph.reorder_children(positions[tail], self.merge_links(tail, old, new, positions))
+        graph.link_times = None
+
+        self.previous_instances = []
+        self.previous_ends = []
+        self.reusable = {}
+        self.unplaced = {}
+        self.reused_runs = []
+        if self.entry_node is not None:
+            self.entry_node = graph.node(positions[self.entry_node.index])
+            self.end_node = self.current_node = graph.node(positions[self.end_node.index])
+
+    def merge_links(self, tail: int, old: List[int], new: List[int], positions: array) -> List[int]:
+        """Merge the old and new children of a shared tail, each in the order
+        its links were made, into the order of a fresh trace.
+
+        A link is made when its child is created, or later for a link back
+        to an older node, such as the end of a loop body to its start; the
+        graph logged when the new links were made.
+        """
+        graph = self.graph
+        count = len(graph)
+        keyed = []
+        time = -1.0
+        for order, child in enumerate(old):
+            if positions[child] != -1:
+                time = max(time, positions[child])
+                keyed.append((time, order, positions[child]))
+        for order, child in enumerate(new, len(old)):
+            made = graph.link_times.get((tail << graph.EDGE_SHIFT) | child, child + 1)
+            if made == child + 1:
+                time = positions[child]
+            else:
+                # Just after the node created last, and the bodies moved there
+                time = (positions[made] if made < len(positions) - 1 else count) - 0.5
+            keyed.append((time, order, positions[child]))
+        return [child for *_, child in sorted(keyed)]
+
+    def drop_summary(self, key: Tuple[ast.FunctionDef, bool]):
+        del self.summaries[key]
+        self.summary_lookups.pop(key, None)
+        self.summary_callees.pop(key, None)
+
+    def release_ast(self):
+        """Drop every reference into the parsed tree once the trace is done.
+
+        The graph already holds spans instead of AST nodes; ``function_defs``
+        keeps its names only, and summaries, symbols and the source text,
+        which can be re-read through ``graph.snippet``, are released.
+        """
+        self.function_defs = dict.fromkeys(self.function_defs)
+        self.class_defs.clear()
+        self.class_keys.clear()
+        self.symbols = SymbolTable()
+        self.tree = None
+        self.source = None
+        self.source_lines = None
+        self.instances = None
+        self.summaries.clear()
+        self.summary_lookups.clear()
+        self.summary_callees.clear()
+        self.resolved.clear()
+        self.receiver_types.clear()
+        self.rendered_labels.clear()
+        self.expansions.clear()
+        self.methods.clear()
+        self.method_table.clear()
+
+    def expand(self, node: Union[FlowNode, int]) -> Optional[range]:
+        """Simulate the body of a collapsed FUNCTION node of a lazy trace.
+
+        The body is spliced in between the node and its successors, exactly
+        where an eager trace would have put it, with calls in it left
+        collapsed in turn. Returns the ids of the body's nodes (computed on
+        the first call only), or None for nodes that have no body to expand.
+        """
+        index = node.index if isinstance(node, FlowNode) else node
+        if index in self.bodies:
+            return self.bodies[index]
+        call = self.graph.collapsed.pop(index, None)
+        if call is None:
+            return None
+
+        # Restore the calls that were pending at the call site
+        chain = []
+        parent = call.parent
+        while parent is not None:
+            chain.append(parent)
+            parent = parent.parent
+        chain.reverse()
+        self.call_frames = [
+            [p.signature, depth, p.func_def, (p.func_def, p.in_super_call), 0]
+            for depth, p in enumerate(chain)
+        ]
+        self.visited_calls = {p.signature for p in chain}
+
+        graph = self.graph
+        successors = graph.children(index)
+        for child in successors:
+            graph.remove_edge(index, child)
+        self.current_node = graph.node(index)
+        self.in_super_call = call.in_super_call
+        start = len(graph)
+        self.expanding = call
+        with self.phase("simulation"):
+            depth = len(self.tasks)
+            if self.budget is None or self.expansion_allowed(call.name, call.func_def):
+                key = (call.func_def, call.in_super_call)
+                self.note_call(key)
+                self.enter_function(call.name, call.func_def, key, call.signature)
+                self.drain(depth)
+        for child in successors:
+            graph.add_edge(self.current_node.index, child)
+
+        self.expanding = None
+        self.call_frames = []
+        self.visited_calls = set()
+        self.in_super_call = False
+        body = self.bodies[index] = range(start, len(graph))
+        return body
+
+    def expand_all(self):
+        """Expand every collapsed node of a lazy trace, including new ones"""
+        while self.graph.collapsed:
+            self.expand(next(iter(self.graph.collapsed)))
+
+    def walk_calls(
+        self, node: Optional[FlowNode] = None, max_depth: Optional[int] = None
+    ) -> Iterator[Tuple[int, FlowNode]]:
+        """Call tree below a FUNCTION node (main by default), depth first.
+
+        Yields ``(depth, node)`` for each call in program order. In a lazy
+        trace a body is only simulated once the walk moves past its node,
+        so stopping early or setting ``max_depth`` leaves the rest collapsed.
+        """
+        if not self.lazy:
+            raise ValueError("walk_calls needs a lazy trace")
+        graph = self.graph
+        if node is None:
+            if self.entry_node is None:
+                return
+            node = self.entry_node.children[0]
+        stack = [(0, node.index)]
+        while stack:
+            depth, index = stack.pop()
+            yield depth, graph.node(index)
+            if max_depth is not None and depth >= max_depth:
+                continue
+            body = self.expand(index)
+            if body is None:
+                continue
+            calls = [i for i in body if graph.node_type(i) == "FUNCTION"]
+            stack.extend((depth + 1, i) for i in reversed(calls))
+
+    def phase(self, name: str):
+        """Context timing a phase of the trace when instrumentation is enabled"""
+        return self.stats.phase(name) if self.stats is not None else nullcontext()
+
+    def unparse(self, node: ast.AST) -> str:
+        """Source text of an AST node, for labels"""
+        if self.stats is not None:
+            self.stats.unparsed(node)
+        return ast.unparse(node)
+
+    def note_lookup(self, name: str):
+        """Record that the body being simulated depends on what a name resolves to"""
+        if self.call_frames:
+            self.summary_lookups[self.call_frames[-1][3]].update(name.split("."))
+
+    def note_call(self, callee: Tuple[ast.FunctionDef, bool]):
+        """Record that the body being simulated calls the function with this summary key"""
+        if self.call_frames:
+            self.summary_callees[self.call_frames[-1][3]].add(callee)
+
+    def cache_fingerprint(self) -> str:
+        """Settings that change cached traces, mixed into cache keys"""
+        parts = [type(self).__name__]
+        if self.coverage != "legacy":
+            parts.append(self.coverage)
+        if self.summary_mode != "copy":
+            parts.append(self.summary_mode)
+        if self.label_limits != LABEL_LIMITS:
+            parts.append(repr(sorted(self.label_limits.items())))
+        return "/".join(parts)
+
+    def cacheable(self) -> bool:
+        """Whether traces of this tracer can be stored in and loaded from a cache.
+
+        Budgets depend on time and lazy traces stay unexpanded, and a cached
+        trace is only rebuilt into an empty graph.
+        """
+        return self.budget is None and not self.lazy and not len(self.graph)
+
+    def close_instances(self):
+        """Complete the record of the whole trace, from ENTRY to END"""
+        if self.instances is not None and self.entry_node is not None:
+            root = self.instances[0]
+            root[2], root[4] = len(self.graph), len(self.visit_log)
+            root[5], root[6] = self.entry_node.index, self.end_node.index
+
+    def cached_trace(self) -> Optional[Dict[str, Any]]:
+        """The recorded trace as a cache entry, or None if it cannot be stored.
+
+        Each simulated body is stored once and without the bodies it calls:
+        its own nodes as ``(type, label, span)``, its own visits, where it
+        called each other body (a simulated one, or ``~id`` for a replay of
+        an earlier one) and the edges among its nodes and the heads and
+        tails of its callees. No syntax tree is stored.
+        """
+        graph, instances = self.graph, self.instances
+        # Innermost body of every node and visit; bodies nest and ids grow inwards
+        owner = [0] * len(graph)
+        visit_owner = [0] * len(self.visit_log)
+        callees: List[List[int]] = [[] for _ in instances]
+        for i, (parent, start, end, visit_start, visit_end) in enumerate(record[:5] for record in instances):
+            owner[start:end] = [i] * (end - start)
+            visit_owner[visit_start:visit_end] = [i] * (visit_end - visit_start)
+            if parent >= 0:
+                callees[parent].append(i)
+        own_nodes: Dict[int, List[int]] = {i: [] for i, record in enumerate(instances) if record[7] is None}
+        own_visits: Dict[int, List[int]] = {i: [] for i in own_nodes}
+        local = [0] * len(graph)
+        for index, body in enumerate(owner):
+            nodes = own_nodes.get(body)
+            if nodes is not None:
+                local[index] = len(nodes)
+                nodes.append(index)
+        for index, body in enumerate(visit_owner):
+            if body in own_visits:
+                own_visits[body].append(index)
+
+        heads: Dict[int, Dict[int, int]] = {}
+        tails: Dict[int, Dict[int, int]] = {}
+        for body in own_nodes:
+            heads[body], tails[body] = {}, {}
+            for position, callee in enumerate(callees[body]):
+                if instances[callee][5] is not None:
+                    heads[body].setdefault(instances[callee][5], position)
+                    tails[body].setdefault(instances[callee][6], position)
+
+        def ref(body: int, index: int, ends: Dict[int, Dict[int, int]]) -> Optional[int]:
+            """Index of an own node of a body, or ~position of the callee it ends"""
+            if owner[index] == body:
+                return local[index]
+            position = ends[body].get(index)
+            return None if position is None else ~position
+
+        def simulated(body: int) -> int:
+            return body if body in own_nodes else instances[body][0]
+
+        edges: Dict[int, List[Tuple[int, int]]] = {body: [] for body in own_nodes}
+        for parent in range(len(graph)):
+            for child in graph.children(parent):
+                body = owner[parent]
+                if body == owner[child] and body not in own_nodes:
+                    continue  # Made by copy_range with the replayed range
+                target = simulated(owner[child])
+                for body in (target, instances[target][0], simulated(owner[parent])):
+                    if body < 0:
+                        continue
+                    source, dest = ref(body, parent, tails), ref(body, child, heads)
+                    if source is not None and dest is not None:
+                        edges[body].append((source, dest))
+                        break
+                else:
+                    return None
+
+        bodies = {}
+        for body, nodes in own_nodes.items():
+            record = instances[body]
+            head = None if record[5] is None else ref(body, record[5], heads)
+            tail = None if record[6] is None else ref(body, record[6], tails)
+            if (head is None) != (record[5] is None) or (tail is None) != (record[6] is None):
+                return None
+            specs = []
+            for index in nodes:
+                if graph.low_memory:
+                    span = graph.span(index)
+                    span = span and span[1:]
+                else:
+                    ast_node = graph.ast_nodes.get(index)
+                    lineno = getattr(ast_node, "lineno", None)
+                    span = lineno and (lineno, ast_node.col_offset, ast_node.end_lineno or lineno)
+                specs.append((graph.node_type(index), graph.label(index), span))
+            calls = [
+                (
+                    bisect.bisect_left(nodes, instances[callee][1]),
+                    bisect.bisect_left(own_visits[body], instances[callee][3]),
+                    callee if instances[callee][7] is None else ~instances[callee][7].instance,
+                )
+                for callee in callees[body]
+            ]
+            # Each edge is added before the first call made after both its
+            # ends exist and after the edges before it from the same node,
+            # so every node keeps the order of its children
+            positions = [node_pos for node_pos, _, _ in calls]
+            staged = []
+            last_stage: Dict[int, int] = {}
+            for source, dest in edges[body]:
+                stage = max(
+                    last_stage.get(source, 0),
+                    *(bisect.bisect_right(positions, end) if end >= 0 else ~end + 1 for end in (source, dest)),
+                )
+                last_stage[source] = stage
+                staged.append((stage, source, dest))
+            staged.sort(key=lambda edge: edge[0])
+            visits = [self.visit_log[index] for index in own_visits[body]]
+            bodies[body] = (specs, visits, calls, staged, head, tail)
+        return {"function_defs": list(self.function_defs), "bodies": bodies}
+
+    def load_cached_trace(self, entry: Dict[str, Any], file_path: str):
+        """Rebuild the graph and visit log of a trace stored by cached_trace.
+
+        Bodies are rebuilt in their original order, so node ids match the
+        traced graph; replays copy or link the already rebuilt body. The
+        graph holds spans instead of AST nodes and ``function_defs`` names
+        only.
+        """
+        graph, visit_log, bodies = self.graph, self.visit_log, entry["bodies"]
+        graph.low_memory = True
+        graph.file_id = graph.add_file(file_path)
+        self.module_name = os.path.splitext(os.path.basename(file_path))[0]
+        self.function_defs.update(dict.fromkeys(entry["function_defs"]))
+
+        def node_id(index: Optional[int], own: List[int], ends: List[tuple], end: int) -> Optional[int]:
+            if index is None:
+                return None
+            return own[index] if index >= 0 else ends[~index][end]
+
+        # Body -> (node start, node end, visit start, visit end, head, tail)
+        placed: Dict[int, tuple] = {}
+        # [body, next call, own visits done, edges done, own node ids,
+        #  callee (head, tail)s, node start, visit start]
+        stack = [[0, 0, 0, 0, [], [], len(graph), len(visit_log)]]
+        while stack:
+            frame = stack[-1]
+            body, call, visits_done, edges_done, own, ends = frame[:6]
+            nodes, visits, calls, edges, head, tail = bodies[body]
+            node_pos, visit_pos, callee = calls[call] if call < len(calls) else (len(nodes), len(visits), None)
+            for node_type, label, span in nodes[len(own):node_pos]:
+                own.append(graph.add_node(node_type, label))
+                if span is not None:
+                    graph.span_ids[-1] = graph.intern_span(*span)
+            visit_log.extend(visits[visits_done:visit_pos])
+            frame[2] = visit_pos
+            while edges_done < len(edges) and edges[edges_done][0] <= call:
+                _, source, dest = edges[edges_done]
+                graph.add_edge(node_id(source, own, ends, 1), node_id(dest, own, ends, 0))
+                edges_done += 1
+            frame[3] = edges_done
+
+            if callee is None:
+                head, tail = node_id(head, own, ends, 0), node_id(tail, own, ends, 1)
+                placed[body] = (frame[6], len(graph), frame[7], len(visit_log), head, tail)
+                stack.pop()
+                if stack:
+                    stack[-1][5].append((head, tail))
+                    stack[-1][1] += 1
+            elif callee >= 0:
+                stack.append([callee, 0, 0, 0, [], [], len(graph), len(visit_log)])
+            else:
+                start, end, visit_start, visit_end, head, tail = placed[~callee]
+                visit_log.extend(visit_log[visit_start:visit_end])
+                if head is not None and self.summary_mode == "copy":
+                    offset = graph.copy_range(start, end) - start
+                    head, tail = head + offset, tail + offset
+                ends.append((head, tail))
+                frame[1] += 1
+
+        head, tail = placed[0][4:]
+        self.entry_node, self.end_node = graph.node(head), graph.node(tail)
+        self.current_node = self.end_node
+
+    def push(self, *tasks: Tuple[Callable[..., Any], tuple]):
+        """Queue tasks so that they run in the order given"""
+        self.tasks.extend(reversed(tasks))
+
+    def push_statements(self, stmts: List[ast.stmt]):
+        """Queue a block of statements in program order"""
+        handlers = self.statement_handlers
+        self.tasks.extend([
+            (handlers[type(stmt)], (stmt,)) for stmt in reversed(stmts) if type(stmt) in handlers
+        ])
+
+    def drain(self, depth: int = 0):
+        """Run queued tasks until the worklist shrinks back to ``depth``"""
+        tasks = self.tasks
+        if self.budget is not None:
+            self.drain_within_budget(depth)
+            return
+        while len(tasks) > depth:
+            handler, args = tasks.pop()
+            handler(*args)
+
+    def drain_within_budget(self, depth: int):
+        """Run queued tasks, stopping when the node or time budget runs out"""
+        tasks = self.tasks
+        graph = self.graph
+        max_nodes = self.budget.max_nodes
+        deadline = None
+        if self.budget.max_seconds is not None:
+            deadline = time.perf_counter() + self.budget.max_seconds
+        interval = self.budget.CLOCK_INTERVAL
+        count = 0
+        while len(tasks) > depth:
+            handler, args = tasks.pop()
+            handler(*args)
+            if max_nodes is not None and len(graph) >= max_nodes:
+                self.stop_simulation("nodes", depth)
+                return
+            count += 1
+            if deadline is not None and count % interval == 0 and time.perf_counter() > deadline:
+                self.stop_simulation("time", depth)
+                return
+
+    def stop_simulation(self, reason: str, depth: int):
+        """Mark where exploration stopped and abandon all pending work"""
+        func_def = self.current_function()
+        self.truncate(reason, func_def.name if func_def is not None else "<module>")
+        # Unfinished bodies are dropped without recording summaries
+        del self.tasks[depth:]
+        self.call_frames.clear()
+        self.visited_calls.clear()
+        self.in_super_call = False
+        if self.stats is not None:
+            self.stats.active.clear()
+
+    def truncate(self, reason: str, func_name: str):
+        """Add a TRUNCATED node and count it in the truncation report"""
+        node = self.create_node("TRUNCATED", f"{reason} budget exhausted")
+        entry = self.truncations.get((reason, func_name))
+        if entry is None:
+            self.truncations[(reason, func_name)] = [1, node.id]
+        else:
+            entry[0] += 1
+
+    def truncation_report(self) -> List[Dict[str, Any]]:
+        """Where and why the budget truncated the trace, most frequent first"""
+        report = [
+            {"reason": reason, "function": func_name, "count": count, "first_node": node_id}
+            for (reason, func_name), (count, node_id) in self.truncations.items()
+        ]
+        report.sort(key=lambda entry: (-entry["count"], entry["reason"], entry["function"]))
+        return report
+
+    def expansion_allowed(self, func_name: str, func_def: ast.FunctionDef) -> bool:
+        """Whether the depth and expansion budgets allow expanding another body"""
+        budget = self.budget
+        if budget.max_depth is not None and len(self.call_frames) >= budget.max_depth:
+            self.truncate("depth", func_name)
+            # How deep a body is expanded depends on where it is called from
+            if self.call_frames:
+                self.call_frames[-1][1] = 0
+            return False
+        if budget.max_expansions is not None:
+            count = self.expansions.get(func_def, 0)
+            if count >= budget.max_expansions:
+                self.truncate("expansions", func_name)
+                return False
+            self.expansions[func_def] = count + 1
+        return True
+
+    def replay_allowed(self, summary: FunctionSummary) -> bool:
+        """Whether replaying a summary stays within the depth and node budgets"""
+        budget = self.budget
+        if budget.max_depth is not None and len(self.call_frames) + 1 + summary.height > budget.max_depth:
+            return False
+        if budget.max_nodes is not None and self.summary_mode != "shared":
+            if len(self.graph) + summary.end - summary.start > budget.max_nodes:
+                return False
+        return True
+
     def get_base_classes(self, class_name: str) -> List[str]:
         """Get the base classes of a given class for super() calls"""
-        if class_name in self.class_defs:
-            class_def = self.class_defs[class_name]
-            return [base.id for base in class_def.bases if isinstance(base, ast.Name)]
-        return []
+        class_def = self.class_defs.get(class_name)
+        if class_def is None:
+            return []
+        # Bases are evaluated in the scope enclosing the class statement
+        scope = self.symbols.parents.get(class_def)
+        bases = []
+        for base in class_def.bases:
+            dotted = dotted_name(base)
+            target = dotted and self.symbols.resolve_scoped(scope, self.module_name, dotted)
+            node = self.symbols.symbols.get(target) if target else None
+            if isinstance(node, ast.ClassDef):
+                bases.append(self.class_keys[node])
+            elif dotted:
+                # Classes defined elsewhere (`Base`, `mod.Base`) stay in the chain
+                # under the name they are written as
+                bases.append(dotted)
+        return bases
+
+    def build_method_index(self):
+        """Precompute the MRO and the method tables of every known class"""
+        self.mros.clear()
+        self.methods.clear()
+        self.method_table.clear()
+        for class_name, class_def in self.class_defs.items():
+            for node in class_def.body:
+                if isinstance(node, self.function_types):
+                    self.methods[(class_name, node.name)] = node
+        for class_name in self.class_defs:
+            for base in reversed(self.class_mro(class_name)):
+                class_def = self.class_defs.get(base)
+                if class_def is None:
+                    continue
+                for node in class_def.body:
+                    if isinstance(node, self.function_types):
+                        self.method_table[(class_name, node.name)] = node
+
+    def class_mro(self, class_name: str) -> List[str]:
+        """C3 linearization of a class, computed once per class.
+
+        Bases are linearized before the classes deriving from them on an
+        explicit stack, so deep hierarchies do not recurse. Cyclic or
+        inconsistent hierarchies, which Python would reject, still get an
+        order instead of an error.
+        """
+        mro = self.mros.get(class_name)
+        if mro is not None:
+            return mro
+
+        stack = [class_name]
+        pending = {class_name}
+        while stack:
+            name = stack[-1]
+            bases = self.get_base_classes(name)
+            missing = [base for base in bases if base not in self.mros and base not in pending]
+            if missing:
+                stack.extend(missing)
+                pending.update(missing)
+                continue
+            stack.pop()
+            pending.discard(name)
+            if name in self.mros:
+                continue
+            if len(bases) == 1:
+                base_mro = self.mros.get(bases[0], bases)
+                self.mros[name] = [name] + [c for c in base_mro if c != name]
+            else:
+                sequences = [self.mros.get(base, [base]) for base in bases] + [bases]
+                self.mros[name] = self.c3_merge(name, sequences)
+        return self.mros[class_name]
+
+    def c3_merge(self, class_name: str, sequences: List[List[str]]) -> List[str]:
+        result = [class_name]
+        sequences = [[c for c in sequence if c != class_name] for sequence in sequences]
+        sequences = [sequence for sequence in sequences if sequence]
+        while sequences:
+            for sequence in sequences:
+                head = sequence[0]
+                if not any(head in other[1:] for other in sequences):
+                    break
+            else:
+                head = sequences[0][0]
+            result.append(head)
+            sequences = [[c for c in sequence if c != head] for sequence in sequences]
+            sequences = [sequence for sequence in sequences if sequence]
+        return result
+
+    def lookup_method(self, class_name: str, method_name: str) -> Optional[ast.FunctionDef]:
+        """Definition `instance.method` refers to for an instance of a class"""
+        method = self.method_table.get((class_name, method_name))
+        if method is None and class_name not in self.mros:
+            # Class registered after the index was built
+            for base in self.class_mro(class_name):
+                method = self.methods.get((base, method_name))
+                if method is not None:
+                    break
+        return method
 
     def simulate_call(self, node: ast.Call):
         """Simulate a function call and its arguments"""
+        depth = len(self.tasks)
+        self.step_call(node)
+        self.drain(depth)
+
+    def simulate_statement(self, stmt: ast.AST):
+        """Simulate execution of a statement"""
+        depth = len(self.tasks)
+        self.step_statement(stmt)
+        self.drain(depth)
+
+    def simulate_attribute(self, node: ast.Attribute):
+        """Simulate an attribute access"""
+        depth = len(self.tasks)
+        self.step_attribute(node)
+        self.drain(depth)
+
+    def simulate_expression(self, node: ast.AST):
+        """Simulate an expression"""
+        depth = len(self.tasks)
+        self.step_expression(node)
+        self.drain(depth)
+
+    def simulate_function_call(
+        self, func_name: str, branch_point: Optional[FlowNode] = None
+    ) -> FlowNode:
+        """Simulate execution of a function, including all nested calls"""
+        depth = len(self.tasks)
+        func_node = self.step_function_call(func_name, branch_point)
+        self.drain(depth)
+        return func_node
+
+    def simulate_if_statement(self, node: ast.If):
+        """Simulate an if statement as a branch with condition."""
+        depth = len(self.tasks)
+        self.step_if_statement(node)
+        self.drain(depth)
+
+    def simulate_loop(self, node: ast.For | ast.While):
+        """Simulate a loop execution as a branch with cyclic paths."""
+        depth = len(self.tasks)
+        self.step_loop(node)
+        self.drain(depth)
+
+    def simulate_list_or_generator_expression(
+        self, node: ast.ListComp | ast.SetComp | ast.DictComp | ast.GeneratorExp
+    ):
+        """Simulate a list comprehension or generator expression"""
+        depth = len(self.tasks)
+        self.step_list_or_generator_expression(node)
+        self.drain(depth)
+
+    def step_call(self, node: ast.Call):
+        """Queue the arguments of a call followed by the call itself"""
         # Check if this is a super() call
         is_super_call = (
             isinstance(node.func, ast.Name) and node.func.id == "super"
@@ -68,144 +1282,629 @@ class PythonCallTrace(ast.NodeVisitor):
             self.in_super_call = True
             return
 
-        for arg in node.args:
-            self.simulate_expression(arg)
-
+        expression = self.step_expression
+        handlers = self.expression_handlers
+        work = [(expression, (arg,)) for arg in node.args if type(arg) in handlers]
         for keyword in node.keywords:
-            self.simulate_expression(keyword.value)
+            if type(keyword.value) in handlers:
+                work.append((expression, (keyword.value,)))
+
+        if work:
+            self.tasks.append((self.step_call_target, (node,)))
+            self.tasks.extend(reversed(work))
+        else:
+            self.step_call_target(node)
+
+    def step_call_target(self, node: ast.Call):
+        """Dispatch the called object once its arguments have been simulated"""
+        tasks = self.tasks
+        tasks.append((self.step_call_done, ()))
+        depth = len(tasks)
 
+        called_function = None
         if isinstance(node.func, ast.Name):
             called_function = node.func.id
-            if called_function in self.class_defs:
+        elif isinstance(node.func, ast.Attribute):
+            called_function = self.attribute_call_name(node.func)
+
+        if called_function is not None:
+            self.note_lookup(called_function)
+            class_key = self.resolve_class(called_function)
+            if class_key is not None:
                 # Handle class instantiation
                 self.visit_log.append(called_function)
 
-                # Get inheritance chain
-                class_chain = []
-                current_class = called_function
-                while current_class:
-                    class_chain.append(current_class)
-                    bases = self.get_base_classes(current_class)
-                    current_class = bases[0] if bases else None
-
-                # Call constructors from base to derived
-                for class_name in reversed(class_chain):
-                    if f"{class_name}.__init__" not in self.visited_calls:
-                        self.simulate_function_call(f"{class_name}.__init__")
+                # Call constructors from base to derived, in reverse MRO order
+                class_chain = self.class_mro(class_key)
+                if self.call_frames:
+                    for class_name in class_chain:
+                        self.note_lookup(class_name)
+                tasks.extend(
+                    (self.step_constructor, (class_name,)) for class_name in class_chain
+                )
             else:
-                self.simulate_function_call(called_function)
+                self.step_function_call(called_function)
         elif isinstance(node.func, ast.Attribute):
             if not self.in_super_call:  # Only process if not in a super() call
-                self.simulate_attribute(node.func)
+                self.step_attribute(node.func)
+
+        # Nothing was queued after the call, so reset the flag right away
+        if len(tasks) == depth:
+            tasks.pop()
+            self.in_super_call = False
 
+    def step_call_done(self):
         self.in_super_call = False  # Reset super call flag
 
-    def simulate_statement(self, stmt: ast.AST):
+    def step_constructor(self, class_name: str):
+        if f"{class_name}.__init__" not in self.visited_calls:
+            self.step_function_call(f"{class_name}.__init__")
+
+    def step_statement(self, stmt: ast.AST):
         """Simulate execution of a statement"""
-        if isinstance(stmt, ast.If):
-            self.simulate_if_statement(stmt)
-        elif isinstance(stmt, ast.Expr):
-            if isinstance(stmt.value, ast.Call):
-                self.simulate_call(stmt.value)
-            elif isinstance(stmt.value, (ast.ListComp, ast.GeneratorExp)):
-                self.simulate_expression(stmt.value)
-        elif isinstance(stmt, (ast.For, ast.While)):
-            self.simulate_loop(stmt)
-        elif isinstance(stmt, ast.Assign):
-            if isinstance(stmt.value, ast.Call):
-                self.simulate_call(stmt.value)
-            elif isinstance(stmt.value, (ast.ListComp, ast.GeneratorExp)):
-                self.simulate_expression(stmt.value)
+        handler = self.statement_handlers.get(type(stmt))
+        if handler is not None:
+            handler(stmt)
+
+    def step_expression_statement(self, stmt: ast.Expr):
+        if isinstance(stmt.value, ast.Call):
+            self.step_call(stmt.value)
+
+    def step_assignment(self, stmt: ast.Assign | ast.AugAssign | ast.AnnAssign):
+        """Simulate the assigned value; targets are not simulated"""
+        if stmt.value is not None:
+            self.step_expression(stmt.value)
+
+    def step_full_assignment(self, stmt: ast.Assign | ast.AugAssign | ast.AnnAssign):
+        """The value, then the calls in the targets; an augmented target comes first"""
+        targets = stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+        tasks = [(self.step_target, (target,)) for target in targets]
+        if stmt.value is not None:
+            value = (self.step_expression, (stmt.value,))
+            if isinstance(stmt, ast.AugAssign):
+                tasks.append(value)
             else:
-                self.simulate_expression(stmt.value)
-        elif isinstance(stmt, ast.Return):
-            if isinstance(stmt.value, ast.Call):
-                self.simulate_call(stmt.value)
-            elif isinstance(stmt.value, (ast.JoinedStr, ast.FormattedValue)):
-                self.simulate_expression(stmt.value)
-        elif isinstance(stmt, ast.Call):
-            self.simulate_call(stmt)
+                tasks.insert(0, value)
+        self.push(*tasks)
 
-    def simulate_attribute(self, node: ast.Attribute):
-        """Simulate an attribute access"""
+    def step_delete(self, stmt: ast.Delete):
+        self.push(*[(self.step_target, (target,)) for target in stmt.targets])
+
+    def step_target(self, node: ast.expr):
+        """Simulate what is evaluated to store into or delete a target:
+        ``f()`` in ``x[f()]`` and ``obj.attr(g())`` in ``obj.attr(g()).y``"""
+        if isinstance(node, ast.Attribute):
+            self.step_expression(node.value)
+        elif isinstance(node, ast.Subscript):
+            self.push((self.step_expression, (node.value,)), (self.step_expression, (node.slice,)))
+        elif isinstance(node, (ast.Tuple, ast.List)):
+            self.push(*[(self.step_target, (element,)) for element in node.elts])
+        elif isinstance(node, ast.Starred):
+            self.step_target(node.value)
+
+    def step_function_definition(self, node: ast.FunctionDef | ast.AsyncFunctionDef):
+        """A nested def runs its decorators and default values"""
+        defaults = node.args.defaults + [value for value in node.args.kw_defaults if value is not None]
+        self.step_definition(node.decorator_list, defaults)
+
+    def step_class_definition(self, node: ast.ClassDef):
+        """A nested class runs its decorators, bases and keywords, not its body"""
+        self.step_definition(node.decorator_list, node.bases + [keyword.value for keyword in node.keywords])
+
+    def step_definition(self, decorators: List[ast.expr], values: List[ast.expr]):
+        """Decorator expressions, then values, then the decorators applied
+        innermost first. Applying a decorator named by ``name`` or
+        ``obj.name`` is simulated as a call of that name; the result of
+        ``@factory(...)`` is unknown and only the factory call is.
+        """
+        handlers = self.expression_handlers
+        named = [d for d in decorators if isinstance(d, (ast.Name, ast.Attribute))]
+        evaluated = [d for d in decorators if not isinstance(d, (ast.Name, ast.Attribute))] + values
+        tasks = [(self.step_expression, (node,)) for node in evaluated if type(node) in handlers]
+        tasks.extend(
+            (self.step_call, (ast.copy_location(ast.Call(func=decorator, args=[], keywords=[]), decorator),))
+            for decorator in reversed(named)
+        )
+        self.push(*tasks)
+
+    def step_return(self, stmt: ast.Return):
+        if isinstance(stmt.value, (ast.Call, ast.JoinedStr, ast.FormattedValue)):
+            self.step_expression(stmt.value)
+
+    def step_attribute(self, node: ast.Attribute):
+        """Queue the receiver of an attribute access, then log the attribute"""
         if not self.in_super_call:  # Skip if in super() call
-            self.simulate_expression(node.value)
-            if isinstance(node.value, ast.Call):
-                self.simulate_call(node.value)
-            self.visit_log.append(node.attr)
+            value = node.value
+            if type(value) not in self.expression_handlers:
+                self.visit_log.append(node.attr)
+                return
+            tasks = [(self.step_expression, (value,))]
+            if isinstance(value, ast.Call):
+                tasks.append((self.step_call, (value,)))
+            tasks.append((self.visit_log.append, (node.attr,)))
+            self.push(*tasks)
 
-    def simulate_expression(self, node: ast.AST):
+    def step_expression(self, node: ast.AST):
         """Simulate an expression"""
-        if isinstance(node, ast.Call):
-            self.simulate_call(node)
-        elif isinstance(node, ast.Attribute):
-            self.simulate_attribute(node)
-        elif isinstance(node, (ast.JoinedStr, ast.FormattedValue)):
-            if isinstance(node, ast.JoinedStr):
-                for value in node.values:
-                    self.simulate_expression(value)
-            elif isinstance(node, ast.FormattedValue):
-                self.simulate_expression(node.value)
-        elif isinstance(node, ast.Name):
-            pass  # Skip to avoid logging variable names
+        handler = self.expression_handlers.get(type(node))
+        if handler is not None:
+            handler(node)
 
-    def simulate_function_call(
+    def step_formatted_value(self, node: ast.FormattedValue):
+        self.step_expression(node.value)
+
+    def step_sub_expressions(self, node: ast.AST):
+        """Simulate the child expressions of a node in source order"""
+        expression = self.step_expression
+        handlers = self.expression_handlers
+        self.push(*[
+            (expression, (child,)) for child in ast.iter_child_nodes(node) if type(child) in handlers
+        ])
+
+    def attribute_call_name(self, node: ast.Attribute) -> Optional[str]:
+        """Name to simulate an attribute call as, or None to only log the attribute.
+
+        Calls on a receiver whose class is known (``self``, annotated
+        parameters, variables assigned an instance) resolve through the
+        class's MRO to ``Class.method``.
+        """
+        if not isinstance(node.value, ast.Name):
+            return None
+        class_key = self.receiver_class(node.value.id)
+        if class_key is None:
+            return None
+        for class_name in self.class_mro(class_key):
+            self.note_lookup(class_name)
+            if (class_name, node.attr) in self.methods:
+                return f"{class_name}.{node.attr}"
+        return None
+
+    def receiver_class(self, name: str) -> Optional[str]:
+        """Class key of the instance a local name holds in the current body"""
+        func_def = self.current_function()
+        if func_def is None:
+            return None
+        types = self.receiver_types.get(func_def)
+        if types is None:
+            types = self.receiver_types[func_def] = self.infer_receiver_types(func_def)
+        return types.get(name)
+
+    def infer_receiver_types(self, func_def: ast.FunctionDef) -> Dict[str, Optional[str]]:
+        """Classes of the local names of a function that only ever hold one.
+
+        The first parameter of a method is an instance of its class,
+        annotated parameters and variables of their annotation, and a
+        variable assigned ``Class(...)`` of that class. Names bound to
+        anything else, or to different classes, map to None.
+        """
+        types: Dict[str, Optional[str]] = {}
+
+        def bind(name: str, class_key: Optional[str]):
+            types[name] = class_key if types.get(name, class_key) == class_key else None
+
+        args = func_def.args
+        positional = args.posonlyargs + args.args
+        parent = self.symbols.parents.get(func_def)
+        if isinstance(parent, ast.ClassDef) and positional and not any(
+            dotted_name(decorator) == "staticmethod" for decorator in func_def.decorator_list
+        ):
+            bind(positional[0].arg, self.class_keys.get(parent))
+        for arg in positional + args.kwonlyargs:
+            if arg.annotation is not None:
+                bind(arg.arg, self.annotation_class(arg.annotation))
+
+        stack = list(self.function_body(func_def))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+                continue
+            if isinstance(node, ast.Assign):
+                value = node.value
+                class_key = None
+                if isinstance(value, ast.Call):
+                    dotted = dotted_name(value.func)
+                    class_key = dotted and self.resolve_class(dotted)
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        bind(target.id, class_key)
+            elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+                bind(node.target.id, self.annotation_class(node.annotation))
+            stack.extend(ast.iter_child_nodes(node))
+        return types
+
+    def annotation_class(self, annotation: ast.expr) -> Optional[str]:
+        """Class key an annotation (possibly a string) names"""
+        if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+            dotted = annotation.value.strip()
+        else:
+            dotted = dotted_name(annotation)
+        return self.resolve_class(dotted) if dotted else None
+
+    def current_module(self) -> Optional[str]:
+        """Module whose namespace names are currently resolved in"""
+        return self.module_name
+
+    def qualify(self, name: str) -> Optional[str]:
+        """Qualified name a name written in the current body refers to"""
+        scope = self.current_function()
+        key = (scope, name)
+        if key not in self.resolved:
+            # Constructor chains pass names that are already qualified
+            if name in self.symbols.symbols:
+                self.resolved[key] = name
+            else:
+                self.resolved[key] = self.symbols.resolve_scoped(scope, self.current_module(), name)
+        return self.resolved[key]
+
+    def resolve_class(self, name: str) -> Optional[str]:
+        """Key of the class a called name instantiates, if it is a known class"""
+        qualname = self.qualify(name)
+        node = self.symbols.symbols.get(qualname) if qualname else None
+        return self.class_keys.get(node) if isinstance(node, ast.ClassDef) else None
+
+    def call_signature(self, func_name: str, branch_point: Optional[FlowNode] = None) -> str:
+        """Key identifying a pending call for recursion detection"""
+        return f"{self.qualify(func_name) or func_name}_{id(branch_point)}"
+
+    def current_function(self) -> Optional[ast.FunctionDef]:
+        """Definition whose body is being simulated, if any"""
+        return self.call_frames[-1][2] if self.call_frames else None
+
+    def resolve_function(self, func_name: str) -> Optional[ast.FunctionDef]:
+        """Find the definition a (possibly Class.method) call name refers to"""
+        class_name, _, method_name = func_name.rpartition(".")
+        if class_name in self.class_defs:
+            return self.methods.get((class_name, method_name))
+        qualname = self.qualify(func_name)
+        node = self.symbols.symbols.get(qualname) if qualname else None
+        return node if isinstance(node, self.function_types) else None
+
+    def step_function_call(
         self, func_name: str, branch_point: Optional[FlowNode] = None
     ) -> FlowNode:
-        """Simulate execution of a function, including all nested calls"""
-        call_signature = f"{func_name}_{id(branch_point)}"
+        """Log a call and queue the body of the called function"""
+        call_signature = self.call_signature(func_name, branch_point)
 
         if ( not func_name.endswith(".__init__") or call_signature not in self.visited_calls):
             self.visit_log.append(func_name)
 
         func_node = self.create_node("FUNCTION", f"{func_name}")
 
-        if call_signature not in self.visited_calls:
-            self.visited_calls.add(call_signature)
+        if call_signature in self.visited_calls:
+            self.note_recursion_cut(call_signature)
+            if self.stats is not None:
+                self.stats.recursion_cut(func_name)
+            return func_node
 
-            pure_func_name = func_name.split(".")[-1]
-            class_name = func_name.split(".")[0] if "." in func_name else None
+        self.note_lookup(func_name)
+        func_def = self.resolve_function(func_name)
+        if func_def is None:
+            return func_node
 
-            func_def = None
-            if class_name and class_name in self.class_defs:
-                for node in self.class_defs[class_name].body:
-                    if (
-                        isinstance(node, ast.FunctionDef)
-                        and node.name == pure_func_name
-                    ):
-                        func_def = node
-                        break
-            else:
-                func_def = self.function_defs.get(pure_func_name)
+        if self.lazy:
+            # The body is simulated when the node is expanded
+            self.graph.collapsed[func_node.index] = LazyCall(
+                func_name, func_def, self.in_super_call, call_signature, self.expanding
+            )
+            return func_node
 
-            if func_def:
-                for stmt in func_def.body:
-                    self.simulate_statement(stmt)
+        if self.budget is not None and not self.expansion_allowed(func_name, func_def):
+            return func_node
 
-            self.visited_calls.remove(call_signature)
+        key = (func_def, self.in_super_call)
+        self.note_call(key)
+        summary = self.summaries.get(key)
+        if (
+            summary is not None
+            and self.can_replay(summary)
+            and (self.budget is None or self.replay_allowed(summary))
+        ):
+            node_count = len(self.graph)
+            self.apply_summary(summary, func_node)
+            if self.call_frames:
+                top = self.call_frames[-1]
+                top[4] = max(top[4], summary.height + 1)
+            if self.stats is not None:
+                self.stats.summary_replayed(func_name, len(self.graph) - node_count)
+            return func_node
 
+        self.enter_function(func_name, func_def, key, call_signature)
         return func_node
 
-    def trim_text(self, text: str, n: int) -> str:
-        """Trim text to a maximum of 20 characters."""
-        if len(text) > n:
+    def enter_function(
+        self,
+        func_name: str,
+        func_def: ast.FunctionDef,
+        key: Tuple[ast.FunctionDef, bool],
+        call_signature: str,
+    ):
+        """Push a frame for a function body and queue its statements"""
+        self.visited_calls.add(call_signature)
+        self.call_frames.append([call_signature, len(self.call_frames), func_def, key, 0])
+        self.summary_lookups.setdefault(key, set())
+        self.summary_callees.setdefault(key, set())
+        self.entered_calls.append(call_signature)
+        if self.instances is not None:
+            self.open_instances.append(len(self.instances))
+            self.instances.append([
+                self.open_instances[-2], len(self.graph), -1, len(self.visit_log), -1, None, None, None, None,
+            ])
+        if self.stats is not None:
+            self.stats.function_entered(func_name)
+        self.tasks.append((
+            self.step_function_exit,
+            (key, len(self.visit_log), len(self.entered_calls) - 1, len(self.graph)),
+        ))
+        self.push_statements(self.function_body(func_def))
+
+    def function_body(self, func_def: ast.FunctionDef) -> List[ast.stmt]:
+        """Statements of a function, parsed again from its source if released"""
+        # Python has no empty bodies, so only a released body is empty
+        if func_def.body:
+            return func_def.body
+        lines = self.definition_lines(func_def)
+        # Padding puts the statements back on their original lines; nested
+        # definitions are wrapped so they keep their original columns
+        header = "\n" * (func_def.lineno - 1)
+        if func_def.col_offset:
+            header = "\n" * (func_def.lineno - 2) + "if 1:\n"
+        node = ast.parse(header + "\n".join(lines[func_def.lineno - 1:func_def.end_lineno])).body[0]
+        if func_def.col_offset:
+            node = node.body[0]
+        func_def.body = node.body
+        return func_def.body
+
+    def definition_lines(self, func_def: ast.FunctionDef) -> List[str]:
+        """Source lines of the module defining a function"""
+        if self.source_lines is None:
+            self.source_lines = split_lines(self.source)
+        return self.source_lines
+
+    def step_function_exit(
+        self,
+        key: Tuple[ast.FunctionDef, bool],
+        visit_start: int,
+        entered_start: int,
+        node_start: int,
+    ):
+        """Leave a function body and record its summary"""
+        call_signature, cut_depth, func_def, _, height = self.call_frames.pop()
+        self.visited_calls.remove(call_signature)
+        instance = None
+        if self.instances is not None:
+            instance = self.open_instances.pop()
+            self.record_instance(instance, node_start, visit_start, None)
+        if self.stats is not None:
+            self.stats.function_exited(len(self.graph) - node_start)
+        if self.call_frames:
+            parent = self.call_frames[-1]
+            parent[1] = min(parent[1], cut_depth)
+            parent[4] = max(parent[4], height + 1)
+
+        # Bodies that were cut short by a caller still on the stack depend on
+        # that context and cannot be replayed elsewhere,
+        # and lazy bodies contain collapsed calls
+        if self.summary_mode != "off" and not self.lazy and cut_depth >= len(self.call_frames):
+            has_body = len(self.graph) > node_start
+            summary = self.summaries[key] = FunctionSummary(
+                visit_start,
+                len(self.visit_log),
+                entered_start,
+                len(self.entered_calls),
+                node_start,
+                len(self.graph),
+                node_start if has_body else None,
+                self.current_node.index if has_body else None,
+                self.in_super_call,
+            )
+            summary.height = height
+            summary.instance = instance
+            if instance is not None:
+                self.instances[instance][8] = summary
+            if self.low_memory:
+                # Later calls replay the summary; the few that cannot
+                # (a pending call it expanded is on the stack) parse it again
+                func_def.body = []
+
+    def note_recursion_cut(self, call_signature: str):
+        """Record that a recursive call to a pending function was not expanded"""
+        for depth, frame in enumerate(self.call_frames):
+            if frame[0] == call_signature:
+                top = self.call_frames[-1]
+                top[1] = min(top[1], depth)
+                break
+
+    def summary_visits(self, summary: FunctionSummary) -> List[str]:
+        if summary.visits is not None:
+            return summary.visits
+        return self.visit_log[summary.visit_start:summary.visit_end]
+
+    def summary_entered(self, summary: FunctionSummary) -> List[str]:
+        if summary.entered is not None:
+            return summary.entered
+        return self.entered_calls[summary.entered_start:summary.entered_end]
+
+    def can_replay(self, summary: FunctionSummary) -> bool:
+        """A summary is only valid if none of the calls it expanded are pending"""
+        if summary.expanded is None:
+            summary.expanded = frozenset(self.summary_entered(summary))
+        return summary.expanded.isdisjoint(self.visited_calls)
+
+    def apply_summary(self, summary: FunctionSummary, func_node: FlowNode):
+        """Replay a cached function body at a new call site"""
+        node_start, visit_start = len(self.graph), len(self.visit_log)
+        self.visit_log.extend(self.summary_visits(summary))
+        self.entered_calls.extend(self.summary_entered(summary))
+        self.in_super_call = summary.super_out
+
+        reusable = self.reusable.get(summary)
+        if reusable:
+            self.reuse_instance(reusable.pop(), func_node, visit_start)
+            return
+        if summary.head is not None and self.summary_mode == "shared":
+            if summary in self.unplaced:
+                self.place_instance(self.unplaced.pop(summary), visit_start)
+            self.graph.add_edge(func_node.index, summary.head)
+            self.current_node = self.graph.node(summary.tail)
+        elif summary.head is not None:
+            # Copy the body sub-graph, keeping only edges internal to it
+            ranges = self.summary_ranges(summary)
+            starts = self.graph.copy_ranges(ranges)
+
+            def copied(index: int) -> int:
+                for (start, end), new_start in zip(ranges, starts):
+                    if start <= index < end:
+                        return new_start + index - start
+
+            self.graph.add_edge(func_node.index, copied(summary.head))
+            self.current_node = self.graph.node(copied(summary.tail))
+
+        if self.instances is not None:
+            self.instances.append([self.open_instances[-1], 0, 0, 0, 0, None, None, summary, None])
+            self.record_instance(len(self.instances) - 1, node_start, visit_start, func_node)
+
+    def summary_ranges(self, summary: FunctionSummary) -> List[Tuple[int, int]]:
+        """Node ranges of a summary's body in the order they were created.
+
+        A body simulated by update_file is split where it linked in bodies
+        reused from the previous trace, which lie elsewhere in the graph.
+        """
+        runs = self.reused_runs
+        first = bisect.bisect_right(runs, (summary.start, math.inf))
+        last = bisect.bisect_right(runs, (summary.end, math.inf))
+        ranges = []
+        previous = summary.start
+        for anchor, start, end in runs[first:last]:
+            ranges += [(previous, anchor), (start, end)]
+            previous = anchor
+        ranges.append((previous, summary.end))
+        return [(start, end) for start, end in ranges if start < end]
+
+    def reuse_instance(self, reused: Tuple[int, int], func_node: FlowNode, visit_start: int):
+        """Link a body left in the graph by the previous trace at a call site.
+
+        Its records, and those of the bodies it contains, are moved to the
+        new trace's records.
+        """
+        first, end = reused
+        record = self.previous_instances[first]
+        self.reused_runs.append((len(self.graph), record[1], record[2]))
+        self.graph.add_edge(func_node.index, record[5])
+        self.current_node = self.graph.node(record[6])
+
+        base, shift = len(self.instances), visit_start - record[3]
+        for old in self.previous_instances[first:end]:
+            parent = self.open_instances[-1] if old is record else old[0] - first + base
+            self.instances.append([parent, old[1], old[2], old[3] + shift, old[4] + shift, *old[5:]])
+
+    def place_instance(self, first: int, visit_start: int):
+        """Move a shared body left in the graph by the previous trace to its
+        first call in the new trace, where a fresh trace simulates it.
+
+        Its records are moved to the new trace's records. Bodies it linked
+        that are not placed yet are placed inside it, and bodies it
+        simulated that were placed earlier become links, as in a fresh trace.
+        """
+        previous, ends = self.previous_instances, self.previous_ends
+        anchor = len(self.graph)
+        stack: List[list] = []  # [record, new record, node cursor, next contained record, visit shift]
+
+        def place(old: int, parent: int, start: int):
+            record = previous[old]
+            shift = start - record[3]
+            self.instances.append([parent, record[1], record[2], start, record[4] + shift, *record[5:]])
+            stack.append([old, len(self.instances) - 1, record[1], old + 1, shift])
+
+        def move(frame: list, end: int, resume: int):
+            if frame[2] < end:
+                self.reused_runs.append((anchor, frame[2], end))
+            frame[2] = resume
+
+        place(first, self.open_instances[-1], visit_start)
+        while stack:
+            frame = stack[-1]
+            old, instance, _, child, shift = frame
+            if child >= ends[old]:
+                move(frame, previous[old][2], previous[old][2])
+                stack.pop()
+                continue
+            record = previous[child]
+            frame[3] = ends[child]
+            if record[7] is None and (record[8] is None or self.unplaced.pop(record[8], None) is not None):
+                move(frame, record[1], record[2])
+                place(child, instance, record[3] + shift)
+            elif record[7] is None:
+                # Placed before, so a fresh trace links it here
+                move(frame, record[1], record[2])
+                self.instances.append([
+                    instance, record[1], record[1], record[3] + shift, record[4] + shift,
+                    record[5], record[6], record[8], None,
+                ])
+            elif record[7] in self.unplaced:
+                move(frame, record[1], record[1])
+                place(self.unplaced.pop(record[7]), instance, record[3] + shift)
+            else:
+                self.instances.append([instance, *record[1:3], record[3] + shift, record[4] + shift, *record[5:]])
+
+    def record_instance(self, instance: int, node_start: int, visit_start: int, func_node: Optional[FlowNode]):
+        """Complete the record of a body that was just simulated or replayed.
+
+        Its head is the first node after ``node_start``, or for a shared
+        replay the node ``func_node`` was linked to.
+        """
+        record = self.instances[instance]
+        record[1:5] = [node_start, len(self.graph), visit_start, len(self.visit_log)]
+        if func_node is not None and self.current_node is not func_node:
+            record[5], record[6] = self.graph.children(func_node.index)[-1], self.current_node.index
+        elif func_node is None and len(self.graph) > node_start:
+            record[5], record[6] = node_start, self.current_node.index
+
+    def trim_text(self, text: str, n: Optional[int]) -> str:
+        """Trim text to a maximum of n characters."""
+        if n is not None and len(text) > n:
             return text[:n] + '...'
         return text
 
-    def simulate_if_statement(self, node: ast.If):
-        """Simulate an if statement as a branch with condition."""
-        condition_text = self.trim_text(f"if {ast.unparse(node.test)}:", 15)
-        condition_node = self.create_node('CONDITION', condition_text, node)
+    def render_label(self, node_type: str, node: ast.AST) -> str:
+        """Label of a CONDITION or LOOP_START node, memoized per AST node"""
+        label = self.rendered_labels.get(node)
+        if label is not None:
+            return label
+        if isinstance(node, ast.If):
+            text = f"if {self.unparse(node.test)}:"
+        elif isinstance(node, (ast.For, ast.AsyncFor)):
+            text = f"for {' '.join(self.unparse(node.target).split())} in {' '.join(self.unparse(node.iter).split())}:"
+            if isinstance(node, ast.AsyncFor):
+                text = "async " + text
+        elif isinstance(node, ast.While):
+            text = f"while {' '.join(self.unparse(node.test).split())}:"
+        elif isinstance(node, ast.Match):
+            text = f"match {' '.join(self.unparse(node.subject).split())}:"
+        else:  # ast.Try and ast.TryStar
+            text = "try:"
+        label = self.trim_text(text, self.label_limits.get(node_type))
+        if not self.low_memory:  # Memoizing would keep released bodies alive
+            self.rendered_labels[node] = label
+        return label
+
+    def step_if_statement(self, node: ast.If):
+        """Open a branch with condition and queue the true branch"""
+        # The label is rendered from the AST node when it is first needed
+        condition_node = self.create_node('CONDITION', None, node)
+
+        # Process true branch, then the false branch from the condition node
+        self.tasks.append((self.step_else_branch, (node, condition_node)))
+        self.push_statements(node.body)
 
-        # Process true branch
-        for stmt in node.body:
-            self.simulate_statement(stmt)
+    def step_else_branch(self, node: ast.If, condition_node: FlowNode):
         end_true_branch = self.current_node
 
         # Reset to condition node for the false branch
         self.current_node = condition_node
-        for stmt in node.orelse:
-            self.simulate_statement(stmt)
+        self.tasks.append((self.step_end_if, (node, end_true_branch)))
+        self.push_statements(node.orelse)
+
+    def step_end_if(self, node: ast.If, end_true_branch: Optional[FlowNode]):
         end_false_branch = self.current_node
 
         # Create a merge node that both branches connect to
@@ -216,35 +1915,102 @@ class PythonCallTrace(ast.NodeVisitor):
             end_false_branch.add_child(merge_node)
         self.current_node = merge_node
 
-    def simulate_loop(self, node: ast.For | ast.While):
-        """Simulate a loop execution as a branch with cyclic paths."""
-        # Create a loop entry node with loop condition as label
-        if isinstance(node, ast.For):
-            loop_text = self.trim_text(f"for {' '.join(ast.unparse(node.target).split())} in {' '.join(ast.unparse(node.iter).split())}:", 25)
-        else:  # ast.While
-            loop_text = self.trim_text(f"while {' '.join(ast.unparse(node.test).split())}:", 25)
-        loop_entry = self.create_node('LOOP_START', loop_text, node)
+    def step_full_if_statement(self, node: ast.If):
+        """Simulate the test, then branch"""
+        self.push((self.step_expression, (node.test,)), (self.step_if_statement, (node,)))
+
+    def step_full_for_loop(self, node: ast.For | ast.AsyncFor):
+        """Simulate the iterable once, the loop, then its else block"""
+        self.push_statements(node.orelse)
+        self.push((self.step_expression, (node.iter,)), (self.step_loop, (node,)))
+
+    def step_full_while_loop(self, node: ast.While):
+        """Simulate the loop with its test at the start of every iteration"""
+        self.push_statements(node.orelse)
+        self.step_loop(node)
+        self.tasks.append((self.step_expression, (node.test,)))
+
+    def step_with(self, node: ast.With | ast.AsyncWith):
+        self.push_statements(node.body)
+        self.push(*[(self.step_expression, (item.context_expr,)) for item in node.items])
+
+    def step_try(self, node: ast.Try):
+        """The body, then either the else block or a handler, then finally"""
+        self.push_statements(node.finalbody)
+        if node.handlers:
+            blocks = [(None, node.orelse)] + [(None, handler.body) for handler in node.handlers]
+            self.tasks.append((self.step_branches, (node, blocks)))
+        else:
+            self.push_statements(node.orelse)
+        self.push_statements(node.body)
+
+    def step_match(self, node: ast.Match):
+        """The subject, then a branch per case, guards first"""
+        blocks = [(case.guard, case.body) for case in node.cases]
+        last = node.cases[-1]
+        if not (isinstance(last.pattern, ast.MatchAs) and last.pattern.pattern is None and last.guard is None):
+            blocks.append((None, []))  # No case matches
+        self.push((self.step_expression, (node.subject,)), (self.step_branches, (node, blocks)))
+
+    def step_branches(self, node: ast.AST, blocks: List[Tuple[Optional[ast.expr], List[ast.stmt]]]):
+        """Branch from a CONDITION node into each (guard, body) block and merge"""
+        condition_node = self.create_node("CONDITION", None, node)
+        ends: List[Optional[FlowNode]] = []
+        tasks = []
+        for guard, body in blocks:
+            tasks.append((self.step_branch_start, (condition_node,)))
+            if guard is not None:
+                tasks.append((self.step_expression, (guard,)))
+            tasks.extend((self.step_statement, (stmt,)) for stmt in body)
+            tasks.append((self.step_branch_end, (ends,)))
+        tasks.append((self.step_merge_branches, (node, ends)))
+        self.push(*tasks)
+
+    def step_branch_start(self, condition_node: FlowNode):
+        self.current_node = condition_node
+
+    def step_branch_end(self, ends: List[Optional[FlowNode]]):
+        ends.append(self.current_node)
+
+    def step_merge_branches(self, node: ast.AST, ends: List[Optional[FlowNode]]):
+        self.current_node = None
+        merge_node = self.create_node("END_IF", "End Conditional", node)
+        for end in ends:
+            if end is not None:
+                end.add_child(merge_node)
+
+    def step_loop(self, node: ast.For | ast.While):
+        """Open a loop entry node and queue the loop body"""
+        # Create a loop entry node, labelled with the loop header once needed
+        loop_entry = self.create_node('LOOP_START', None, node)
 
         # Simulate the loop body
-        for stmt in node.body:
-            self.simulate_statement(stmt)
+        self.tasks.append((self.step_end_loop, (loop_entry,)))
+        self.push_statements(node.body)
 
+    def step_end_loop(self, loop_entry: FlowNode):
         if self.current_node:
             self.current_node.add_child(loop_entry)
             self.current_node = loop_entry
 
-    def simulate_list_or_generator_expression(
-        self, node: ast.ListComp | ast.GeneratorExp
+    def step_list_or_generator_expression(
+        self, node: ast.ListComp | ast.SetComp | ast.DictComp | ast.GeneratorExp
     ):
-        """Simulate a list comprehension or generator expression"""
+        """Queue the iterables, conditions and element of a comprehension"""
+        tasks = []
         for generator in node.generators:
             if isinstance(generator.iter, ast.Call):
-                self.simulate_call(generator.iter)
+                tasks.append((self.step_call, (generator.iter,)))
             else:
-                self.simulate_expression(generator.iter)
+                tasks.append((self.step_expression, (generator.iter,)))
 
             # Handle condition if present
             for if_expr in generator.ifs:
-                self.simulate_expression(if_expr)
+                tasks.append((self.step_expression, (if_expr,)))
 
-        self.simulate_expression(node.elt)
+        if isinstance(node, ast.DictComp):
+            tasks.append((self.step_expression, (node.key,)))
+            tasks.append((self.step_expression, (node.value,)))
+        else:
+            tasks.append((self.step_expression, (node.elt,)))
+        self.push(*tasks)
@@ -0,0 +1,292 @@
+import argparse
+import dis
+import inspect
+import json
+import os
+import runpy
+import sys
+from collections import deque
+from contextlib import redirect_stdout
+from typing import Optional, Dict, List, Any
+from flow_node import FlowGraph, FlowNode
+from python_call_trace import PythonCallTrace, COVERAGE_MODES
+
+RUNTIME_BACKENDS = ("auto", "monitoring", "profile")
+DEFAULT_CAPACITY = 100_000
+# Code of generators and coroutines is resumed, not just called
+RESUMABLE = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+# Calls that are not calls of the program's functions
+IGNORED = {"__build_class__", "super"}
+monitoring = getattr(sys, "monitoring", None)  # Python 3.12+
+
+
+class RuntimeTrace:
+    """Calls that a program's main() makes when it actually runs.
+
+    Every call made from code in the traced file is recorded by name, as
+    the visit log of PythonCallTrace names calls, so the two can be
+    compared. On Python 3.12+ calls are seen as sys.monitoring CALL events;
+    call sites in other files are disabled the first time they fire, so
+    library code runs at full speed. Older versions fall back to
+    sys.setprofile, which is slower and names classes by the ``__init__``
+    they run.
+
+    Only every ``sample``-th call is recorded, and the recorded names are
+    kept in a ring buffer of ``capacity`` names; ``counts`` has every
+    recorded call, including those pushed out of the buffer. Lambdas and
+    comprehensions are not recorded.
+    """
+
+    def __init__(self, sample: int = 1, capacity: int = DEFAULT_CAPACITY, backend: str = "auto"):
+        if sample < 1 or capacity < 1:
+            raise ValueError("sample and capacity must be at least 1")
+        if backend not in RUNTIME_BACKENDS:
+            raise ValueError(f"backend must be one of {RUNTIME_BACKENDS}")
+        if backend == "auto":
+            backend = "profile" if monitoring is None else "monitoring"
+        elif backend == "monitoring" and monitoring is None:
+            raise ValueError("The monitoring backend needs Python 3.12 or later")
+        self.sample = sample
+        self.backend = backend
+        self.events: deque = deque(maxlen=capacity)
+        self.counts: Dict[str, int] = {}
+        self.calls = 0  # Calls from the traced file, recorded or not
+        self.filename: Optional[str] = None
+        self.error: Optional[str] = None  # Exception that ended main(), if any
+        self.resume_offsets: Dict[Any, int] = {}
+        self.graph = FlowGraph()
+        self.entry_node: Optional[FlowNode] = None
+        self.end_node: Optional[FlowNode] = None
+
+    def __str__(self):
+        return f"Visits: {self.visit_log}"
+
+    @property
+    def visit_log(self) -> List[str]:
+        return list(self.events)
+
+    @property
+    def recorded(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def complete(self) -> bool:
+        """Whether every call was recorded and is still in the buffer"""
+        return self.sample == 1 and self.recorded == len(self.events)
+
+    def analyze_file(self, file_path: str) -> tuple[FlowNode, FlowNode]:
+        """Run the file's main() and record its calls.
+
+        The module is run under another name than ``__main__``, so its
+        ``if __name__ == "__main__"`` block is skipped, with its directory
+        first on sys.path. An exception raised by main() ends the run and
+        is kept in ``error``.
+        """
+        file_path = os.path.abspath(file_path)
+        directory = os.path.dirname(file_path)
+        sys.path.insert(0, directory)
+        try:
+            namespace = runpy.run_path(file_path, run_name="__runtime_trace__")
+            main = namespace.get("main")
+            if not inspect.isfunction(main):
+                raise ValueError(f"No main function found in {file_path}")
+            self.filename = main.__code__.co_filename
+            self.calls += 1
+            self.keep("main")
+            self.start()
+            try:
+                main()
+            except (Exception, SystemExit) as error:
+                self.error = f"{type(error).__name__}: {error}"
+            finally:
+                self.stop()
+        finally:
+            if directory in sys.path:
+                sys.path.remove(directory)
+        return self.build_graph()
+
+    def start(self):
+        # Callbacks run on every call, so the state they touch is bound to locals
+        filename = self.filename
+        events = self.events
+        counts = self.counts
+        sample = self.sample
+        if self.backend == "monitoring":
+            tool = monitoring.PROFILER_ID
+            disable = monitoring.DISABLE
+
+            def on_call(code, offset: int, function: Any, arg0: Any):
+                if code.co_filename != filename:
+                    return disable
+                name = getattr(function, "__name__", None) or type(function).__name__
+                if name[0] == "<" or name in IGNORED:
+                    return
+                self.calls += 1
+                if self.calls % sample == 0:
+                    events.append(name)
+                    counts[name] = counts.get(name, 0) + 1
+
+            monitoring.use_tool_id(tool, "python_call_trace")
+            monitoring.register_callback(tool, monitoring.events.CALL, on_call)
+            monitoring.set_events(tool, monitoring.events.CALL)
+            return
+
+        first_resume = self.first_resume
+
+        def on_profile(frame, event: str, arg: Any):
+            if event == "call":
+                caller = frame.f_back
+                code = frame.f_code
+                if (
+                    caller is None
+                    or caller.f_code.co_filename != filename
+                    or not code.co_flags & inspect.CO_NEWLOCALS  # A class body
+                    or code.co_flags & RESUMABLE and frame.f_lasti != first_resume(code)
+                ):
+                    return
+                name = code.co_name
+            elif event == "c_call" and frame.f_code.co_filename == filename:
+                name = arg.__name__
+            else:
+                return
+            if name[0] == "<" or name in IGNORED:
+                return
+            self.calls += 1
+            if self.calls % sample == 0:
+                events.append(name)
+                counts[name] = counts.get(name, 0) + 1
+
+        sys.setprofile(on_profile)
+
+    def stop(self):
+        if self.backend == "monitoring":
+            tool = monitoring.PROFILER_ID
+            monitoring.set_events(tool, 0)
+            monitoring.register_callback(tool, monitoring.events.CALL, None)
+            monitoring.free_tool_id(tool)
+            # Call sites disabled during the run fire again for later runs
+            monitoring.restart_events()
+        else:
+            sys.setprofile(None)
+
+    def first_resume(self, code) -> int:
+        """Instruction a generator frame starts from; later resumptions are not calls"""
+        offset = self.resume_offsets.get(code)
+        if offset is None:
+            # Before Python 3.11 fresh frames start at -1
+            offset = self.resume_offsets[code] = next(
+                (i.offset for i in dis.get_instructions(code) if i.opname == "RESUME"), -1
+            )
+        return offset
+
+    def keep(self, name: str):
+        self.events.append(name)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def build_graph(self) -> tuple[FlowNode, FlowNode]:
+        """Chain the buffered calls between an entry and an end node"""
+        graph = self.graph
+        graph.clear()
+        current = graph.add_node("ENTRY", "Program Start")
+        self.entry_node = graph.node(current)
+        for name in self.events:
+            index = graph.add_node("FUNCTION", name)
+            graph.add_edge(current, index)
+            current = index
+        end = graph.add_node("END", "Program Exit")
+        graph.add_edge(current, end)
+        self.end_node = graph.node(end)
+        return self.entry_node, self.end_node
+
+    def compare(self, visit_log: List[str]) -> Dict[str, Any]:
+        """Divergences between a static visit log and the recorded calls.
+
+        Names are compared without their class prefix. ``unpredicted``
+        counts calls that ran but were never predicted. ``unexecuted``
+        lists predicted calls that never ran, and ``first_divergence`` is
+        where the two logs first differ; both are None unless the run is
+        complete, as sampled or dropped calls would look unexecuted.
+        """
+        predicted = [name.rpartition(".")[2] for name in visit_log]
+        predicted_names = set(predicted)
+        report: Dict[str, Any] = {
+            "backend": self.backend,
+            "sample": self.sample,
+            "calls": self.calls,
+            "recorded": self.recorded,
+            "dropped": self.recorded - len(self.events),
+            "error": self.error,
+            "unpredicted": {
+                name: count for name, count in sorted(self.counts.items()) if name not in predicted_names
+            },
+            "unexecuted": None,
+            "first_divergence": None,
+        }
+        if not self.complete:
+            return report
+        report["unexecuted"] = sorted(predicted_names - set(self.counts))
+        executed = list(self.events)
+        for index in range(max(len(predicted), len(executed))):
+            expected = predicted[index] if index < len(predicted) else None
+            actual = executed[index] if index < len(executed) else None
+            if expected != actual:
+                report["first_divergence"] = {"index": index, "predicted": expected, "executed": actual}
+                break
+        return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{report['recorded']} of {report['calls']} calls recorded ({report['backend']})"]
+    if report["error"]:
+        lines.append(f"main() raised {report['error']}")
+    if report["unpredicted"]:
+        calls = ", ".join(f"{name} x{count}" for name, count in report["unpredicted"].items())
+        lines.append(f"unpredicted: {calls}")
+    if report["unexecuted"]:
+        lines.append(f"unexecuted: {', '.join(report['unexecuted'])}")
+    divergence = report["first_divergence"]
+    if divergence is not None:
+        lines.append(
+            f"first divergence at call {divergence['index']}: "
+            f"predicted {divergence['predicted']}, executed {divergence['executed']}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run a Python file's main() and compare its calls with the static trace."
+    )
+    parser.add_argument("path", help="source file to run")
+    parser.add_argument("-f", "--format", choices=("text", "json"), default="text",
+                        help="report format (default: text)")
+    parser.add_argument("--sample", type=int, default=1, metavar="N",
+                        help="record every N-th call only (default: 1)")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY,
+                        help=f"most recent calls kept in order (default: {DEFAULT_CAPACITY})")
+    parser.add_argument("--backend", choices=RUNTIME_BACKENDS, default="auto",
+                        help="sys.monitoring or sys.setprofile (default: monitoring where available)")
+    parser.add_argument("--coverage", choices=COVERAGE_MODES, default="legacy",
+                        help="coverage of the static trace (default: legacy)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the divergences; exits with 1 if calls ran that were not predicted"""
+    args = parse_args(argv)
+    tracer = PythonCallTrace(coverage=args.coverage)
+    tracer.analyze_file(args.path)
+    runtime = RuntimeTrace(args.sample, args.capacity, args.backend)
+    # The program's own output goes to stderr, keeping the report parseable
+    with redirect_stdout(sys.stderr):
+        runtime.analyze_file(args.path)
+    report = runtime.compare(tracer.visit_log)
+    if args.format == "json":
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 1 if report["unpredicted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import ast
+from collections import deque
+from typing import Optional, Dict, List, Iterator
+
+# Fields through which statements nest; definitions and imports are
+# statements, so expressions never need to be searched for them
+STATEMENT_FIELDS = ("body", "handlers", "orelse", "finalbody", "cases")
+
+
+def child_statements(node: ast.AST) -> Iterator[ast.AST]:
+    """Statements (and except handlers/match cases) directly inside a node"""
+    for field in STATEMENT_FIELDS:
+        children = getattr(node, field, None)
+        if isinstance(children, list):
+            yield from children
+
+
+def walk_statements(tree: ast.AST) -> Iterator[ast.AST]:
+    """Breadth-first walk over statements, in the order of ``ast.walk``"""
+    todo = deque([tree])
+    while todo:
+        node = todo.popleft()
+        todo.extend(child_statements(node))
+        yield node
+
+
+class ModuleInfo:
+    """Top-level definitions and import bindings of one parsed module"""
+
+    def __init__(self, name: str, path: str, tree: ast.Module, is_package: bool = False):
+        self.name = name
+        self.path = path
+        self.tree = tree
+        self.is_package = is_package  # True for a package's __init__ module
+        self.functions: Dict[str, ast.FunctionDef] = {}
+        self.classes: Dict[str, ast.ClassDef] = {}
+        self.imports: Dict[str, str] = {}  # Local alias -> qualified target
+        self.star_imports: List[str] = []  # Modules imported with `from m import *`
+
+        for node in tree.body:
+            if isinstance(node, ast.FunctionDef):
+                self.functions[node.name] = node
+            elif isinstance(node, ast.ClassDef):
+                self.classes[node.name] = node
+
+        # Imports may appear anywhere (functions, try blocks), so walk the tree
+        for node in walk_statements(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self.imports[alias.asname] = alias.name
+                    else:
+                        # `import a.b` binds `a`
+                        top = alias.name.split(".")[0]
+                        self.imports[top] = top
+            elif isinstance(node, ast.ImportFrom):
+                source = self.absolute_module(node.module, node.level)
+                if source is None:
+                    continue
+                for alias in node.names:
+                    if alias.name == "*":
+                        self.star_imports.append(source)
+                    else:
+                        self.imports[alias.asname or alias.name] = f"{source}.{alias.name}"
+
+    def absolute_module(self, module: Optional[str], level: int) -> Optional[str]:
+        """Turn a (possibly relative) `from` import source into a module name"""
+        if level == 0:
+            return module
+        parts = self.name.split(".")
+        if not self.is_package:
+            parts = parts[:-1]
+        if level - 1 > len(parts):
+            return None
+        parts = parts[: len(parts) - (level - 1)]
+        if module:
+            parts.append(module)
+        return ".".join(parts) or None
+
+
+def parse_module(path: str, name: str, is_package: bool = False) -> ModuleInfo:
+    """Read and parse a module; module-level so it can run in a worker process"""
+    with open(path, "r") as file:
+        tree = ast.parse(file.read(), filename=path)
+    return ModuleInfo(name, path, tree, is_package)
+
+
+def dotted_name(node: ast.AST) -> Optional[str]:
+    """`a.b.c` for a chain of attribute accesses on a name, else None"""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class SymbolTable:
+    """Definitions of a set of modules keyed by qualified name.
+
+    Every function and class is registered under its ``__qualname__``
+    prefixed with its module: ``module.name``, ``module.Class.method`` and
+    ``module.outer.<locals>.inner``. Names are resolved through the
+    enclosing function scopes of the code that uses them, then through the
+    module's own definitions and import aliases, including re-exports from
+    other modules of the table.
+    """
+
+    MAX_ALIAS_HOPS = 32
+
+    def __init__(self):
+        self.modules: Dict[str, ModuleInfo] = {}
+        self.symbols: Dict[str, ast.AST] = {}  # Qualified name -> definition
+        self.owners: Dict[ast.AST, str] = {}  # Definition -> defining module
+        self.qualnames: Dict[ast.AST, str] = {}  # Definition -> qualified name
+        self.parents: Dict[ast.AST, ast.AST] = {}  # Definition -> enclosing definition or module
+        self.scope_members: Dict[ast.AST, Dict[str, ast.AST]] = {}  # Definitions local to a scope
+
+    def add_module(self, info: ModuleInfo):
+        """Register a module and every definition nested in it"""
+        self.modules[info.name] = info
+        # Pre-order walk in source order, so later definitions of a name win
+        stack = [(info.tree, info.tree, info.name)]
+        while stack:
+            node, scope, qualname = stack.pop()
+            children = []
+            for child in child_statements(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    local = ".<locals>" if isinstance(scope, (ast.FunctionDef, ast.AsyncFunctionDef)) else ""
+                    child_qualname = f"{qualname}{local}.{child.name}"
+                    self.register(child_qualname, child, info.name)
+                    self.parents[child] = scope
+                    self.scope_members.setdefault(scope, {})[child.name] = child
+                    children.append((child, child, child_qualname))
+                else:
+                    children.append((child, scope, qualname))
+            stack.extend(reversed(children))
+
+    def register(self, qualname: str, node: ast.AST, module: str):
+        self.symbols[qualname] = node
+        self.owners[node] = module
+        self.qualnames[node] = qualname
+
+    def resolve(self, qualname: str) -> Optional[str]:
+        """Follow import aliases until a qualified name names a definition or module"""
+        for _ in range(self.MAX_ALIAS_HOPS):
+            if qualname in self.symbols or qualname in self.modules:
+                return qualname
+
+            # Find the longest module prefix and look the remainder up in it
+            parts = qualname.split(".")
+            for i in range(len(parts) - 1, 0, -1):
+                module = self.modules.get(".".join(parts[:i]))
+                if module is not None:
+                    target = self.lookup_in_module(module, parts[i])
+                    if target is None:
+                        return None
+                    qualname = ".".join([target] + parts[i + 1:])
+                    break
+            else:
+                return None
+        return None
+
+    def lookup_in_module(self, module: ModuleInfo, name: str) -> Optional[str]:
+        """Qualified target a top-level name of a module is bound to"""
+        member = self.scope_members.get(module.tree, {}).get(name)
+        if member is not None:
+            return self.qualnames[member]
+        if name in module.imports:
+            return module.imports[name]
+        if f"{module.name}.{name}" in self.modules:
+            return f"{module.name}.{name}"  # Submodule of a package
+        for source in module.star_imports:
+            source_module = self.modules.get(source)
+            if source_module is not None and (
+                name in source_module.functions or name in source_module.classes
+            ):
+                return f"{source}.{name}"
+        return None
+
+    def resolve_scoped(
+        self, scope: Optional[ast.AST], module_name: str, dotted: str
+    ) -> Optional[str]:
+        """Resolve a (dotted) name as written in the body of a definition.
+
+        Like Python, the enclosing function scopes are searched first;
+        class bodies are not visible from the methods they contain.
+        """
+        first, _, rest = dotted.partition(".")
+        while scope is not None and not isinstance(scope, ast.Module):
+            if not isinstance(scope, ast.ClassDef):
+                member = self.scope_members.get(scope, {}).get(first)
+                if member is not None:
+                    target = self.qualnames[member]
+                    return self.resolve(f"{target}.{rest}" if rest else target)
+            scope = self.parents.get(scope)
+        return self.resolve_name(module_name, dotted)
+
+    def resolve_name(self, module_name: str, dotted: str) -> Optional[str]:
+        """Resolve a (dotted) name as written in the given module"""
+        module = self.modules.get(module_name)
+        if module is None:
+            return None
+        first, _, rest = dotted.partition(".")
+        target = self.lookup_in_module(module, first)
+        if target is None:
+            return None
+        return self.resolve(f"{target}.{rest}" if rest else target)
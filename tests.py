@@ -1,4 +1,27 @@
 from python_call_trace import PythonCallTrace
+import asyncio
+import io
+import json
+import subprocess
+import sys
+import xml.etree.ElementTree as ElementTree
+from exporters import export_graph, export_file
+import main as cli
+import benchmark
+from flow_node import FlowGraph
+from graphing import GraphBuilder
+from project_trace import ProjectCallTrace
+from trace_cache import DefinitionCache
+from trace_stats import TraceStats
+from trace_budget import TraceBudget
+from trace_server import TraceServer
+from compaction import compact_graph
+from binary_graph import load_graph
+from trace_diff import diff_graphs
+from call_index import CallIndex, build_call_index
+from runtime_trace import RuntimeTrace
+from hotness import estimate_file
+from paged_graph import PagedGraph
 
 
 def test_file_1():
@@ -88,3 +111,767 @@ def test_file_6():
     assert str(analyzer) == truth
 
 
+
+
+def write_diamond(path, levels):
+    lines = ["def level_0():", "    print('leaf')", ""]
+    for i in range(1, levels + 1):
+        lines += [f"def level_{i}():", f"    level_{i - 1}()", f"    level_{i - 1}()", ""]
+    lines += ["def main():", f"    level_{levels}()", ""]
+    path.write_text("\n".join(lines))
+
+
+def test_summary_modes(tmp_path):
+    input_file = tmp_path / "diamond.py"
+    write_diamond(input_file, 10)
+
+    logs = {}
+    node_counts = {}
+    for mode in ("off", "copy", "shared"):
+        analyzer = PythonCallTrace(summary_mode=mode)
+        analyzer.analyze_file(str(input_file))
+        logs[mode] = analyzer.visit_log
+        node_counts[mode] = len(analyzer.graph)
+
+    assert logs["off"] == logs["copy"] == logs["shared"]
+    assert node_counts["off"] == node_counts["copy"]
+    assert node_counts["shared"] < 50
+
+
+def test_deep_call_chain(tmp_path):
+    depth = 20000
+    input_file = tmp_path / "deep.py"
+    lines = []
+    for i in range(depth):
+        lines += [f"def f_{i}():", f"    f_{i + 1}()"]
+    lines += [f"def f_{depth}():", "    print('bottom')", "def main():", "    f_0()"]
+    input_file.write_text("\n".join(lines))
+
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file(str(input_file))
+    assert analyzer.visit_log[:2] == ["main", "f_0"]
+    assert analyzer.visit_log[-2:] == [f"f_{depth}", "print"]
+
+    graph = GraphBuilder("deep", analyzer)
+    graph.add_nodes_edges(analyzer.entry_node)
+    assert len(graph.visited) == depth + 5
+
+
+def test_project_trace(tmp_path):
+    package = tmp_path / "app"
+    (package / "util").mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    (package / "util" / "__init__.py").write_text("from .text import shout as loud\n")
+    (package / "util" / "text.py").write_text(
+        "def shout(value):\n    print(value.upper())\n"
+    )
+    (package / "models.py").write_text(
+        "class Base:\n    def __init__(self):\n        setup()\n\n"
+        "class Model(Base):\n    pass\n\n"
+        "def setup():\n    print('setup')\n"
+    )
+    (package / "cli.py").write_text(
+        "import app.models as models\n"
+        "from app.util import loud\n\n"
+        "def main():\n    m = models.Model()\n    loud('hi')\n"
+    )
+
+    (package / "tools.py").write_text("def main():\n    pass\n")
+
+    analyzer = ProjectCallTrace(workers=2)
+    analyzer.analyze_project(str(package), entry="app.cli.main")
+
+    assert analyzer.visit_log == [
+        "main", "models.Model", "app.models.Base.__init__", "setup", "print",
+        "app.models.Model.__init__", "loud", "upper", "print",
+    ]
+    assert "app.util.text.shout" in analyzer.function_defs
+    # Modules the entry does not import are indexed but never parsed in-process
+    assert sorted(analyzer.symbols.modules) == ["app", "app.cli", "app.models", "app.util", "app.util.text"]
+
+    # Low memory parses each body again from its file when it is entered
+    low = ProjectCallTrace(workers=1, low_memory=True)
+    low.analyze_project(str(package), entry="app.cli.main")
+    assert low.visit_log == analyzer.visit_log
+
+
+def test_definition_cache(tmp_path):
+    cache = DefinitionCache(str(tmp_path / "cache"))
+    truths = open("truths.txt", "r").readlines()
+    truth = truths[10].strip() + "\n" + truths[11].strip()
+
+    graphs = []
+    for _ in range(2):
+        analyzer = PythonCallTrace(cache=cache)
+        analyzer.analyze_file("input/test_6.py")
+        assert str(analyzer) == truth
+        graph = analyzer.graph
+        graphs.append([(graph.label(i), graph.lineno(i), graph.children(i)) for i in range(len(graph))])
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Hits rebuild the same graph from body summaries, without a syntax tree
+    assert graphs[0] == graphs[1] and analyzer.tree is None
+    assert set(cache.load(open("input/test_6.py").read(), "PythonCallTrace")) == {"function_defs", "bodies"}
+
+    cache.max_bytes = 0
+    cache.evict()
+    assert cache.load(open("input/test_6.py").read(), "PythonCallTrace") is None
+
+
+def test_update_file(tmp_path):
+    path = tmp_path / "edited.py"
+    write_diamond(path, 8)
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file(str(path))
+
+    source = path.read_text().replace("def level_3():\n", "def level_3():\n    print('edited')\n")
+    path.write_text(source)
+    analyzer.update_file(str(path))
+
+    fresh = PythonCallTrace()
+    fresh.analyze_file(str(path))
+    assert analyzer.visit_log == fresh.visit_log
+    assert len(analyzer.graph) == len(fresh.graph)
+    assert analyzer.last_update["changed"] == 1
+    assert analyzer.last_update["reused"] == 3
+    # Unchanged bodies keep their nodes, moved to their new lines
+    lines = [analyzer.graph.lineno(i) for i in range(len(analyzer.graph))]
+    assert lines == [fresh.graph.lineno(i) for i in range(len(fresh.graph))]
+
+    # Only the edited body is created again, not the bodies it calls
+    path.write_text(source.replace("def main():\n", "def main():\n    print('edited')\n"))
+    analyzer.update_file(str(path))
+    assert analyzer.last_update["invalidated"] == 1
+    assert analyzer.last_update["created"] < len(fresh.graph) // 100
+
+
+def test_update_file_recursion(tmp_path):
+    path = tmp_path / "recursive.py"
+    source = (
+        "def ping():\n    pong()\n\n"
+        "def pong():\n    if x:\n        ping()\n    helper()\n\n"
+        "def helper():\n    print('y')\n\n"
+        "def main():\n    ping()\n    helper()\n"
+    )
+
+    def nodes(analyzer):
+        graph = analyzer.graph
+        return [(graph.node_type(i), graph.label(i), graph.children(i)) for i in range(len(graph))]
+
+    for mode in ("off", "copy", "shared"):
+        path.write_text(source)
+        analyzer = PythonCallTrace(summary_mode=mode)
+        analyzer.analyze_file(str(path))
+
+        # The reused bodies of ping and pong hold the cut back into ping
+        path.write_text(source.replace("def main():\n", "def main():\n    print('edited')\n"))
+        analyzer.update_file(str(path))
+
+        fresh = PythonCallTrace(summary_mode=mode)
+        fresh.analyze_file(str(path))
+        assert analyzer.visit_log == fresh.visit_log
+        assert nodes(analyzer) == nodes(fresh)
+        assert str(analyzer) == str(fresh)
+
+
+def test_benchmark(tmp_path):
+    params = {"functions": 12, "fan_out": 2, "depth": 3, "class_depth": 2, "nesting": 2}
+    path = tmp_path / "synthetic.py"
+    path.write_text(benchmark.generate_program(**params))
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file(str(path))
+    assert "Class_1.__init__" in analyzer.visit_log
+
+    result = benchmark.run_scenario(params, repeat=1)
+    assert result["nodes"] == len(analyzer.graph)
+    assert result["visits"] == len(analyzer.visit_log) and result["peak_rss"] > result["peak_memory"]
+    assert benchmark.compare_results({"s": result}, {"s": result}) == []
+
+    slower = dict(result, simulate_seconds=result["simulate_seconds"] + 1, nodes=0)
+    assert len(benchmark.compare_results({"s": slower}, {"s": result})) == 2
+
+    result = benchmark.run_cache_benchmark(params, repeat=1)
+    assert result["hits"] == 1 and result["nodes"] == result["cold_nodes"] == len(analyzer.graph)
+    assert result["entry_bytes"] > 0
+
+
+def test_trace_stats(tmp_path):
+    path = tmp_path / "diamond.py"
+    write_diamond(path, 3)
+    stats = TraceStats()
+    exits = []
+    stats.subscribe("function_exit", lambda name, nodes: exits.append(name))
+    analyzer = PythonCallTrace(stats=stats)
+    analyzer.analyze_file(str(path))
+
+    report = stats.report()
+    assert set(report["phases"]) == {"parse", "definitions", "simulation"}
+    assert report["totals"]["simulations"] == 5
+    assert report["totals"]["replays"] == 3
+    assert exits == ["level_0", "level_1", "level_2", "level_3", "main"]
+    by_name = {f["name"]: f for f in report["functions"]}
+    assert by_name["main"]["nodes"] == len(analyzer.graph) - 3
+    assert report["functions"][0]["name"] == "main"
+
+
+def test_deferred_labels():
+    stats = TraceStats()
+    analyzer = PythonCallTrace(stats=stats)
+    analyzer.analyze_file("input/test_3.py")
+    assert stats.unparse_calls == 0
+
+    loops = [node for node in map(analyzer.graph.node, range(len(analyzer.graph)))
+             if node.type == "LOOP_START"]
+    assert loops[0].label == "for _ in range(5):"
+    assert loops[1].label == "for (idx, stats) in enume..."
+    labels = [node.label for node in loops]
+    calls = stats.unparse_calls
+    assert [node.label for node in loops] == labels and stats.unparse_calls == calls
+
+    analyzer = PythonCallTrace(label_limits={"LOOP_START": None})
+    analyzer.analyze_file("input/test_3.py")
+    assert analyzer.graph.node(loops[1].index).label == "for (idx, stats) in enumerate(all_statistics):"
+
+
+def test_method_resolution_order(tmp_path):
+    path = tmp_path / "diamond_classes.py"
+    path.write_text(
+        "import shapes\n"
+        "class A:\n    def __init__(self):\n        pass\n    def run(self):\n        pass\n"
+        "class B(A):\n    pass\n"
+        "class C(A):\n    def run(self):\n        pass\n"
+        "class D(B, C):\n    pass\n"
+        "class E(shapes.D):\n    pass\n"
+        "class F(E, D):\n    pass\n"
+        "def main():\n    F()\n"
+    )
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file(str(path))
+
+    assert analyzer.class_mro("D") == ["D", "B", "C", "A"]
+    # shapes.D is another module's class, not the local D
+    assert analyzer.class_mro("E") == ["E", "shapes.D"]
+    assert analyzer.class_mro("F") == ["F", "E", "shapes.D", "D", "B", "C", "A"]
+    assert analyzer.lookup_method("D", "run") is analyzer.methods[("C", "run")]
+    assert analyzer.lookup_method("B", "__init__") is analyzer.methods[("A", "__init__")]
+    assert analyzer.visit_log == [
+        "main", "F", "A.__init__", "C.__init__", "B.__init__", "D.__init__",
+        "shapes.D.__init__", "E.__init__", "F.__init__",
+    ]
+
+
+def test_scoped_resolution(tmp_path):
+    path = tmp_path / "vehicles.py"
+    path.write_text(
+        "class Engine:\n"
+        "    def start(self):\n        print('engine')\n"
+        "    def run(self):\n        self.start()\n"
+        "class Car:\n"
+        "    def __init__(self):\n        self.engine = Engine()\n"
+        "    def start(self):\n        helper()\n"
+        "    def drive(self, engine: Engine):\n        self.start()\n        engine.run()\n"
+        "def helper():\n"
+        "    def helper():\n        print('inner')\n"
+        "    helper()\n"
+        "def start():\n    print('module start')\n"
+        "def main():\n"
+        "    car = Car()\n    car.drive(None)\n    unknown.start()\n    start()\n"
+    )
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file(str(path))
+
+    assert "vehicles.helper.<locals>.helper" in analyzer.symbols.symbols
+    assert analyzer.visit_log == [
+        "main", "Car", "Car.__init__", "Engine", "Engine.__init__",
+        "Car.drive", "Car.start", "helper", "helper", "print",
+        "Engine.run", "Engine.start", "print", "start", "start", "print",
+    ]
+
+
+def test_budgets(tmp_path):
+    path = tmp_path / "diamond.py"
+    write_diamond(path, 12)
+
+    analyzer = PythonCallTrace(budget=TraceBudget(max_nodes=100))
+    analyzer.analyze_file(str(path))
+    assert len(analyzer.graph) == 102
+    assert [node.type for node in analyzer.end_node.parents] == ["TRUNCATED"]
+    assert analyzer.truncation_report()[0]["reason"] == "nodes"
+
+    analyzer = PythonCallTrace(budget=TraceBudget(max_depth=3))
+    analyzer.analyze_file(str(path))
+    assert analyzer.visit_log == [
+        "main", "level_12", "level_11", "level_10", "level_10",
+        "level_11", "level_10", "level_10",
+    ]
+    assert analyzer.truncation_report() == [
+        {"reason": "depth", "function": "level_10", "count": 4, "first_node": 5}
+    ]
+
+    analyzer = PythonCallTrace(budget=TraceBudget(max_expansions=1))
+    analyzer.analyze_file(str(path))
+    assert analyzer.visit_log.count("level_0") == 2
+    assert analyzer.visit_log.count("print") == 1
+    assert len(analyzer.truncation_report()) == 12
+
+
+def test_full_coverage(tmp_path):
+    path = tmp_path / "statements.py"
+    path.write_text(
+        "async def fetch():\n"
+        "    await sleep()\n"
+        "\n"
+        "def main():\n"
+        "    total = 0\n"
+        "    total += compute()\n"
+        "    with open_file() as f:\n"
+        "        process(f)\n"
+        "    try:\n"
+        "        risky()\n"
+        "    except ValueError:\n"
+        "        recover()\n"
+        "    finally:\n"
+        "        close()\n"
+        "    match command():\n"
+        "        case \"run\":\n"
+        "            run()\n"
+        "    result = sorted(data, key=lambda v: weight(v))\n"
+        "    run_async(fetch())\n"
+    )
+    legacy = PythonCallTrace()
+    legacy.analyze_file(str(path))
+    assert legacy.visit_log == ["main", "sorted", "fetch", "run_async"]
+
+    full = PythonCallTrace(coverage="full")
+    full.analyze_file(str(path))
+    assert full.visit_log == [
+        "main", "compute", "open_file", "process", "risky", "recover", "close",
+        "command", "run", "weight", "sorted", "fetch", "sleep", "run_async",
+    ]
+    conditions = [full.graph.node(i) for i in range(len(full.graph))
+                  if full.graph.node_type(i) == "CONDITION"]
+    assert [node.label for node in conditions] == ["try:", "match command()..."]
+
+    lazy = PythonCallTrace(coverage="full", lazy=True)
+    lazy.analyze_file(str(path))
+    lazy.expand_all()
+    assert sorted(lazy.visit_log) == sorted(full.visit_log) and len(lazy.graph) == len(full.graph)
+
+    # Calls made when a statement runs, one construct per case
+    cases = {
+        "@trace\n    @app.route(path())\n    def handler():\n        pass": ["path", "route", "trace", "log"],
+        "def handler(x=default(), *, y=other()):\n        pass": ["default", "other"],
+        "class Local(make_base(), metaclass=meta()):\n        pass": ["make_base", "meta"],
+        "del table[slot()], holder(h()).field": ["slot", "h", "holder"],
+        "items[index()] = value()": ["value", "index"],
+        "obj.attr(arg()).y = 1": ["arg", "attr"],
+        "cache[key()] += more()": ["key", "more"],
+    }
+    for statement, calls in cases.items():
+        tracer = PythonCallTrace(coverage="full")
+        tracer.analyze_source(f"def trace(func):\n    log()\n\ndef main():\n    {statement}\n")
+        assert tracer.visit_log == ["main"] + calls, statement
+
+
+def test_lazy_expansion(tmp_path):
+    path = tmp_path / "diamond.py"
+    write_diamond(path, 6)
+    eager = PythonCallTrace(summary_mode="off")
+    eager.analyze_file(str(path))
+
+    lazy = PythonCallTrace(lazy=True)
+    lazy.analyze_file(str(path))
+    assert lazy.visit_log == ["main"] and len(lazy.graph) == 3
+    calls = [(depth, node.label) for depth, node in lazy.walk_calls(max_depth=2)]
+    assert calls == [(0, "main"), (1, "level_6"), (2, "level_5"), (2, "level_5")]
+    assert len(lazy.graph.collapsed) == 2
+
+    def labels(node, seen):
+        if node.index in seen:
+            return []
+        seen.add(node.index)
+        return [node.label] + [label for child in node.children for label in labels(child, seen)]
+
+    # Iterating children expands the rest into the same graph as an eager trace
+    assert labels(lazy.entry_node, set()) == labels(eager.entry_node, set())
+    assert not lazy.graph.collapsed and len(lazy.graph) == len(eager.graph)
+    assert sorted(lazy.visit_log) == sorted(eager.visit_log)
+
+    # Exports expand collapsed nodes as they reach them
+    expected = export_graph(eager.entry_node, io.StringIO(), "jsonl")
+    for fmt in ("jsonl", "binary"):
+        lazy = PythonCallTrace(lazy=True)
+        lazy.analyze_file(str(path))
+        if fmt == "binary":
+            assert export_file(lazy.entry_node, str(tmp_path / "lazy.pctg")) == expected
+        else:
+            assert export_graph(lazy.entry_node, io.StringIO(), fmt) == expected
+        assert not lazy.graph.collapsed
+
+
+def test_trace_server(tmp_path):
+    source = open("input/test_1.py").read()
+    expected = PythonCallTrace()
+    expected.analyze_file("input/test_1.py")
+    socket_path = str(tmp_path / "trace.sock")
+
+    async def post(payload):
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        body = json.dumps(payload).encode()
+        writer.write(b"POST /trace HTTP/1.1\r\nConnection: close\r\n")
+        writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+        response = await reader.read()
+        writer.close()
+        head, _, chunks = response.partition(b"\r\n\r\n")
+        lines = [json.loads(line) for line in chunks.split(b"\r\n") if line.startswith(b"{")]
+        return head.split(b"\r\n")[0], lines
+
+    async def scenario():
+        async with TraceServer(workers=1) as server:
+            await server.start(unix_path=socket_path)
+            status, reports = await post([{"source": source, "id": i} for i in range(3)])
+            assert status == b"HTTP/1.1 200 OK"
+            assert sorted(report["id"] for report in reports) == [0, 1, 2]
+            assert all(report["visit_log"] == expected.visit_log for report in reports)
+            assert sum(report["cache_hit"] for report in reports) == 2
+
+            status, reports = await post({"path": "input/test_2.py", "graph": "jsonl"})
+            assert reports[0]["error"] is None and reports[0]["graph"].startswith('{"kind": "node"')
+            status, reports = await post({"path": "input/test_2.py", "source": source})
+            assert status == b"HTTP/1.1 400 Bad Request"
+            for bad in ({"label_limit": 2.5}, {"stats_top": True}, {"max_depth": 1.0}):
+                status, reports = await post(dict(bad, path="input/test_2.py"))
+                assert status == b"HTTP/1.1 400 Bad Request"
+
+    asyncio.run(scenario())
+
+
+def test_compaction(tmp_path):
+    path = tmp_path / "compact.py"
+    path.write_text("\n".join([
+        "def helper():", "    print('a')", "    print('a')", "    print('b')", "",
+        "def main():", "    if x:", "        pass", "    for i in items:", "        y = 1",
+        "    if y:", "        helper()", "    else:", "        helper()", "    helper()", "",
+    ]))
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file(str(path))
+    sizes = [len(compact_graph(analyzer.entry_node, level).graph) for level in range(4)]
+    assert sizes == [len(analyzer.graph), 17, 8, 7]
+
+    entry = compact_graph(analyzer.entry_node)
+    labels = [entry.graph.label(i) for i in range(len(entry.graph))]
+    assert labels.count("helper, print x3 (4 calls)") == 2
+    condition = entry.children[0].children[0]
+    assert condition.label == "if y:" and len(condition.children) == 1
+
+    # Low-memory traces keep their spans and files
+    low = PythonCallTrace(low_memory=True)
+    low.analyze_file(str(path))
+    entry = compact_graph(low.entry_node)
+    assert entry.graph.low_memory and entry.graph.files == [str(path)]
+    conditions = [i for i in range(len(entry.graph)) if entry.graph.node_type(i) == "CONDITION"]
+    assert entry.graph.lineno(conditions[0]) == 11 and entry.graph.snippet(conditions[0]).startswith("if y:")
+
+    # Branches in a different order are not merged
+    graph = FlowGraph()
+    entry, end = graph.add_node("ENTRY", "entry"), graph.add_node("END", "end")
+    first, second = graph.add_node("FUNCTION", "a"), graph.add_node("FUNCTION", "b")
+    for order in ((first, second), (second, first)):
+        condition = graph.add_node("CONDITION", "if x:")
+        graph.add_edge(entry, condition)
+        for branch in order:
+            graph.add_edge(condition, branch)
+    graph.add_edge(first, end)
+    graph.add_edge(second, end)
+    assert len(compact_graph(graph.node(entry)).graph) == 6
+
+
+def test_binary_graph(tmp_path):
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file("input/test_4.py")
+    path = str(tmp_path / "test_4.pctg")
+    counts = export_file(analyzer.entry_node, path)
+
+    expected, loaded = io.StringIO(), io.StringIO()
+    export_graph(compact_graph(analyzer.entry_node, 0), expected, "jsonl")
+    with load_graph(path) as graph:
+        assert counts == {"nodes": len(graph), "edges": len(graph.child_ids)}
+        assert graph.metadata == {"name": "flow"}
+        export_graph(graph.entry, loaded, "jsonl")
+        end = graph.end
+        assert end.type == "END" and end.children == []
+        assert end.span is None and graph.snippet(end.index) is None
+        assert all(end in parent.children for parent in end.parents)
+    assert loaded.getvalue() == expected.getvalue()
+
+
+def test_trace_diff(tmp_path):
+    old, new = PythonCallTrace(), PythonCallTrace()
+    old.analyze_source("\n".join([
+        "def helper():", "    print('a')", "    log()", "",
+        "def main():", "    setup()", "    if ready:", "        helper()", "    helper()", "    finish()",
+    ]))
+    new.analyze_source("\n".join([
+        "def helper():", "    print('a')", "    audit()", "    log()", "",
+        "def main():", "    setup()", "    if ready:", "        helper()", "    else:", "        fallback()",
+        "    helper()", "    cleanup()",
+    ]))
+    diff = diff_graphs(old.entry_node, new.entry_node)
+    changes = {(c["change"], c["label"], c["after"], c["count"]) for c in diff.changes()}
+    assert changes == {
+        ("added", "audit", "print", 2),
+        ("added", "fallback", "if ready:", 1),
+        ("added", "cleanup", "log", 1),
+        ("removed", "finish", "log", 1),
+    }
+    report = diff.report()
+    assert report["added"]["calls"] == 4 and report["removed"]["calls"] == 1
+    assert report["matched"] == report["old_nodes"] - 1
+    assert not diff_graphs(old.entry_node, old.entry_node).report()["changes"]
+
+    # Stored graphs are closed after the diff, and a closed pipe is not an error
+    paths = [str(tmp_path / "old.pctg"), str(tmp_path / "new.pctg")]
+    export_file(old.entry_node, paths[0])
+    export_file(new.entry_node, paths[1])
+    command = [sys.executable, "trace_diff.py", *paths, "--format", "json"]
+    result = subprocess.run(command, capture_output=True, text=True)
+    assert result.returncode == 1 and json.loads(result.stdout) == report
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdout.close()
+    assert process.wait() == 1 and process.stderr.read() == b""
+    process.stderr.close()
+
+
+def test_call_index():
+    index = build_call_index("input/test_6.py")
+    assert index.direct_callees("main") == [
+        "Animal.__init__", "Cat", "Cat.__init__", "Dog", "Dog.__init__", "animal_conversation",
+    ]
+    assert index.reachable("main", "speak") and not index.reachable("speak", "main")
+    assert index.shortest_path("main", "print") == ["main", "animal_conversation", "print"]
+    assert index.impact("print") == ["animal_conversation", "main"]
+    assert index.query("callers", "speak") == ["animal_conversation"]
+    # speak() is only called on objects of unknown type
+    assert index.uncalled() == ["Animal.speak", "Dog.speak", "Cat.speak"]
+
+    tracer = PythonCallTrace(lazy=True)
+    tracer.analyze_source("\n".join([
+        "def helper():", "    first()", "",
+        "def outer():", "    def helper():", "        second()", "    helper()", "",
+        "def main():", "    outer()",
+    ]))
+    index = CallIndex(tracer)
+    assert index.direct_callees("outer") == ["outer.<locals>.helper"]
+    assert index.direct_callees("outer.<locals>.helper") == ["second"]
+    assert "helper" not in index.callees and "first" not in index
+    assert index.uncalled() == ["helper"]
+
+    tracer = PythonCallTrace(lazy=True)
+    tracer.analyze_source("\n".join([
+        "def ping(n):", "    pong(n)", "", "def pong(n):", "    ping(n)", "",
+        "def unused():", "    pass", "", "def main():", "    ping(1)",
+    ]))
+    index = CallIndex(tracer)
+    assert index.reachable("pong", "ping") and index.impact("ping") == ["main", "ping", "pong"]
+    assert index.uncalled() == ["unused"]
+    assert index.shortest_path("ping", "main") is None
+
+
+def test_runtime_trace(tmp_path):
+    path = tmp_path / "program.py"
+    path.write_text(
+        "def numbers():\n"
+        "    yield 1\n"
+        "    yield 2\n"
+        "\n"
+        "def check(n):\n"
+        "    return n > 1\n"
+        "\n"
+        "def report(n):\n"
+        "    return abs(n)\n"
+        "\n"
+        "def main():\n"
+        "    for n in numbers():\n"
+        "        if check(n):\n"
+        "            report(n)\n"
+    )
+    runtime = RuntimeTrace()
+    entry, end = runtime.analyze_file(str(path))
+    assert runtime.visit_log == ["main", "numbers", "check", "check", "report", "abs"]
+    assert [node.label for node in entry.children] == ["main"] and end.type == "END"
+    assert len(runtime.graph) == 8 and runtime.complete
+
+    tracer = PythonCallTrace()
+    tracer.analyze_file(str(path))
+    report = runtime.compare(tracer.visit_log)
+    assert report["unpredicted"] == {"check": 2, "numbers": 1}
+    assert report["unexecuted"] == []
+    assert report["first_divergence"] == {"index": 1, "predicted": "report", "executed": "numbers"}
+
+    sampled = RuntimeTrace(sample=2, capacity=2)
+    sampled.analyze_file(str(path))
+    assert sampled.calls == 6 and sampled.recorded == 4 and sampled.visit_log == ["check", "abs"]
+    assert sampled.compare(tracer.visit_log)["unexecuted"] is None
+
+
+def test_hotness(tmp_path):
+    path = tmp_path / "loops.py"
+    path.write_text(
+        "SIZE = 4\n"
+        "\n"
+        "def inner(x):\n"
+        "    if x:\n"
+        "        hit()\n"
+        "    return [square(v) for v in range(3)]\n"
+        "\n"
+        "def outer():\n"
+        "    for i in range(SIZE):\n"
+        "        for j in [1, 2]:\n"
+        "            inner(j)\n"
+        "\n"
+        "def main():\n"
+        "    outer()\n"
+        "    while busy():\n"
+        "        outer()\n"
+    )
+    heat = estimate_file(str(path), default_trips=5, coverage="full")
+    # outer runs once plus 5 times in the while loop; each run makes 4 x 2 calls of inner
+    assert heat.hot_paths(2) == [
+        (["main", "outer", "inner", "square"], 144.0),
+        (["main", "outer", "inner"], 48.0),
+    ]
+    counts = heat.function_counts()
+    assert counts["outer"] == 6 and counts["hit"] == 24 and counts["busy"] == 5
+    assert len(heat.counts) == len(heat.tracer.graph)
+
+    builder = GraphBuilder("heat", heat.tracer, heat=heat)
+    builder.add_nodes_edges(heat.tracer.entry_node)
+    assert 'label=square fillcolor="0.000 0.900 1.000"' in builder.dot.source
+
+
+def test_paged_rendering(tmp_path):
+    tracer = PythonCallTrace(lazy=True)
+    tracer.analyze_source("\n".join([
+        "def a():", "    print(1)", "    print(2)", "",
+        "def b():", "    a()", "    a()", "    print(3)", "",
+        "def main():", "    b()", "    a()", "    b()",
+    ]))
+    paged = PagedGraph(tracer, page_size=6)
+    # Bodies stay whole; those that do not fit go to an overflow page
+    assert paged.page_bodies == [[1], [3, 6], [7], [4, 5], [15, 16]]
+    assert sum(len(nodes) for nodes in paged.pages) == len(tracer.graph)
+    assert all(len(nodes) <= 6 for nodes in paged.pages)
+
+    paths = paged.write(str(tmp_path / "pages"), "abc", render=False)
+    assert [p.rsplit("/", 1)[1] for p in paths] == [f"page_{i}.dot" for i in range(5)]
+    page = (tmp_path / "pages" / "page_1.dot").read_text()
+    assert 'subgraph cluster_3 {\n\t\tlabel="b"' in page
+    assert 'from_0_3 [label="page 0: b" URL="page_0.svg"' in page and "from_0_3 -> 6" in page
+    assert "7 -> to_2_11" in page
+    index = (tmp_path / "pages" / "index.html").read_text()
+    assert '<a href="page_3.svg">page 3</a></td><td>5</td><td>a, b</td>' in index
+
+
+def test_low_memory(tmp_path):
+    path = tmp_path / "spans.py"
+    path.write_text(
+        "def check(items):\n"
+        "    for item in items:\n"
+        "        if item > 1:\n"
+        "            print(item)\n"
+        "\n"
+        "def main():\n"
+        "    check([1, 2])\n"
+        "    check([3])\n"
+    )
+    full = PythonCallTrace()
+    full.analyze_file(str(path))
+    tracer = PythonCallTrace(low_memory=True)
+    tracer.analyze_file(str(path))
+    graph = tracer.graph
+    assert tracer.visit_log == full.visit_log and list(tracer.function_defs) == ["check", "main"]
+    assert tracer.tree is None and not graph.ast_nodes and not tracer.summaries
+    assert [graph.label(i) for i in range(len(graph))] == [full.graph.label(i) for i in range(len(graph))]
+    loops = [i for i in range(len(graph)) if graph.node_type(i) == "LOOP_START"]
+    # Both calls of check share the spans of its statements
+    assert len(loops) == 2 and graph.span(loops[0]) == graph.span(loops[1]) == (0, 2, 4, 4)
+    assert graph.files == [str(path)] and graph.lineno(loops[1]) == 2
+    assert graph.snippet(loops[0]).splitlines() == [
+        "for item in items:", "        if item > 1:", "            print(item)",
+    ]
+
+    # Bodies are released once summarized; K.f cannot be replayed while K.g
+    # is pending, so its body is parsed again at its original position
+    path.write_text(
+        "class K:\n"
+        "    def f(self):\n"
+        "        if self:\n"
+        "            self.g()\n"
+        "\n"
+        "    def g(self):\n"
+        "        self.f()\n"
+        "\n"
+        "def main():\n"
+        "    k = K()\n"
+        "    k.f()\n"
+        "    k.g()\n"
+    )
+    full = PythonCallTrace()
+    full.analyze_file(str(path))
+    tracer = PythonCallTrace(low_memory=True)
+    tracer.analyze_file(str(path))
+    assert tracer.visit_log == full.visit_log == ["main", "K", "K.__init__"] + ["K.f", "K.g"] * 3
+    conditions = [i for i in range(len(tracer.graph)) if tracer.graph.node_type(i) == "CONDITION"]
+    assert [tracer.graph.span(i) for i in conditions] == [(0, 3, 8, 4)] * 2
+
+
+def test_flow_graph_edges():
+    graph = FlowGraph()
+    condition = graph.node(graph.add_node("CONDITION", "if x:"))
+    branches = [graph.node(graph.add_node("FUNCTION", "print")) for _ in range(3)]
+    for branch in branches + branches:
+        condition.add_child(branch)
+
+    assert condition.children == branches
+    assert all(branch.parents == [condition] for branch in branches)
+    assert len(graph.more_edges) == 2
+    assert branches[0].label is branches[1].label
+
+
+def test_streaming_export():
+    analyzer = PythonCallTrace()
+    analyzer.analyze_file("input/test_4.py")
+    graph = GraphBuilder("test_4", analyzer)
+    graph.add_nodes_edges(analyzer.entry_node)
+
+    streams = {fmt: io.StringIO() for fmt in ("dot", "jsonl", "graphml")}
+    for fmt, stream in streams.items():
+        counts = export_graph(analyzer.entry_node, stream, fmt)
+        assert counts["nodes"] == len(graph.visited)
+
+    records = [json.loads(line) for line in streams["jsonl"].getvalue().splitlines()]
+    assert sum(record["kind"] == "edge" for record in records) == counts["edges"]
+    assert streams["dot"].getvalue().count(" -> ") == counts["edges"]
+    root = ElementTree.fromstring(streams["graphml"].getvalue())
+    assert len(root.findall(".//{http://graphml.graphdrawing.org/xmlns}edge")) == counts["edges"]
+
+
+def test_batch_cli(tmp_path):
+    report_file = tmp_path / "report.json"
+    broken = tmp_path / "broken.py"
+    broken.write_text("def main(:\n    pass\n")
+    status = cli.main([
+        "input/test_*.py", str(broken), "missing.py", "-j", "2", "-o", str(report_file),
+        "--graph-dir", str(tmp_path / "graphs"), "--graph-format", "jsonl",
+    ])
+    report = json.loads(report_file.read_text())
+    truths = open("truths.txt", "r").readlines()
+
+    assert status == 1
+    assert [entry["file"] for entry in report["files"]][-1] == "missing.py"
+    for i, entry in enumerate(report["files"][:-2]):
+        assert f"Visits: {entry['visit_log']}" == truths[2 * i + 1].strip()
+        # Graphs mirror the directories of the traced files
+        assert (tmp_path / "graphs" / "input" / f"test_{i + 1}.jsonl").exists()
+    # A file that fails does not stop the others
+    assert report["files"][-2]["error"] and report["files"][-1]["error"]
+    assert not any(entry["error"] for entry in report["files"][:-2])
@@ -0,0 +1,46 @@
+from typing import Optional
+
+# Reasons recorded on TRUNCATED nodes and in truncation reports
+TRUNCATION_REASONS = ("depth", "expansions", "nodes", "time")
+
+
+class TraceBudget:
+    """Limits on how much of a program a PythonCallTrace explores.
+
+    ``max_depth`` caps the number of nested function bodies and
+    ``max_expansions`` the number of times each function's body is expanded
+    (simulated or replayed); calls beyond them get a TRUNCATED node instead
+    of a body and the trace continues after them. ``max_nodes`` and
+    ``max_seconds`` bound the whole simulation: once either is exceeded a
+    TRUNCATED node is added where exploration stopped and the trace ends.
+    ``None`` disables a limit.
+    """
+
+    # Tasks run between two clock reads when max_seconds is set
+    CLOCK_INTERVAL = 256
+
+    def __init__(
+        self,
+        max_depth: Optional[int] = None,
+        max_nodes: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        max_expansions: Optional[int] = None,
+    ):
+        for name, value in (
+            ("max_depth", max_depth),
+            ("max_nodes", max_nodes),
+            ("max_seconds", max_seconds),
+            ("max_expansions", max_expansions),
+        ):
+            if value is not None and value < 0:
+                raise ValueError(f"{name} must not be negative")
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.max_expansions = max_expansions
+
+    def __repr__(self):
+        limits = ", ".join(
+            f"{name}={value}" for name, value in vars(self).items() if value is not None
+        )
+        return f"TraceBudget({limits})"
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+# Bump when the layout of cache entries changes
+FORMAT_VERSION = 4
+CACHE_DIR_ENV = "PYTHON_CALL_TRACE_CACHE"
+
+
+def default_cache_dir() -> str:
+    """Cache directory from the environment, else under the user's cache home"""
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "python-call-trace")
+
+
+def cache_key(source: str, fingerprint: str = "") -> str:
+    digest = hashlib.sha256()
+    digest.update(
+        f"{FORMAT_VERSION}:{sys.implementation.name}:{sys.version_info[:2]}:{fingerprint}\0".encode()
+    )
+    digest.update(source.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+
+class DefinitionCache:
+    """On-disk cache of traces: the names a module defines and the compact
+    summaries of the function bodies simulated from ``main``.
+
+    Entries are pickled dictionaries keyed by a hash of the source text, the
+    Python version (its grammar decides what the source means) and a tracer
+    fingerprint. No syntax tree is stored: unpickling one costs as much as
+    parsing the source again.
+    Each entry is one file; reading an entry refreshes its modification time
+    and the least recently used entries are evicted once the directory grows
+    beyond ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, source: str, fingerprint: str = "") -> str:
+        return cache_key(source, fingerprint)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pickle")
+
+    def load(self, source: str, fingerprint: str = "") -> Optional[Dict[str, Any]]:
+        """Cached entry for a source text, or None"""
+        path = self.path(self.key(source, fingerprint))
+        try:
+            with open(path, "rb") as file:
+                entry = pickle.load(file)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Truncated or incompatible entries are treated as missing
+            self.misses += 1
+            self.remove(path)
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def store(self, source: str, fingerprint: str, entry: Dict[str, Any]):
+        """Write an entry atomically, then evict old entries if over budget"""
+        try:
+            data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        except pickle.PicklingError:
+            return  # Entries that cannot be pickled are simply not cached
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, self.path(self.key(source, fingerprint)))
+        except OSError:
+            self.remove(tmp_path)
+            return
+        self.evict()
+
+    def remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".pickle"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pickle"):
+                self.remove(entry.path)
+
+
+class MemoryCache:
+    """In-process counterpart of DefinitionCache for long-running processes.
+
+    Entries stay unpickled and the ``max_entries`` most recently used are
+    kept. Loading a trace only reads its entry, so entries are shared
+    between loads.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, source: str, fingerprint: str = "") -> Optional[Dict[str, Any]]:
+        """Cached entry for a source text, or None"""
+        key = cache_key(source, fingerprint)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def store(self, source: str, fingerprint: str, entry: Dict[str, Any]):
+        key = cache_key(source, fingerprint)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
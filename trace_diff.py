@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import sys
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Any, Tuple, Iterator
+from flow_node import FlowNode
+from python_call_trace import PythonCallTrace
+from binary_graph import load_graph
+
+# Longest run of inserted or deleted straight-line nodes skipped when
+# re-aligning the flow after them
+LOOKAHEAD = 64
+# How node types are counted in diff reports
+CATEGORIES = {
+    "FUNCTION": "calls",
+    "CHAIN": "calls",
+    "CONDITION": "branches",
+    "LOOP_START": "branches",
+}
+
+
+def subgraph_hashes(entry: FlowNode) -> Tuple[List[int], Dict[int, int], Dict[int, int]]:
+    """Depth-first order, tree parents and subgraph hashes of the nodes
+    reachable from entry.
+
+    A node's hash covers its type, label and everything reachable from it,
+    so two nodes have equal hashes when the flow from them on is the same.
+    Components of the graph (loops) are hashed as a whole, from the sinks
+    up, using Tarjan's algorithm; line numbers are left out so that code
+    moving within a file does not change hashes.
+    """
+    graph = entry.graph
+    order: List[int] = []
+    tree_parents: Dict[int, int] = {}
+    hashes: Dict[int, int] = {}
+    number: Dict[int, int] = {}
+    low: Dict[int, int] = {}
+    stack: List[int] = []
+    on_stack = set()
+
+    def key(index: int) -> Tuple[str, str]:
+        return graph.node_type(index), graph.label(index)
+
+    number[entry.index] = low[entry.index] = 0
+    order.append(entry.index)
+    stack.append(entry.index)
+    on_stack.add(entry.index)
+    # The path being explored and the next child to visit at each step; kept
+    # as plain ints since a stack of iterators is slow to garbage collect
+    work = [entry.index]
+    positions = [0]
+    while work:
+        index = work[-1]
+        children = graph.children(index)
+        position = positions[-1]
+        if position < len(children):
+            positions[-1] = position + 1
+            child = children[position]
+            if child not in number:
+                number[child] = low[child] = len(order)
+                order.append(child)
+                tree_parents[child] = index
+                stack.append(child)
+                on_stack.add(child)
+                work.append(child)
+                positions.append(0)
+            elif child in on_stack:
+                low[index] = min(low[index], number[child])
+            continue
+        work.pop()
+        positions.pop()
+        if work:
+            parent = work[-1]
+            low[parent] = min(low[parent], low[index])
+        if low[index] != number[index]:
+            continue
+
+        members = []
+        while True:
+            node = stack.pop()
+            on_stack.discard(node)
+            members.append(node)
+            if node == index:
+                break
+        if len(members) == 1 and index not in graph.children(index):
+            hashes[index] = hash((key(index), tuple(hashes[c] for c in graph.children(index))))
+            continue
+        inside = set(members)
+        component = hash((
+            tuple(sorted(key(i) for i in members)),
+            tuple(sorted(hashes[c] for i in members for c in graph.children(i) if c not in inside)),
+        ))
+        for node in members:
+            hashes[node] = hash((key(node), component))
+    return order, tree_parents, hashes
+
+
+class TraceDiff:
+    """Matching between the nodes of two flow graphs of the same program.
+
+    Nodes are matched in three passes. Nodes whose subgraph hash occurs
+    once in each graph are matched outright. The children of matched pairs
+    are then paired top-down, first by hash and then by type and label,
+    preferring nodes of the same line. Children left over are re-aligned by
+    skipping up to LOOKAHEAD straight-line nodes on either side, which is
+    where calls were inserted or removed. Every step is linear in the size
+    of the graphs apart from the short lookahead.
+
+    Nodes of the old graph left unmatched were removed, those of the new
+    graph were added.
+    """
+
+    def __init__(self, old: FlowNode, new: FlowNode, lookahead: int = LOOKAHEAD):
+        self.old = old
+        self.new = new
+        self.lookahead = lookahead
+        self.old_order, self.old_parents, self.old_hashes = subgraph_hashes(old)
+        self.new_order, self.new_parents, self.new_hashes = subgraph_hashes(new)
+        self.matches: Dict[int, int] = {}  # Old node -> new node
+        self.matched: Dict[int, int] = {}  # New node -> old node
+        self.work: List[Tuple[int, int]] = []
+        self.match()
+        self.removed = [i for i in self.old_order if i not in self.matches]
+        self.added = [i for i in self.new_order if i not in self.matched]
+
+    def pair(self, old: int, new: int):
+        self.matches[old] = new
+        self.matched[new] = old
+        self.work.append((old, new))
+
+    def match(self):
+        old_graph, new_graph = self.old.graph, self.new.graph
+        self.pair(self.old.index, self.new.index)
+        unique: Dict[int, Optional[int]] = {}
+        for index in self.new_order:
+            h = self.new_hashes[index]
+            unique[h] = None if h in unique else index
+        seen: Dict[int, Optional[int]] = {}
+        for index in self.old_order:
+            h = self.old_hashes[index]
+            seen[h] = None if h in seen else index
+        for h, index in seen.items():
+            new = unique.get(h)
+            if index is not None and new is not None and index not in self.matches and new not in self.matched:
+                self.pair(index, new)
+
+        while self.work:
+            old, new = self.work.pop()
+            old_children = [c for c in old_graph.children(old) if c not in self.matches]
+            new_children = [c for c in new_graph.children(new) if c not in self.matched]
+            if not old_children or not new_children:
+                continue
+            self.pair_children(old_children, new_children, lambda o, n: self.old_hashes[o] == self.new_hashes[n])
+            self.pair_children(old_children, new_children, self.same_node)
+            if old_children and new_children:
+                self.realign(old_children, new_children)
+
+    def same_node(self, old: int, new: int) -> bool:
+        old_graph, new_graph = self.old.graph, self.new.graph
+        return (
+            old_graph.node_type(old) == new_graph.node_type(new)
+            and old_graph.label(old) == new_graph.label(new)
+        )
+
+    def pair_children(self, old_children: List[int], new_children: List[int], equal):
+        """Pair equal children in order, removing them from both lists"""
+        for new in list(new_children):
+            candidates = [old for old in old_children if equal(old, new)]
+            if not candidates:
+                continue
+            if len(candidates) > 1:
+                # Prefer the node of the same line (the same AST location)
+                line = self.new.graph.lineno(new)
+                candidates.sort(key=lambda old: self.old.graph.lineno(old) != line)
+            old_children.remove(candidates[0])
+            new_children.remove(new)
+            self.pair(candidates[0], new)
+
+    def realign(self, old_children: List[int], new_children: List[int]):
+        """Skip nodes inserted before or removed from the rest of the flow"""
+        for old in list(old_children):
+            for new in new_children:
+                found = self.scan(self.new.graph, new, self.matched, lambda n: self.same_node(old, n))
+                if found is not None:
+                    self.pair(old, found)
+                    break
+                found = self.scan(self.old.graph, old, self.matches, lambda o: self.same_node(o, new))
+                if found is not None:
+                    self.pair(found, new)
+                    new_children.remove(new)
+                    break
+
+    def scan(self, graph, start: int, matched: Dict[int, int], wanted) -> Optional[int]:
+        """First wanted node on the straight unmatched path after start"""
+        index = start
+        for _ in range(self.lookahead):
+            children = graph.children(index)
+            if len(children) != 1 or children[0] in matched:
+                return None
+            index = children[0]
+            if wanted(index):
+                return index
+        return None
+
+    def changes(self) -> List[Dict[str, Any]]:
+        """Added and removed nodes, grouped by type, label and preceding node.
+
+        ``after`` is the label of the closest matched node before the
+        change, in the new graph for additions and the old one for removals.
+        """
+        grouped: Dict[tuple, Dict[str, Any]] = {}
+        for change, graph, nodes, parents, matched in (
+            ("removed", self.old.graph, self.removed, self.old_parents, self.matches),
+            ("added", self.new.graph, self.added, self.new_parents, self.matched),
+        ):
+            anchors: Dict[int, Optional[int]] = {}
+            for index in nodes:
+                # Depth-first order puts a node's tree parent before it
+                parent = parents.get(index)
+                anchors[index] = parent if parent is None or parent in matched else anchors.get(parent)
+                anchor = anchors[index]
+                key = (change, graph.node_type(index), graph.label(index),
+                       None if anchor is None else graph.label(anchor))
+                entry = grouped.get(key)
+                if entry is None:
+                    entry = grouped[key] = {
+                        "change": change,
+                        "type": key[1],
+                        "label": key[2],
+                        "lineno": graph.lineno(index),
+                        "after": key[3],
+                        "count": 0,
+                    }
+                entry["count"] += 1
+        return list(grouped.values())
+
+    def report(self) -> Dict[str, Any]:
+        """Compact summary: sizes, counts per category and grouped changes"""
+        counts = {}
+        for change, graph, nodes in (
+            ("added", self.new.graph, self.added),
+            ("removed", self.old.graph, self.removed),
+        ):
+            counts[change] = {"calls": 0, "branches": 0, "other": 0}
+            for index in nodes:
+                counts[change][CATEGORIES.get(graph.node_type(index), "other")] += 1
+        return {
+            "old_nodes": len(self.old_order),
+            "new_nodes": len(self.new_order),
+            "matched": len(self.matches),
+            "added": counts["added"],
+            "removed": counts["removed"],
+            "changes": self.changes(),
+        }
+
+
+def diff_graphs(old: FlowNode, new: FlowNode, lookahead: int = LOOKAHEAD) -> TraceDiff:
+    """Match the graphs reachable from two entry nodes and find what changed.
+
+    Expand lazy traces first: collapsed nodes are compared as they are.
+    """
+    return TraceDiff(old, new, lookahead)
+
+
+@contextmanager
+def load_entry(path: str, summary_mode: str = "copy") -> Iterator[FlowNode]:
+    """Entry node of a stored binary graph, or of a fresh trace of a source
+    file; a stored graph is closed on exit"""
+    if path.endswith(".pctg"):
+        with load_graph(path) as graph:
+            yield graph.entry
+        return
+    tracer = PythonCallTrace(summary_mode=summary_mode)
+    tracer.analyze_file(path)
+    yield tracer.entry_node
+
+
+def format_changes(changes: List[Dict[str, Any]]) -> str:
+    lines = []
+    for change in changes:
+        sign = "+" if change["change"] == "added" else "-"
+        line = f"{sign} {change['type']} {change['label']}"
+        if change["after"] is not None:
+            line += f" (after {change['after']})"
+        if change["count"] > 1:
+            line += f" x{change['count']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare the flow graphs of two versions of a program."
+    )
+    parser.add_argument("old", help="old source file or .pctg graph")
+    parser.add_argument("new", help="new source file or .pctg graph")
+    parser.add_argument("-f", "--format", choices=("text", "json"), default="text",
+                        help="report format (default: text)")
+    parser.add_argument("--lookahead", type=int, default=LOOKAHEAD,
+                        help=f"inserted or removed nodes skipped to re-align flows (default: {LOOKAHEAD})")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the differences; exits with 1 if there are any, like diff"""
+    args = parse_args(argv)
+    with load_entry(args.old) as old, load_entry(args.new) as new:
+        diff = diff_graphs(old, new, args.lookahead)
+        # Reports read labels from the graphs, so they are built while open
+        if args.format == "json":
+            output = json.dumps(diff.report(), indent=2)
+        else:
+            output = format_changes(diff.changes()) if diff.added or diff.removed else None
+    try:
+        if output is not None:
+            print(output)
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader went away, e.g. piped into head: drop the rest quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    return 1 if diff.added or diff.removed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
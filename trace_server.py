@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Any, Tuple
+from python_call_trace import SUMMARY_MODES, COVERAGE_MODES
+from trace_cache import MemoryCache
+from exporters import WRITERS
+from compaction import COMPACTION_LEVELS
+from main import trace_file, BUDGET_OPTIONS
+
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 16 * 2 ** 20
+# Fields of a trace request besides "path", "source", "id" and "graph"
+REQUEST_OPTIONS = ("summary_mode", "coverage", "stats", "stats_top", "label_limit", "compact") + BUDGET_OPTIONS
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    501: "Not Implemented",
+}
+
+# Parsed modules and summaries kept by each worker process between requests
+worker_cache: Optional[MemoryCache] = None
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def init_worker(max_entries: int):
+    global worker_cache
+    worker_cache = MemoryCache(max_entries)
+
+
+def run_request(request: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """Trace one validated request; runs in a worker process"""
+    options = dict(defaults)
+    options.update((name, request[name]) for name in REQUEST_OPTIONS if name in request)
+    if request.get("graph"):
+        options["graph_inline"] = True
+        options["graph_format"] = request["graph"]
+    options["cache"] = worker_cache
+    hits = worker_cache.hits if worker_cache is not None else 0
+
+    report = trace_file(request.get("path", "<source>"), options, request.get("source"))
+    report["cache_hit"] = worker_cache is not None and worker_cache.hits > hits
+    if "id" in request:
+        report["id"] = request["id"]
+    return report
+
+
+def validate_request(request: Any) -> Dict[str, Any]:
+    """Check one trace request object, raising HTTPError(400) if invalid"""
+    if not isinstance(request, dict):
+        raise HTTPError(400, "Each trace request must be a JSON object")
+    unknown = set(request) - {"path", "source", "id", "graph"} - set(REQUEST_OPTIONS)
+    if unknown:
+        raise HTTPError(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    if ("path" in request) == ("source" in request):
+        raise HTTPError(400, "Give exactly one of 'path' and 'source'")
+    for field in ("path", "source"):
+        if field in request and not isinstance(request[field], str):
+            raise HTTPError(400, f"'{field}' must be a string")
+    if request.get("summary_mode", "copy") not in SUMMARY_MODES:
+        raise HTTPError(400, f"'summary_mode' must be one of {', '.join(SUMMARY_MODES)}")
+    if request.get("coverage", "legacy") not in COVERAGE_MODES:
+        raise HTTPError(400, f"'coverage' must be one of {', '.join(COVERAGE_MODES)}")
+    if request.get("graph") and request["graph"] not in WRITERS:
+        raise HTTPError(400, f"'graph' must be one of {', '.join(WRITERS)}")
+    if request.get("compact", 0) not in COMPACTION_LEVELS:
+        raise HTTPError(400, f"'compact' must be one of {', '.join(map(str, COMPACTION_LEVELS))}")
+    for name in ("stats_top", "label_limit") + BUDGET_OPTIONS:
+        value = request.get(name)
+        if value is None:
+            continue
+        # Only the time budget may be fractional; bool is an int subclass
+        kinds = (int, float) if name == "max_seconds" else int
+        if isinstance(value, bool) or not isinstance(value, kinds):
+            raise HTTPError(400, f"'{name}' must be {'a number' if name == 'max_seconds' else 'an integer'}")
+    return request
+
+
+async def read_request(
+    reader: asyncio.StreamReader, max_body: int = MAX_BODY_BYTES
+) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Method, target, headers and body of the next request, or None at EOF"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(501, "Chunked request bodies are not supported")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > max_body:
+        raise HTTPError(413, f"Request bodies are limited to {max_body} bytes")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method, target, headers, body
+
+
+def response_head(status: int, content_type: str, length: Optional[int] = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}"]
+    if length is None:
+        lines.append("Transfer-Encoding: chunked")
+    else:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def write_json(writer: asyncio.StreamWriter, status: int, data: Any, close: bool = False):
+    body = (json.dumps(data) + "\n").encode()
+    head = response_head(status, "application/json", len(body))
+    if close:
+        head = head[:-2] + b"Connection: close\r\n\r\n"
+    writer.write(head + body)
+
+
+def write_chunk(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+
+class TraceServer:
+    """Long-running tracer behind a minimal HTTP/1.1 API.
+
+    ``POST /trace`` takes one request object or a list of them and streams
+    one NDJSON report per request, in completion order, using chunked
+    encoding. ``GET /health`` describes the server. Traces run in a process
+    pool whose workers each keep a MemoryCache, so a source seen before by
+    a worker is neither parsed nor simulated again where its summaries can
+    be replayed. The same protocol is served over TCP or a Unix socket.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+        cache_entries: int = 256,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.defaults = defaults or {}
+        self.cache_entries = cache_entries
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self.served = 0
+        self.started = time.time()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, unix_path: Optional[str] = None
+    ) -> asyncio.AbstractServer:
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker, initargs=(self.cache_entries,)
+        )
+        # Start the workers before listening: forked later, they would inherit
+        # client sockets and keep connections open after the server closes them
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, os.getpid) for _ in range(self.workers)))
+        if unix_path:
+            self.server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    @property
+    def address(self) -> Any:
+        """Bound (host, port) or Unix socket path"""
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await asyncio.gather(*self.connections.values(), return_exceptions=True)
+            await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def __aenter__(self) -> "TraceServer":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the requests of one connection, keeping it open between them"""
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    await self.respond(method, target.split("?")[0], body, writer)
+                except HTTPError as error:
+                    # The rest of the request may be unread, so the connection ends here
+                    write_json(writer, error.status, {"error": error.message}, close=True)
+                    await writer.drain()
+                    break
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def respond(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if path == "/health":
+            if method != "GET":
+                raise HTTPError(405, "Use GET for /health")
+            write_json(writer, 200, {
+                "status": "ok",
+                "workers": self.workers,
+                "served": self.served,
+                "uptime": round(time.time() - self.started, 3),
+            })
+            await writer.drain()
+        elif path == "/trace":
+            if method != "POST":
+                raise HTTPError(405, "Use POST for /trace")
+            try:
+                payload = json.loads(body)
+            except ValueError as error:
+                raise HTTPError(400, f"Invalid JSON: {error}")
+            requests = payload if isinstance(payload, list) else [payload]
+            await self.stream_traces([validate_request(r) for r in requests], writer)
+        else:
+            raise HTTPError(404, f"No such endpoint {path}")
+
+    async def stream_traces(self, requests: List[Dict[str, Any]], writer: asyncio.StreamWriter):
+        """Run requests on the pool and write each report as it finishes"""
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(self.pool, run_request, request, self.defaults)
+            for request in requests
+        ]
+        writer.write(response_head(200, "application/x-ndjson"))
+        try:
+            for next_report in asyncio.as_completed(futures):
+                try:
+                    report = await next_report
+                except Exception as error:
+                    # Worker crashes are reported like any other failed trace
+                    report = {"error": f"{type(error).__name__}: {error}"}
+                self.served += 1
+                write_chunk(writer, (json.dumps(report) + "\n").encode())
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serve traces over HTTP on a TCP port or a Unix socket."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"TCP port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--summary-mode", choices=SUMMARY_MODES, default="copy",
+                        help="default replay mode of requests (default: copy)")
+    parser.add_argument("--cache-entries", type=int, default=256,
+                        help="sources kept warm by each worker (default: 256)")
+    return parser.parse_args(argv)
+
+
+async def serve(args: argparse.Namespace):
+    server = TraceServer(max(1, args.workers), {"summary_mode": args.summary_mode}, args.cache_entries)
+    async with server:
+        await server.start(args.host, args.port, args.unix)
+        print(f"Serving traces on {args.unix or '%s:%d' % server.address[:2]}", file=sys.stderr)
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await stop.wait()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
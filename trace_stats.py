@@ -0,0 +1,119 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Callable, Any, Iterator
+
+# Events that callbacks can subscribe to, and the arguments they receive
+EVENTS = {
+    "phase": "(phase name, seconds)",
+    "function_enter": "(function name)",
+    "function_exit": "(function name, nodes produced)",
+    "summary_replay": "(function name, nodes produced)",
+    "recursion_cut": "(function name)",
+    "unparse": "(AST node)",
+}
+
+
+class FunctionStats:
+    """Counters for one function, by the name it is called with"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.simulations = 0  # Bodies simulated statement by statement
+        self.replays = 0  # Bodies replayed from a summary
+        self.cuts = 0  # Recursive calls that were not expanded
+        self.nodes = 0  # Flow nodes produced, including those of callees
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "simulations": self.simulations,
+            "replays": self.replays,
+            "cuts": self.cuts,
+            "nodes": self.nodes,
+        }
+
+
+class TraceStats:
+    """Opt-in timers, counters and callbacks for a PythonCallTrace.
+
+    Pass an instance as ``PythonCallTrace(stats=...)``; the tracer only
+    pays for instrumentation when one is given. Phase times accumulate over
+    repeated runs of the same phase.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.functions: Dict[str, FunctionStats] = {}
+        self.unparse_calls = 0
+        self.callbacks: Dict[str, List[Callable[..., Any]]] = {}
+        self.active: List[str] = []  # Names of the bodies being simulated
+
+    def subscribe(self, event: str, callback: Callable[..., Any]):
+        """Call `callback` with the event's arguments whenever it happens"""
+        if event not in EVENTS:
+            raise ValueError(f"Unknown event {event!r}, expected one of {tuple(EVENTS)}")
+        self.callbacks.setdefault(event, []).append(callback)
+
+    def emit(self, event: str, *args):
+        for callback in self.callbacks.get(event, ()):
+            callback(*args)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as part of a phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.emit("phase", name, seconds)
+
+    def function(self, name: str) -> FunctionStats:
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats(name)
+        return stats
+
+    def function_entered(self, name: str):
+        self.function(name).simulations += 1
+        self.active.append(name)
+        self.emit("function_enter", name)
+
+    def function_exited(self, nodes: int):
+        name = self.active.pop()
+        self.function(name).nodes += nodes
+        self.emit("function_exit", name, nodes)
+
+    def summary_replayed(self, name: str, nodes: int):
+        stats = self.function(name)
+        stats.replays += 1
+        stats.nodes += nodes
+        self.emit("summary_replay", name, nodes)
+
+    def recursion_cut(self, name: str):
+        self.function(name).cuts += 1
+        self.emit("recursion_cut", name)
+
+    def unparsed(self, node):
+        self.unparse_calls += 1
+        self.emit("unparse", node)
+
+    def report(self, top: int = 0) -> Dict[str, Any]:
+        """Structured summary; functions are sorted by nodes produced.
+
+        ``top`` limits the number of functions listed (0 lists all).
+        """
+        functions = sorted(self.functions.values(), key=lambda f: (-f.nodes, f.name))
+        if top:
+            functions = functions[:top]
+        return {
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "totals": {
+                "simulations": sum(f.simulations for f in self.functions.values()),
+                "replays": sum(f.replays for f in self.functions.values()),
+                "cuts": sum(f.cuts for f in self.functions.values()),
+                "unparse_calls": self.unparse_calls,
+            },
+            "functions": [f.as_dict() for f in functions],
+        }